@@ -0,0 +1,167 @@
+from flask import g, has_request_context, request
+from src.models.admin_models import db, AdminAuditLog
+from sqlalchemy import insert
+from collections import deque
+from datetime import date, datetime
+from enum import Enum
+import atexit
+import threading
+import time
+
+MUTATING_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+def _json_value(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def transition_before(obj):
+    """Status and version a conditional status UPDATE replaced, taken from the row it returned.
+    
+    The UPDATE copies the old status into previous_status and bumps version by
+    exactly one, so no separate read is needed that a concurrent write could slip past.
+    """
+    return {'status': _json_value(obj.previous_status), 'version': obj.version - 1}
+
+def state_of(obj, *fields):
+    return {field: _json_value(getattr(obj, field)) for field in fields}
+
+class AuditLog:
+    """Buffered writer for admin_audit_log.
+    
+    record() only appends to an in-process deque; a daemon thread inserts the
+    buffer in one executemany every AUDIT_FLUSH_SECONDS, or sooner once
+    AUDIT_FLUSH_BATCH entries are waiting, so a write request pays for a list
+    append instead of an extra INSERT. Mutating requests that record nothing
+    themselves get a generic entry from an after_request hook. Entries still
+    buffered when the process exits are flushed by an atexit hook; a hard kill
+    loses at most one flush interval.
+    """
+    
+    def __init__(self, app=None):
+        self.app = None
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self.flushed = 0
+        self.dropped = 0
+        self.last_flush_ms = None
+        self.last_error = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('AUDIT_FLUSH_SECONDS', 1.0)
+        app.config.setdefault('AUDIT_FLUSH_BATCH', 200)
+        # Oldest entries are dropped (and counted) beyond this while the database is unavailable
+        app.config.setdefault('AUDIT_MAX_BUFFER', 50000)
+        # High-rate telemetry endpoints that are not admin actions
+        app.config.setdefault('AUDIT_EXCLUDED_ENDPOINTS', {'captain.ingest_captain_locations'})
+        self.app = app
+        self.flush_seconds = app.config['AUDIT_FLUSH_SECONDS']
+        self.flush_batch = app.config['AUDIT_FLUSH_BATCH']
+        self.max_buffer = app.config['AUDIT_MAX_BUFFER']
+        app.after_request(self._audit_request)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+            self._thread.start()
+            atexit.register(self._flush_at_exit)
+        app.extensions['audit_log'] = self
+    
+    def record(self, action, entity_type=None, entity_id=None, before=None, after=None, admin_id=None):
+        entry = {
+            'admin_id': admin_id,
+            'action': action,
+            'entity_type': entity_type,
+            'entity_id': entity_id,
+            'before': before,
+            'after': after,
+            'method': None,
+            'path': None,
+            'ip_address': None,
+            'created_at': datetime.utcnow()
+        }
+        if has_request_context():
+            current_admin = g.get('current_admin')
+            if admin_id is None and current_admin is not None:
+                entry['admin_id'] = current_admin.admin_id
+            entry['method'] = request.method
+            entry['path'] = request.path[:255]
+            entry['ip_address'] = request.remote_addr
+            g.audit_recorded = True
+        with self._condition:
+            self._buffer.append(entry)
+            if len(self._buffer) > self.max_buffer:
+                self._buffer.popleft()
+                self.dropped += 1
+            if len(self._buffer) >= self.flush_batch:
+                self._condition.notify()
+    
+    def _audit_request(self, response):
+        if (request.method in MUTATING_METHODS and 200 <= response.status_code < 300
+                and g.get('current_admin') is not None and not g.get('audit_recorded')
+                and request.endpoint not in self.app.config['AUDIT_EXCLUDED_ENDPOINTS']):
+            self.record(request.endpoint or 'unknown', after={'status_code': response.status_code})
+        return response
+    
+    def flush(self):
+        """Insert everything buffered so far, returns the number of entries written."""
+        with self._condition:
+            rows = list(self._buffer)
+            self._buffer.clear()
+        if not rows:
+            return 0
+        started = time.perf_counter()
+        try:
+            # Own connection and transaction, independent of any request session
+            with db.engine.begin() as connection:
+                connection.execute(insert(AdminAuditLog.__table__), rows)
+        except Exception as e:
+            self.last_error = str(e)
+            with self._condition:
+                self._buffer.extendleft(reversed(rows))
+                while len(self._buffer) > self.max_buffer:
+                    self._buffer.popleft()
+                    self.dropped += 1
+            raise
+        self.flushed += len(rows)
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 3)
+        self.last_error = None
+        return len(rows)
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._buffer) < self.flush_batch:
+                    self._condition.wait(self.flush_seconds)
+            if not self._buffer:
+                continue
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    self.app.logger.exception('Audit log flush failed')
+                    time.sleep(self.flush_seconds)
+    
+    def _flush_at_exit(self):
+        if self.app is not None and self._buffer:
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    pass
+    
+    def stats(self):
+        with self._condition:
+            buffered = len(self._buffer)
+        return {
+            'buffered': buffered,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'last_flush_ms': self.last_flush_ms,
+            'last_error': self.last_error
+        }
+
+audit_log = AuditLog()
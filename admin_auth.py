@@ -1,6 +1,7 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, g, current_app
 from werkzeug.security import check_password_hash, generate_password_hash
-from src.models.admin_models import db, Admin
+from src.models.admin_models import db, Admin, AdminAuditLog
+from src.routes.admin_audit import audit_log
 import jwt
 import datetime
 from functools import wraps
@@ -27,6 +28,8 @@ def token_required(f):
         except:
             return jsonify({'message': 'Token is invalid'}), 401
         
+        # Actor of the admin_audit_log entries written during this request
+        g.current_admin = current_admin
         return f(current_admin, *args, **kwargs)
     return decorated
 
@@ -98,6 +101,7 @@ def create_admin():
         
         db.session.add(new_admin)
         db.session.commit()
+        audit_log.record('admin.create', 'admin', new_admin.admin_id, after={'name': name, 'email': email})
         
         return jsonify({
             'message': 'Admin created successfully',
@@ -107,3 +111,55 @@ def create_admin():
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Failed to create admin: {str(e)}'}), 500
+
+@admin_auth_bp.route('/admin/audit-log', methods=['GET'])
+@token_required
+def get_audit_log(current_admin):
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        before_id = request.args.get('before_id')
+        admin_id = request.args.get('admin_id')
+        action = request.args.get('action')
+        entity_type = request.args.get('entity_type')
+        entity_id = request.args.get('entity_id')
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        
+        # Entries still in this worker's buffer show up right away; best effort, the reader does not wait
+        # on a failing write, the background flush keeps retrying them
+        try:
+            audit_log.flush()
+        except Exception:
+            current_app.logger.warning('Audit log flush before read failed', exc_info=True)
+        
+        # Newest first by audit_id, each filter combination is served by one of the (column, audit_id) indexes
+        query = AdminAuditLog.query
+        if entity_type:
+            query = query.filter(AdminAuditLog.entity_type == entity_type)
+            if entity_id:
+                query = query.filter(AdminAuditLog.entity_id == int(entity_id))
+        if admin_id:
+            query = query.filter(AdminAuditLog.admin_id == int(admin_id))
+        if action:
+            query = query.filter(AdminAuditLog.action == action)
+        if date_from:
+            query = query.filter(AdminAuditLog.created_at >= datetime.datetime.fromisoformat(date_from))
+        if date_to:
+            query = query.filter(AdminAuditLog.created_at <= datetime.datetime.fromisoformat(date_to))
+        if before_id:
+            query = query.filter(AdminAuditLog.audit_id < int(before_id))
+        
+        entries = query.order_by(AdminAuditLog.audit_id.desc()).limit(limit + 1).all()
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        
+        return jsonify({
+            'entries': [entry.to_dict() for entry in entries],
+            'next_before_id': entries[-1].audit_id if has_more else None,
+            'buffer': audit_log.stats()
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch audit log: {str(e)}'}), 500
@@ -1,8 +1,23 @@
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql import Select
 from datetime import datetime
 from enum import Enum
+import json
 
-db = SQLAlchemy()
+class RoutingSession(Session):
+    """Session that sends plain SELECTs of read-routed requests to the 'read' bind (see read_routing)."""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_request_context()
+                and g.get('db_route') == 'read' and (clause is None or isinstance(clause, Select))):
+            read_engine = self._db.engines.get('read')
+            if read_engine is not None:
+                return read_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Enums for status fields
 class UserStatus(Enum):
@@ -37,6 +52,8 @@ class BookingStatus(Enum):
     COMPLETED = "Completed"
     CANCELLED = "Cancelled"
     DISPUTED = "Disputed"
+    # Booked for later, moved to PENDING by the scheduled dispatcher when it is due
+    SCHEDULED = "Scheduled"
 
 class PaymentMethod(Enum):
     CASH = "Cash"
@@ -48,6 +65,36 @@ class PaymentStatus(Enum):
     FAILED = "Failed"
     REFUNDED = "Refunded"
 
+class JobStatus(Enum):
+    QUEUED = "Queued"
+    RUNNING = "Running"
+    COMPLETED = "Completed"
+    FAILED = "Failed"
+    EXPIRED = "Expired"
+
+class ChangeOperation(Enum):
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+
+class DurationMetric(Enum):
+    PICKUP_WAIT = "pickup_wait"
+    TRIP_DURATION = "trip_duration"
+
+class DiscrepancyType(Enum):
+    MISSING_PAYMENT = "MissingPayment"
+    AMOUNT_MISMATCH = "AmountMismatch"
+    REFUNDED_PAYMENT = "RefundedPayment"
+    FAILED_PAYMENT = "FailedPayment"
+
+class SweepAction(Enum):
+    CANCELLED = "Cancelled"
+    FLAGGED = "Flagged"
+
+class CohortType(Enum):
+    SIGNUP = "signup"
+    FIRST_BOOKING = "first_booking"
+
 class Admin(db.Model):
     __tablename__ = 'admins'
     
@@ -75,7 +122,7 @@ class AppUser(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     face_id_enabled = db.Column(db.Boolean, default=False)
     status = db.Column(db.Enum(UserStatus), default=UserStatus.ACTIVE)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship with bookings
@@ -108,10 +155,26 @@ class Captain(db.Model):
     plate_number = db.Column(db.String(20), unique=True)
     profile_image_url = db.Column(db.String(255))
     vehicle_image_url = db.Column(db.String(255))
-    rating = db.Column(db.Float, default=5.0)
+    # Mean of rating_sum / rating_count, maintained from booking ratings by captain_ratings
+    rating = db.Column(db.Float, default=5.0, index=True)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    # Exponentially decayed mean favouring recent trips, see captain_ratings
+    recent_rating = db.Column(db.Float, index=True)
+    recent_rating_sum = db.Column(db.Float, nullable=False, default=0.0)
+    recent_rating_weight = db.Column(db.Float, nullable=False, default=0.0)
     status = db.Column(db.Enum(CaptainStatus), default=CaptainStatus.PENDING)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Copied from status by every status UPDATE, so the statement itself reports the status it replaced
+    previous_status = db.Column(db.Enum(CaptainStatus))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Optimistic concurrency: bumped by every write, ORM flushes fail with StaleDataError on a mismatch
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (
+        # Status filter plus rating sort in get_captains
+        db.Index('ix_captains_status_rating', 'status', 'rating'),
+    )
     
     # Relationships
     rates = db.relationship('CaptainRate', backref='captain', lazy=True, cascade='all, delete-orphan')
@@ -131,9 +194,12 @@ class Captain(db.Model):
             'profile_image_url': self.profile_image_url,
             'vehicle_image_url': self.vehicle_image_url,
             'rating': self.rating,
+            'rating_count': self.rating_count,
+            'recent_rating': self.recent_rating,
             'status': self.status.value if self.status else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'version': self.version
         }
 
 class CaptainRate(db.Model):
@@ -162,10 +228,18 @@ class CaptainRate(db.Model):
 
 class Booking(db.Model):
     __tablename__ = 'bookings'
+    __table_args__ = (
+        # Range scan behind the scheduled dispatcher
+        db.Index('ix_bookings_status_scheduled_time', 'status', 'scheduled_time'),
+        # Range scan behind the stale booking sweeper
+        db.Index('ix_bookings_status_booking_time', 'status', 'booking_time'),
+        # Never reuse ids of rows moved to bookings_archive
+        {'sqlite_autoincrement': True}
+    )
     
     booking_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
-    captain_id = db.Column(db.Integer, db.ForeignKey('captains.captain_id'))
+    captain_id = db.Column(db.Integer, db.ForeignKey('captains.captain_id'), index=True)
     service_type = db.Column(db.Enum(ServiceType), nullable=False)
     status = db.Column(db.Enum(BookingStatus), default=BookingStatus.PENDING)
     pickup_location_lat = db.Column(db.Float, nullable=False)
@@ -180,13 +254,24 @@ class Booking(db.Model):
     payment_method = db.Column(db.Enum(PaymentMethod), nullable=False)
     app_commission = db.Column(db.Float)
     captain_earning = db.Column(db.Float)
-    booking_time = db.Column(db.DateTime, default=datetime.utcnow)
+    booking_time = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     scheduled_time = db.Column(db.DateTime)
-    start_time = db.Column(db.DateTime)
+    # Range scan behind captain_utilization
+    start_time = db.Column(db.DateTime, index=True)
     end_time = db.Column(db.DateTime)
     user_rating = db.Column(db.Integer)
     captain_rating = db.Column(db.Integer)
     notes = db.Column(db.Text)
+    # Set once the booking is included in a captain settlement batch
+    settlement_batch_id = db.Column(db.Integer, db.ForeignKey('settlement_batches.batch_id'), index=True)
+    # Set by the stale sweeper on in-progress bookings stuck past their threshold, cleared by a status change
+    stale_flagged_at = db.Column(db.DateTime)
+    # Copied from status by every status UPDATE, so the statement itself reports the status it replaced
+    previous_status = db.Column(db.Enum(BookingStatus))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Optimistic concurrency: bumped by every write, ORM flushes fail with StaleDataError on a mismatch
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
     
     # Relationship with payments
     payments = db.relationship('Payment', backref='booking', lazy=True)
@@ -217,15 +302,20 @@ class Booking(db.Model):
             'user_rating': self.user_rating,
             'captain_rating': self.captain_rating,
             'notes': self.notes,
+            'settlement_batch_id': self.settlement_batch_id,
+            'stale_flagged_at': self.stale_flagged_at.isoformat() if self.stale_flagged_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'version': self.version,
             'user_name': self.user.name if self.user else None,
             'captain_name': self.captain.name if self.captain else None
         }
 
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = {'sqlite_autoincrement': True}
     
     payment_id = db.Column(db.Integer, primary_key=True)
-    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.booking_id'), nullable=False)
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.booking_id'), nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     currency = db.Column(db.String(10), default='EGP')
     method = db.Column(db.Enum(PaymentMethod), nullable=False)
@@ -233,6 +323,8 @@ class Payment(db.Model):
     transaction_ref = db.Column(db.String(100))
     payment_date = db.Column(db.DateTime, default=datetime.utcnow)
     processed_by = db.Column(db.Integer, db.ForeignKey('admins.admin_id'))
+    # Lets incremental reconciliation find payments changed since its last run
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     def to_dict(self):
         return {
@@ -246,3 +338,560 @@ class Payment(db.Model):
             'payment_date': self.payment_date.isoformat() if self.payment_date else None,
             'processed_by': self.processed_by
         }
+
+class ArchivedBooking(db.Model):
+    """Completed/cancelled bookings moved out of the hot bookings table."""
+    __tablename__ = 'bookings_archive'
+    
+    booking_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False, index=True)
+    captain_id = db.Column(db.Integer, db.ForeignKey('captains.captain_id'))
+    service_type = db.Column(db.Enum(ServiceType), nullable=False)
+    status = db.Column(db.Enum(BookingStatus))
+    pickup_location_lat = db.Column(db.Float, nullable=False)
+    pickup_location_lon = db.Column(db.Float, nullable=False)
+    dropoff_location_lat = db.Column(db.Float, nullable=False)
+    dropoff_location_lon = db.Column(db.Float, nullable=False)
+    pickup_address = db.Column(db.String(255))
+    dropoff_address = db.Column(db.String(255))
+    distance_km = db.Column(db.Float)
+    estimated_fare = db.Column(db.Float)
+    final_fare = db.Column(db.Float)
+    payment_method = db.Column(db.Enum(PaymentMethod), nullable=False)
+    app_commission = db.Column(db.Float)
+    captain_earning = db.Column(db.Float)
+    booking_time = db.Column(db.DateTime, index=True)
+    scheduled_time = db.Column(db.DateTime)
+    start_time = db.Column(db.DateTime, index=True)
+    end_time = db.Column(db.DateTime)
+    user_rating = db.Column(db.Integer)
+    captain_rating = db.Column(db.Integer)
+    notes = db.Column(db.Text)
+    settlement_batch_id = db.Column(db.Integer, db.ForeignKey('settlement_batches.batch_id'), index=True)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Read-only relationships, the archive never owns users or captains
+    user = db.relationship('AppUser', viewonly=True)
+    captain = db.relationship('Captain', viewonly=True)
+    payments = db.relationship('ArchivedPayment', backref='booking', lazy=True)
+    
+    def to_dict(self):
+        return {
+            'booking_id': self.booking_id,
+            'user_id': self.user_id,
+            'captain_id': self.captain_id,
+            'service_type': self.service_type.value if self.service_type else None,
+            'status': self.status.value if self.status else None,
+            'pickup_location_lat': self.pickup_location_lat,
+            'pickup_location_lon': self.pickup_location_lon,
+            'dropoff_location_lat': self.dropoff_location_lat,
+            'dropoff_location_lon': self.dropoff_location_lon,
+            'pickup_address': self.pickup_address,
+            'dropoff_address': self.dropoff_address,
+            'distance_km': self.distance_km,
+            'estimated_fare': self.estimated_fare,
+            'final_fare': self.final_fare,
+            'payment_method': self.payment_method.value if self.payment_method else None,
+            'app_commission': self.app_commission,
+            'captain_earning': self.captain_earning,
+            'booking_time': self.booking_time.isoformat() if self.booking_time else None,
+            'scheduled_time': self.scheduled_time.isoformat() if self.scheduled_time else None,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'user_rating': self.user_rating,
+            'captain_rating': self.captain_rating,
+            'notes': self.notes,
+            'settlement_batch_id': self.settlement_batch_id,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'user_name': self.user.name if self.user else None,
+            'captain_name': self.captain.name if self.captain else None,
+            'archived': True
+        }
+
+class ArchivedPayment(db.Model):
+    __tablename__ = 'payments_archive'
+    
+    payment_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings_archive.booking_id'), nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    currency = db.Column(db.String(10), default='EGP')
+    method = db.Column(db.Enum(PaymentMethod), nullable=False)
+    status = db.Column(db.Enum(PaymentStatus))
+    transaction_ref = db.Column(db.String(100))
+    payment_date = db.Column(db.DateTime, index=True)
+    processed_by = db.Column(db.Integer, db.ForeignKey('admins.admin_id'))
+    
+    def to_dict(self):
+        return {
+            'payment_id': self.payment_id,
+            'booking_id': self.booking_id,
+            'amount': self.amount,
+            'currency': self.currency,
+            'method': self.method.value if self.method else None,
+            'status': self.status.value if self.status else None,
+            'transaction_ref': self.transaction_ref,
+            'payment_date': self.payment_date.isoformat() if self.payment_date else None,
+            'processed_by': self.processed_by,
+            'archived': True
+        }
+
+class ArchiveState(db.Model):
+    """Watermarks of the archive job, used to decide when reads must include the archive."""
+    __tablename__ = 'archive_state'
+    
+    state_id = db.Column(db.Integer, primary_key=True)
+    # Every archived booking has booking_time < archived_before
+    archived_before = db.Column(db.DateTime)
+    # Latest payment_date found in payments_archive
+    max_payment_date = db.Column(db.DateTime)
+    archived_bookings = db.Column(db.Integer, default=0)
+    archived_payments = db.Column(db.Integer, default=0)
+    last_run_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'archived_before': self.archived_before.isoformat() if self.archived_before else None,
+            'max_payment_date': self.max_payment_date.isoformat() if self.max_payment_date else None,
+            'archived_bookings': self.archived_bookings,
+            'archived_payments': self.archived_payments,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None
+        }
+
+class BackfillCheckpoint(db.Model):
+    """Resume point of a chunked backfill, one row per backfill and table."""
+    __tablename__ = 'backfill_checkpoints'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    last_id = db.Column(db.Integer, default=0)
+    processed_rows = db.Column(db.Integer, default=0)
+    updated_rows = db.Column(db.Integer, default=0)
+    rows_per_second = db.Column(db.Float)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'last_id': self.last_id,
+            'processed_rows': self.processed_rows,
+            'updated_rows': self.updated_rows,
+            'rows_per_second': self.rows_per_second,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class BackgroundJob(db.Model):
+    __tablename__ = 'background_jobs'
+    
+    job_id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False)
+    # Hash of job_type + normalized params, used to deduplicate identical submissions
+    params_hash = db.Column(db.String(64), nullable=False, index=True)
+    status = db.Column(db.Enum(JobStatus), default=JobStatus.QUEUED, index=True)
+    progress = db.Column(db.Float, default=0.0)
+    result_path = db.Column(db.String(255))
+    error = db.Column(db.Text)
+    submitted_by = db.Column(db.Integer, db.ForeignKey('admins.admin_id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Refreshed by the worker that owns the job while it is queued or running
+    heartbeat_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'job_type': self.job_type,
+            'params': json.loads(self.params) if self.params else None,
+            'status': self.status.value if self.status else None,
+            'progress': round(self.progress or 0, 4),
+            'has_result': bool(self.result_path) and self.status == JobStatus.COMPLETED,
+            'error': self.error,
+            'submitted_by': self.submitted_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class CalendarDay(db.Model):
+    """Calendar dimension: one row per local day and timezone with its UTC boundaries."""
+    __tablename__ = 'calendar_days'
+    
+    tz = db.Column(db.String(64), primary_key=True)
+    local_date = db.Column(db.Date, primary_key=True)
+    # Naive UTC datetimes, comparable with the utcnow-based timestamps stored everywhere else
+    utc_start = db.Column(db.DateTime, nullable=False, index=True)
+    utc_end = db.Column(db.DateTime, nullable=False)
+    day_of_week = db.Column(db.Integer, nullable=False)
+    iso_year = db.Column(db.Integer, nullable=False)
+    iso_week = db.Column(db.Integer, nullable=False)
+    week_start = db.Column(db.Date, nullable=False)
+    month_start = db.Column(db.Date, nullable=False)
+
+class CaptainDailyStat(db.Model):
+    """Per-captain, per-local-day, per-service aggregate of bookings backing the leaderboard."""
+    __tablename__ = 'captain_daily_stats'
+    
+    captain_id = db.Column(db.Integer, db.ForeignKey('captains.captain_id'), primary_key=True)
+    stat_date = db.Column(db.Date, primary_key=True, index=True)
+    service_type = db.Column(db.Enum(ServiceType), primary_key=True)
+    total_trips = db.Column(db.Integer, default=0)
+    completed_trips = db.Column(db.Integer, default=0)
+    cancelled_trips = db.Column(db.Integer, default=0)
+    earnings = db.Column(db.Float, default=0.0)
+    rating_sum = db.Column(db.Integer, default=0)
+    rating_count = db.Column(db.Integer, default=0)
+
+class BookingDurationDaily(db.Model):
+    """Per-local-day, per-service histogram of pickup waits or trip durations (see duration_analytics)."""
+    __tablename__ = 'booking_duration_daily'
+    
+    stat_date = db.Column(db.Date, primary_key=True)
+    service_type = db.Column(db.Enum(ServiceType), primary_key=True)
+    metric = db.Column(db.Enum(DurationMetric), primary_key=True)
+    sample_count = db.Column(db.Integer, default=0)
+    total_seconds = db.Column(db.Float, default=0.0)
+    max_seconds = db.Column(db.Integer)
+    # Sparse {bucket index: count} JSON, buckets are mergeable across days
+    histogram = db.Column(db.Text, default='{}')
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CaptainUtilizationDaily(db.Model):
+    """Busy time of one captain on one local day: the union of their trip intervals (see captain_utilization)."""
+    __tablename__ = 'captain_utilization_daily'
+    
+    captain_id = db.Column(db.Integer, db.ForeignKey('captains.captain_id'), primary_key=True)
+    stat_date = db.Column(db.Date, primary_key=True, index=True)
+    trips = db.Column(db.Integer, default=0)
+    busy_seconds = db.Column(db.Float, default=0.0)
+    # Most trips of this captain running at the same time, above 1 for batched deliveries
+    peak_concurrency = db.Column(db.Integer, default=0)
+    first_start = db.Column(db.DateTime)
+    last_end = db.Column(db.DateTime)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'date': self.stat_date.isoformat(),
+            'trips': self.trips,
+            'busy_seconds': round(self.busy_seconds or 0, 1),
+            'peak_concurrency': self.peak_concurrency,
+            'first_start': self.first_start.isoformat() if self.first_start else None,
+            'last_end': self.last_end.isoformat() if self.last_end else None
+        }
+
+class FleetConcurrencyBucket(db.Model):
+    """Trips in progress fleet-wide during one fixed-width bucket of a local day."""
+    __tablename__ = 'fleet_concurrency_buckets'
+    
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    stat_date = db.Column(db.Date, nullable=False, index=True)
+    peak_trips = db.Column(db.Integer, default=0)
+    # Time-weighted mean of trips in progress over the bucket
+    mean_trips = db.Column(db.Float, default=0.0)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SettlementBatch(db.Model):
+    """Immutable record of one captain payout settlement run."""
+    __tablename__ = 'settlement_batches'
+    
+    batch_id = db.Column(db.Integer, primary_key=True)
+    period_start = db.Column(db.DateTime, nullable=False)
+    period_end = db.Column(db.DateTime, nullable=False)
+    captain_count = db.Column(db.Integer, default=0)
+    booking_count = db.Column(db.Integer, default=0)
+    total_earnings = db.Column(db.Float, default=0.0)
+    total_cash_collected = db.Column(db.Float, default=0.0)
+    net_payable = db.Column(db.Float, default=0.0)
+    created_by = db.Column(db.Integer, db.ForeignKey('admins.admin_id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    lines = db.relationship('SettlementLine', backref='batch', lazy='dynamic')
+    
+    def to_dict(self):
+        return {
+            'batch_id': self.batch_id,
+            'period_start': self.period_start.isoformat() if self.period_start else None,
+            'period_end': self.period_end.isoformat() if self.period_end else None,
+            'captain_count': self.captain_count,
+            'booking_count': self.booking_count,
+            'total_earnings': round(self.total_earnings or 0, 2),
+            'total_cash_collected': round(self.total_cash_collected or 0, 2),
+            'net_payable': round(self.net_payable or 0, 2),
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class SettlementLine(db.Model):
+    """What one captain is owed in a settlement batch (negative balance: captain owes the app)."""
+    __tablename__ = 'settlement_lines'
+    
+    line_id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('settlement_batches.batch_id'), nullable=False, index=True)
+    captain_id = db.Column(db.Integer, db.ForeignKey('captains.captain_id'), nullable=False, index=True)
+    booking_count = db.Column(db.Integer, nullable=False)
+    earnings = db.Column(db.Float, nullable=False)
+    cash_collected = db.Column(db.Float, nullable=False)
+    balance = db.Column(db.Float, nullable=False)
+    
+    captain = db.relationship('Captain', viewonly=True)
+    
+    def to_dict(self):
+        return {
+            'line_id': self.line_id,
+            'batch_id': self.batch_id,
+            'captain_id': self.captain_id,
+            'captain_name': self.captain.name if self.captain else None,
+            'booking_count': self.booking_count,
+            'earnings': round(self.earnings, 2),
+            'cash_collected': round(self.cash_collected, 2),
+            'balance': round(self.balance, 2)
+        }
+
+class ReconciliationRun(db.Model):
+    __tablename__ = 'reconciliation_runs'
+    
+    run_id = db.Column(db.Integer, primary_key=True)
+    date_from = db.Column(db.DateTime, nullable=False)
+    date_to = db.Column(db.DateTime, nullable=False)
+    incremental = db.Column(db.Boolean, default=False)
+    # Checkpoint: every booking_id up to this one has been reconciled by this run
+    last_booking_id = db.Column(db.Integer, default=0)
+    # Bookings created after the run started are left to the next run
+    max_booking_id = db.Column(db.Integer)
+    # change_log head when the run started, the next incremental run rechecks bookings logged after it
+    head_seq = db.Column(db.Integer)
+    checked_bookings = db.Column(db.Integer, default=0)
+    discrepancy_count = db.Column(db.Integer, default=0)
+    completed = db.Column(db.Boolean, default=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'run_id': self.run_id,
+            'date_from': self.date_from.isoformat() if self.date_from else None,
+            'date_to': self.date_to.isoformat() if self.date_to else None,
+            'incremental': self.incremental,
+            'last_booking_id': self.last_booking_id,
+            'checked_bookings': self.checked_bookings,
+            'discrepancy_count': self.discrepancy_count,
+            'completed': self.completed,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class ReconciliationDiscrepancy(db.Model):
+    __tablename__ = 'reconciliation_discrepancies'
+    
+    discrepancy_id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('reconciliation_runs.run_id'), nullable=False)
+    booking_id = db.Column(db.Integer, nullable=False, index=True)
+    booking_time = db.Column(db.DateTime, index=True)
+    kind = db.Column(db.Enum(DiscrepancyType), nullable=False, index=True)
+    expected_amount = db.Column(db.Float)
+    paid_amount = db.Column(db.Float)
+    payment_count = db.Column(db.Integer)
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'discrepancy_id': self.discrepancy_id,
+            'run_id': self.run_id,
+            'booking_id': self.booking_id,
+            'booking_time': self.booking_time.isoformat() if self.booking_time else None,
+            'kind': self.kind.value if self.kind else None,
+            'expected_amount': self.expected_amount,
+            'paid_amount': self.paid_amount,
+            'payment_count': self.payment_count,
+            'detected_at': self.detected_at.isoformat() if self.detected_at else None
+        }
+
+class ChangeLogEntry(db.Model):
+    """One row per write to a synced table, seq orders the changes served by /changes?since=."""
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        db.Index('ix_change_log_resource_seq', 'resource', 'seq'),
+        {'sqlite_autoincrement': True}
+    )
+    
+    seq = db.Column(db.Integer, primary_key=True)
+    resource = db.Column(db.String(32), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.Enum(ChangeOperation), nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'resource': self.resource,
+            'entity_id': self.entity_id,
+            'operation': self.operation.value if self.operation else None,
+            'changed_at': self.changed_at.isoformat() if self.changed_at else None
+        }
+
+class CaptainLocation(db.Model):
+    """Latest reported position per captain, written periodically from the in-memory location index."""
+    __tablename__ = 'captain_locations'
+    
+    captain_id = db.Column(db.Integer, db.ForeignKey('captains.captain_id'), primary_key=True)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    reported_at = db.Column(db.DateTime, nullable=False)
+    persisted_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def to_dict(self):
+        return {
+            'captain_id': self.captain_id,
+            'lat': self.lat,
+            'lon': self.lon,
+            'reported_at': self.reported_at.isoformat() if self.reported_at else None,
+            'persisted_at': self.persisted_at.isoformat() if self.persisted_at else None
+        }
+
+class StaleSweepRun(db.Model):
+    __tablename__ = 'stale_sweep_runs'
+    
+    run_id = db.Column(db.Integer, primary_key=True)
+    # Minutes per status and service type the run applied
+    thresholds = db.Column(db.JSON)
+    batches = db.Column(db.Integer, default=0)
+    cancelled_count = db.Column(db.Integer, default=0)
+    flagged_count = db.Column(db.Integer, default=0)
+    triggered_by = db.Column(db.Integer, db.ForeignKey('admins.admin_id'))
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'run_id': self.run_id,
+            'thresholds': self.thresholds,
+            'batches': self.batches,
+            'cancelled_count': self.cancelled_count,
+            'flagged_count': self.flagged_count,
+            'triggered_by': self.triggered_by,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class StaleSweepItem(db.Model):
+    """One booking cancelled or flagged by a sweep run."""
+    __tablename__ = 'stale_sweep_items'
+    
+    item_id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('stale_sweep_runs.run_id'), nullable=False, index=True)
+    booking_id = db.Column(db.Integer, nullable=False, index=True)
+    service_type = db.Column(db.Enum(ServiceType), nullable=False)
+    previous_status = db.Column(db.Enum(BookingStatus), nullable=False)
+    action = db.Column(db.Enum(SweepAction), nullable=False)
+    booking_time = db.Column(db.DateTime)
+    swept_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'item_id': self.item_id,
+            'run_id': self.run_id,
+            'booking_id': self.booking_id,
+            'service_type': self.service_type.value if self.service_type else None,
+            'previous_status': self.previous_status.value if self.previous_status else None,
+            'action': self.action.value if self.action else None,
+            'booking_time': self.booking_time.isoformat() if self.booking_time else None,
+            'swept_at': self.swept_at.isoformat() if self.swept_at else None
+        }
+
+class AdminAuditLog(db.Model):
+    """Append-only record of admin writes, inserted in batches by the audit buffer."""
+    __tablename__ = 'admin_audit_log'
+    __table_args__ = (
+        db.Index('ix_admin_audit_log_entity', 'entity_type', 'entity_id', 'audit_id'),
+        db.Index('ix_admin_audit_log_admin', 'admin_id', 'audit_id'),
+        db.Index('ix_admin_audit_log_action', 'action', 'audit_id'),
+        {'sqlite_autoincrement': True}
+    )
+    
+    audit_id = db.Column(db.Integer, primary_key=True)
+    admin_id = db.Column(db.Integer, db.ForeignKey('admins.admin_id'))
+    action = db.Column(db.String(64), nullable=False)
+    entity_type = db.Column(db.String(32))
+    entity_id = db.Column(db.Integer)
+    before = db.Column(db.JSON)
+    after = db.Column(db.JSON)
+    method = db.Column(db.String(8))
+    path = db.Column(db.String(255))
+    ip_address = db.Column(db.String(45))
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def to_dict(self):
+        return {
+            'audit_id': self.audit_id,
+            'admin_id': self.admin_id,
+            'action': self.action,
+            'entity_type': self.entity_type,
+            'entity_id': self.entity_id,
+            'before': self.before,
+            'after': self.after,
+            'method': self.method,
+            'path': self.path,
+            'ip_address': self.ip_address,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class UserCohortMember(db.Model):
+    """Cohort months of one user in the reporting timezone, maintained by user_cohorts."""
+    __tablename__ = 'user_cohort_members'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), primary_key=True)
+    signup_month = db.Column(db.Date, nullable=False, index=True)
+    first_booking_month = db.Column(db.Date, index=True)
+
+class UserActivityMonth(db.Model):
+    """One row per user and local month with at least one non-cancelled booking."""
+    __tablename__ = 'user_activity_months'
+    __table_args__ = (
+        db.Index('ix_user_activity_months_month', 'activity_month', 'user_id'),
+    )
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), primary_key=True)
+    activity_month = db.Column(db.Date, primary_key=True)
+    bookings = db.Column(db.Integer, default=0)
+
+class UserCohort(db.Model):
+    __tablename__ = 'user_cohorts'
+    
+    cohort_type = db.Column(db.Enum(CohortType), primary_key=True)
+    cohort_month = db.Column(db.Date, primary_key=True)
+    cohort_size = db.Column(db.Integer, default=0)
+
+class UserCohortRetention(db.Model):
+    """Users of a cohort with bookings month_offset months after the cohort month."""
+    __tablename__ = 'user_cohort_retention'
+    
+    cohort_type = db.Column(db.Enum(CohortType), primary_key=True)
+    cohort_month = db.Column(db.Date, primary_key=True)
+    month_offset = db.Column(db.Integer, primary_key=True)
+    # cohort_month + month_offset, rows are replaced per activity month
+    activity_month = db.Column(db.Date, nullable=False, index=True)
+    active_users = db.Column(db.Integer, default=0)
+
+class CohortState(db.Model):
+    """Progress of the cohort materialization, months up to finalized_through are not recomputed."""
+    __tablename__ = 'cohort_state'
+    
+    state_id = db.Column(db.Integer, primary_key=True)
+    tz = db.Column(db.String(64))
+    finalized_through = db.Column(db.Date)
+    # Last month materialized, possibly still in progress
+    materialized_through = db.Column(db.Date)
+    last_run_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'tz': self.tz,
+            'finalized_through': self.finalized_through.isoformat() if self.finalized_through else None,
+            'materialized_through': self.materialized_through.isoformat() if self.materialized_through else None,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None
+        }
@@ -0,0 +1,150 @@
+from flask import current_app, jsonify
+from src.routes.shared_state import record_metric, metric_totals
+from functools import wraps
+import math
+import threading
+import time
+
+# Cost classes for expensive endpoints, overridable per class with app.config['ADMISSION_CLASSES']
+DEFAULT_ADMISSION_CLASSES = {
+    'export': {'max_concurrent': 2, 'max_queue': 4, 'queue_timeout': 10.0, 'per_admin_limit': 1},
+    'report': {'max_concurrent': 4, 'max_queue': 8, 'queue_timeout': 5.0, 'per_admin_limit': 2},
+    'live': {'max_concurrent': 4, 'max_queue': 16, 'queue_timeout': 3.0, 'per_admin_limit': 2}
+}
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionClass:
+    """Concurrency limit with a bounded, timed wait queue and a per-admin cap.
+    
+    The per-admin cap keeps a single admin from holding every slot of a class,
+    so other admins queueing for the same class still get through.
+    """
+    
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout, per_admin_limit):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.per_admin_limit = per_admin_limit
+        self._condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.active_by_admin = {}
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.rejected_per_admin = 0
+    
+    def _can_enter(self, admin_id):
+        return (self.active < self.max_concurrent and
+                self.active_by_admin.get(admin_id, 0) < self.per_admin_limit)
+    
+    def acquire(self, admin_id):
+        rejection = self._enter(admin_id)
+        # Metrics go to the shared store, a SQLite write, so they are recorded after the condition is released
+        if rejection is not None:
+            counter, status_code, reason = rejection
+            record_metric(f'admission:{self.name}:{counter}')
+            raise AdmissionRejected(status_code, reason, max(1, int(math.ceil(self.queue_timeout))))
+        record_metric(f'admission:{self.name}:admitted')
+    
+    def _enter(self, admin_id):
+        """Take a slot, or return the (counter, status code, reason) of the rejection."""
+        with self._condition:
+            if not self._can_enter(admin_id):
+                if self.waiting >= self.max_queue:
+                    self.rejected_queue_full += 1
+                    return 'rejected_queue_full', 503, 'Server is busy, please retry shortly'
+                
+                self.waiting += 1
+                try:
+                    deadline = time.monotonic() + self.queue_timeout
+                    while not self._can_enter(admin_id):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            if self.active_by_admin.get(admin_id, 0) >= self.per_admin_limit:
+                                self.rejected_per_admin += 1
+                                return 'rejected_per_admin', 429, 'Too many concurrent requests of this kind'
+                            self.rejected_timeout += 1
+                            return 'rejected_timeout', 503, 'Server is busy, please retry shortly'
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            
+            self.active += 1
+            self.active_by_admin[admin_id] = self.active_by_admin.get(admin_id, 0) + 1
+            self.admitted += 1
+        return None
+    
+    def release(self, admin_id):
+        with self._condition:
+            self.active -= 1
+            remaining = self.active_by_admin.get(admin_id, 1) - 1
+            if remaining:
+                self.active_by_admin[admin_id] = remaining
+            else:
+                self.active_by_admin.pop(admin_id, None)
+            self._condition.notify_all()
+    
+    def stats(self):
+        with self._condition:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'queue_timeout': self.queue_timeout,
+                'per_admin_limit': self.per_admin_limit,
+                'active': self.active,
+                'queue_depth': self.waiting,
+                'admitted': self.admitted,
+                'rejected_queue_full': self.rejected_queue_full,
+                'rejected_timeout': self.rejected_timeout,
+                'rejected_per_admin': self.rejected_per_admin
+            }
+
+_classes = {}
+_classes_lock = threading.Lock()
+
+def get_admission_class(name):
+    with _classes_lock:
+        if name not in _classes:
+            settings = dict(DEFAULT_ADMISSION_CLASSES[name])
+            settings.update(current_app.config.get('ADMISSION_CLASSES', {}).get(name, {}))
+            _classes[name] = AdmissionClass(name, **settings)
+        return _classes[name]
+
+def admission_stats():
+    """Live state of this worker's cost classes plus counters summed over all workers."""
+    with _classes_lock:
+        classes = list(_classes.values())
+    return {
+        'worker': {admission_class.name: admission_class.stats() for admission_class in classes},
+        'all_workers': metric_totals('admission:')
+    }
+
+def admission_controlled(cost_class):
+    """Limit concurrent executions of a view. Place it below @token_required."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_admin, *args, **kwargs):
+            admission_class = get_admission_class(cost_class)
+            admin_id = current_admin.admin_id
+            try:
+                admission_class.acquire(admin_id)
+            except AdmissionRejected as rejection:
+                response = jsonify({'message': rejection.reason, 'cost_class': cost_class})
+                response.status_code = rejection.status_code
+                response.headers['Retry-After'] = str(rejection.retry_after)
+                return response
+            
+            try:
+                return f(current_admin, *args, **kwargs)
+            finally:
+                admission_class.release(admin_id)
+        return decorated
+    return decorator
@@ -0,0 +1,179 @@
+from src.models.admin_models import (
+    db, Booking, Payment, ArchivedBooking, ArchivedPayment, ArchiveState, BookingStatus
+)
+from sqlalchemy import func, desc, insert, select, delete, literal, union_all
+from datetime import datetime
+import math
+
+ARCHIVABLE_STATUSES = [BookingStatus.COMPLETED, BookingStatus.CANCELLED]
+
+def months_ago(now, months):
+    """Same day/time `months` calendar months before `now` (clamped to the month length)."""
+    month_index = now.year * 12 + (now.month - 1) - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    days_in_month = [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28,
+                     31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month - 1]
+    return now.replace(year=year, month=month, day=min(now.day, days_in_month))
+
+def get_archive_state():
+    state = ArchiveState.query.first()
+    if not state:
+        state = ArchiveState(archived_bookings=0, archived_payments=0)
+        db.session.add(state)
+        db.session.flush()
+    return state
+
+def _shared_columns(source, target):
+    target_columns = set(target.__table__.columns.keys())
+    return [name for name in source.__table__.columns.keys() if name in target_columns]
+
+def archive_bookings(months=6, batch_size=500, max_batches=None):
+    """Move completed/cancelled bookings older than `months` and their payments to the archive.
+
+    Every batch copies and deletes its rows in a single transaction, so an interrupted
+    run leaves both tables consistent and simply continues where it stopped when rerun.
+    """
+    cutoff = months_ago(datetime.utcnow(), months)
+
+    # Publish the watermark before moving rows so concurrent readers already union the archive
+    state = get_archive_state()
+    if not state.archived_before or state.archived_before < cutoff:
+        state.archived_before = cutoff
+    db.session.commit()
+
+    booking_columns = _shared_columns(Booking, ArchivedBooking)
+    payment_columns = _shared_columns(Payment, ArchivedPayment)
+
+    batches = 0
+    moved_bookings = 0
+    moved_payments = 0
+    while max_batches is None or batches < max_batches:
+        booking_ids = [row.booking_id for row in db.session.query(Booking.booking_id).filter(
+            Booking.status.in_(ARCHIVABLE_STATUSES),
+            Booking.booking_time < cutoff
+        ).order_by(Booking.booking_id).limit(batch_size).all()]
+
+        if not booking_ids:
+            break
+
+        try:
+            db.session.execute(insert(ArchivedBooking.__table__).from_select(
+                booking_columns,
+                select(*[Booking.__table__.c[name] for name in booking_columns]).where(
+                    Booking.booking_id.in_(booking_ids)
+                )
+            ))
+            payments_result = db.session.execute(insert(ArchivedPayment.__table__).from_select(
+                payment_columns,
+                select(*[Payment.__table__.c[name] for name in payment_columns]).where(
+                    Payment.booking_id.in_(booking_ids)
+                )
+            ))
+            batch_max_payment_date = db.session.query(func.max(Payment.payment_date)).filter(
+                Payment.booking_id.in_(booking_ids)
+            ).scalar()
+
+            db.session.execute(delete(Payment.__table__).where(Payment.booking_id.in_(booking_ids)))
+            db.session.execute(delete(Booking.__table__).where(Booking.booking_id.in_(booking_ids)))
+
+            state = get_archive_state()
+            if batch_max_payment_date and (not state.max_payment_date or state.max_payment_date < batch_max_payment_date):
+                state.max_payment_date = batch_max_payment_date
+            state.archived_bookings = (state.archived_bookings or 0) + len(booking_ids)
+            state.archived_payments = (state.archived_payments or 0) + max(payments_result.rowcount, 0)
+            state.last_run_at = datetime.utcnow()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        batches += 1
+        moved_bookings += len(booking_ids)
+        moved_payments += max(payments_result.rowcount, 0)
+
+    return {
+        'cutoff': cutoff.isoformat(),
+        'batches': batches,
+        'archived_bookings': moved_bookings,
+        'archived_payments': moved_payments,
+        'completed': max_batches is None or batches < max_batches
+    }
+
+def bookings_need_archive(date_from=None):
+    """True when a booking_time range starting at `date_from` may reach archived rows."""
+    state = ArchiveState.query.first()
+    if not state or not state.archived_before:
+        return False
+    return date_from is None or date_from < state.archived_before
+
+def bookings_source(date_from=None, date_to=None):
+    """Bookings a booking_time range reads from: the live table, or live and archived rows as one subquery.
+
+    The union is only built when the range may reach the archive; each branch is limited to the range
+    on its own booking_time index, and callers filter the returned selectable's columns as usual.
+    """
+    if not bookings_need_archive(date_from):
+        return Booking.__table__
+    columns = _shared_columns(Booking, ArchivedBooking)
+
+    def branch(model):
+        query = select(*[model.__table__.c[name] for name in columns])
+        if date_from:
+            query = query.where(model.booking_time >= date_from)
+        if date_to:
+            query = query.where(model.booking_time <= date_to)
+        return query
+
+    return union_all(branch(Booking), branch(ArchivedBooking)).subquery()
+
+def payments_need_archive(date_from=None):
+    """True when a payment_date range starting at `date_from` may reach archived rows."""
+    state = ArchiveState.query.first()
+    if not state or not state.max_payment_date:
+        return False
+    return date_from is None or date_from <= state.max_payment_date
+
+class UnionPage:
+    """Minimal stand-in for Flask-SQLAlchemy's Pagination over live + archived bookings."""
+
+    def __init__(self, items, total, page, per_page):
+        self.items = items
+        self.total = total
+        self.page = page
+        self.per_page = per_page
+        self.pages = int(math.ceil(total / per_page)) if per_page else 0
+
+def paginate_with_archive(live_query, archived_query, page, per_page):
+    """Paginate two filtered booking queries as one list ordered by booking_time (newest first)."""
+    live_keys = live_query.order_by(None).with_entities(
+        Booking.booking_id.label('booking_id'),
+        Booking.booking_time.label('booking_time'),
+        literal(0).label('archived')
+    )
+    archived_keys = archived_query.order_by(None).with_entities(
+        ArchivedBooking.booking_id.label('booking_id'),
+        ArchivedBooking.booking_time.label('booking_time'),
+        literal(1).label('archived')
+    )
+    keys = union_all(live_keys.statement, archived_keys.statement).subquery()
+
+    total = db.session.execute(select(func.count()).select_from(keys)).scalar()
+    page_keys = db.session.execute(
+        select(keys.c.booking_id, keys.c.archived).order_by(
+            desc(keys.c.booking_time), desc(keys.c.booking_id)
+        ).limit(per_page).offset((page - 1) * per_page)
+    ).all()
+
+    live_ids = [row.booking_id for row in page_keys if not row.archived]
+    archived_ids = [row.booking_id for row in page_keys if row.archived]
+    loaded = {}
+    if live_ids:
+        for booking in Booking.query.filter(Booking.booking_id.in_(live_ids)).all():
+            loaded[(booking.booking_id, 0)] = booking
+    if archived_ids:
+        for booking in ArchivedBooking.query.filter(ArchivedBooking.booking_id.in_(archived_ids)).all():
+            loaded[(booking.booking_id, 1)] = booking
+
+    items = [loaded[(row.booking_id, row.archived)] for row in page_keys if (row.booking_id, row.archived) in loaded]
+    return UnionPage(items, total, page, per_page)
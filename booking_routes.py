@@ -1,11 +1,55 @@
 from flask import Blueprint, request, jsonify
-from src.models.admin_models import db, Booking, BookingStatus, ServiceType
+from src.models.admin_models import db, Booking, ArchivedBooking, BookingStatus, ServiceType, VehicleType
+from src.models.admin_models import StaleSweepRun, StaleSweepItem, SweepAction
 from src.routes.admin_auth import token_required
-from sqlalchemy import or_, desc
-from datetime import datetime, timedelta
+from src.routes.admission_control import admission_controlled
+from src.routes.single_flight import single_flight
+from src.routes.job_runner import job_runner
+from src.routes.captain_leaderboard import refresh_captain_day
+from src.routes.duration_analytics import PERCENTILES, duration_percentiles, invalidate_duration_day
+from src.routes.captain_utilization import invalidate_utilization
+from src.routes.booking_archive import archive_bookings, bookings_need_archive, bookings_source, paginate_with_archive, get_archive_state
+from src.routes.change_feed import changes_since
+from src.routes.fare_engine import audit_fares
+from src.routes.distance_backfill import backfill_distances, backfill_status
+from src.routes.captain_locations import captain_locations
+from src.routes.scheduled_dispatch import scheduled_dispatcher
+from src.routes.stale_sweeper import stale_sweeper, sweep_stale_bookings
+from src.routes.state_transitions import TransitionRejected, transition_booking, expected_version
+from src.routes.admin_audit import audit_log, state_of, transition_before
+from src.routes.reporting_calendar import reporting_timezone, local_today
+from sqlalchemy import or_, desc, func, literal
+from datetime import date, datetime, timedelta
 
 booking_bp = Blueprint('booking', __name__)
 
+def _filter_bookings(model, status_filter=None, service_type_filter=None, date_from=None, date_to=None, search=''):
+    """Build the bookings list query for either the live or the archived bookings table."""
+    query = model.query
+    
+    # Apply filters
+    if status_filter:
+        query = query.filter(model.status == BookingStatus(status_filter))
+    
+    if service_type_filter:
+        query = query.filter(model.service_type == ServiceType(service_type_filter))
+    
+    if date_from:
+        query = query.filter(model.booking_time >= date_from)
+    
+    if date_to:
+        query = query.filter(model.booking_time <= date_to)
+    
+    if search:
+        query = query.join(model.user).join(model.captain, isouter=True).filter(or_(
+            model.pickup_address.ilike(f'%{search}%'),
+            model.dropoff_address.ilike(f'%{search}%'),
+            model.user.has(name=search),
+            model.captain.has(name=search)
+        ))
+    
+    return query
+
 @booking_bp.route('/bookings', methods=['GET'])
 @token_required
 def get_bookings(current_admin):
@@ -19,37 +63,28 @@ def get_bookings(current_admin):
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
         
-        # Build query
-        query = Booking.query
-        
-        # Apply filters
-        if status_filter:
-            query = query.filter(Booking.status == BookingStatus(status_filter))
-        
-        if service_type_filter:
-            query = query.filter(Booking.service_type == ServiceType(service_type_filter))
-        
-        if date_from:
-            date_from_obj = datetime.fromisoformat(date_from)
-            query = query.filter(Booking.booking_time >= date_from_obj)
+        date_from_obj = datetime.fromisoformat(date_from) if date_from else None
+        date_to_obj = datetime.fromisoformat(date_to) if date_to else None
         
-        if date_to:
-            date_to_obj = datetime.fromisoformat(date_to)
-            query = query.filter(Booking.booking_time <= date_to_obj)
-        
-        if search:
-            query = query.join(Booking.user).join(Booking.captain, isouter=True).filter(or_(
-                Booking.pickup_address.ilike(f'%{search}%'),
-                Booking.dropoff_address.ilike(f'%{search}%'),
-                Booking.user.has(name=search),
-                Booking.captain.has(name=search)
-            ))
+        filters = dict(
+            status_filter=status_filter,
+            service_type_filter=service_type_filter,
+            date_from=date_from_obj,
+            date_to=date_to_obj,
+            search=search
+        )
+        query = _filter_bookings(Booking, **filters)
         
-        # Order by booking time (most recent first)
-        query = query.order_by(desc(Booking.booking_time))
+        if bookings_need_archive(date_from_obj):
+            # Old completed/cancelled bookings live in the archive table
+            archived_query = _filter_bookings(ArchivedBooking, **filters)
+            bookings = paginate_with_archive(query, archived_query, page, per_page)
+        else:
+            # Order by booking time (most recent first)
+            query = query.order_by(desc(Booking.booking_time))
         
-        # Paginate
-        bookings = query.paginate(page=page, per_page=per_page, error_out=False)
+            # Paginate
+            bookings = query.paginate(page=page, per_page=per_page, error_out=False)
         
         return jsonify({
             'bookings': [booking.to_dict() for booking in bookings.items],
@@ -62,11 +97,33 @@ def get_bookings(current_admin):
     except Exception as e:
         return jsonify({'message': f'Failed to fetch bookings: {str(e)}'}), 500
 
+@booking_bp.route('/bookings/changes', methods=['GET'])
+@token_required
+def get_booking_changes(current_admin):
+    try:
+        since = request.args.get('since')
+        since = int(since) if since else None
+        limit = min(int(request.args.get('limit', 500)), 5000)
+        
+        return jsonify(changes_since('bookings', since, limit)), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch booking changes: {str(e)}'}), 500
+
 @booking_bp.route('/bookings/<int:booking_id>', methods=['GET'])
 @token_required
 def get_booking_details(current_admin, booking_id):
     try:
-        booking = Booking.query.get_or_404(booking_id)
+        booking = Booking.query.get(booking_id)
+        if not booking:
+            # Fall back to the archive for old completed/cancelled bookings
+            archived_booking = ArchivedBooking.query.get_or_404(booking_id)
+            booking_data = archived_booking.to_dict()
+            booking_data['payments'] = [payment.to_dict() for payment in archived_booking.payments]
+            return jsonify(booking_data), 200
+        
         booking_data = booking.to_dict()
         
         # Include payment information
@@ -90,22 +147,37 @@ def update_booking_status(current_admin, booking_id):
         if not new_status:
             return jsonify({'message': 'Status is required'}), 400
         
-        booking = Booking.query.get_or_404(booking_id)
-        
         try:
-            booking.status = BookingStatus(new_status)
-            if notes:
-                booking.notes = notes
+            new_status = BookingStatus(new_status)
         except ValueError:
             return jsonify({'message': 'Invalid status value'}), 400
         
+        # One conditional UPDATE; a stuck booking that moves on is no longer stale
+        values = {'stale_flagged_at': None}
+        if notes:
+            values['notes'] = notes
+        booking = transition_booking(booking_id, new_status, expected_version(data), values=values)
+        
+        # Keep the captain leaderboard aggregate in step with the booking
+        refresh_captain_day(booking.captain_id, booking.booking_time)
+        invalidate_duration_day(booking.booking_time)
+        invalidate_utilization(booking.start_time, booking.end_time)
         db.session.commit()
+        audit_log.record('booking.status', 'booking', booking_id, transition_before(booking), state_of(booking, 'status', 'version'))
+        if new_status == BookingStatus.SCHEDULED and booking.scheduled_time:
+            scheduled_dispatcher.push_many([(booking.booking_id, booking.scheduled_time)])
         
         return jsonify({
             'message': 'Booking status updated successfully',
             'booking': booking.to_dict()
         }), 200
         
+    except TransitionRejected as rejection:
+        db.session.rollback()
+        return jsonify({'message': rejection.reason, 'current': rejection.current}), rejection.status_code
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Failed to update booking status: {str(e)}'}), 500
@@ -117,28 +189,42 @@ def resolve_booking_dispute(current_admin, booking_id):
         data = request.get_json()
         resolution_notes = data.get('resolution_notes', '')
         
-        booking = Booking.query.get_or_404(booking_id)
-        
-        if booking.status != BookingStatus.DISPUTED:
-            return jsonify({'message': 'Booking is not in disputed status'}), 400
-        
-        # Update booking status and add resolution notes
-        booking.status = BookingStatus.COMPLETED
-        booking.notes = f"RESOLVED: {resolution_notes}\n\nOriginal notes: {booking.notes or ''}"
+        # Update booking status and add resolution notes in one conditional UPDATE
+        booking = transition_booking(
+            booking_id,
+            BookingStatus.COMPLETED,
+            expected_version(data),
+            from_statuses=[BookingStatus.DISPUTED],
+            values={
+                'notes': literal(f"RESOLVED: {resolution_notes}\n\nOriginal notes: ") + func.coalesce(Booking.notes, ''),
+                'stale_flagged_at': None
+            }
+        )
         
+        refresh_captain_day(booking.captain_id, booking.booking_time)
+        invalidate_duration_day(booking.booking_time)
+        invalidate_utilization(booking.start_time, booking.end_time)
         db.session.commit()
+        audit_log.record('booking.resolve', 'booking', booking_id, transition_before(booking), state_of(booking, 'status', 'version', 'notes'))
         
         return jsonify({
             'message': 'Booking dispute resolved successfully',
             'booking': booking.to_dict()
         }), 200
         
+    except TransitionRejected as rejection:
+        db.session.rollback()
+        return jsonify({'message': rejection.reason, 'current': rejection.current}), rejection.status_code
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Failed to resolve booking dispute: {str(e)}'}), 500
 
 @booking_bp.route('/bookings/live', methods=['GET'])
 @token_required
+@admission_controlled('live')
 def get_live_bookings(current_admin):
     try:
         # Get bookings that are currently active (not completed, cancelled, or disputed)
@@ -149,9 +235,11 @@ def get_live_bookings(current_admin):
             BookingStatus.ARRIVED
         ]
         
-        bookings = Booking.query.filter(
-            Booking.status.in_(active_statuses)
-        ).order_by(desc(Booking.booking_time)).all()
+        query = Booking.query.filter(Booking.status.in_(active_statuses))
+        if request.args.get('include_flagged', 'false').lower() != 'true':
+            # Stuck bookings flagged by the stale sweeper are reviewed via /bookings/stale-sweep
+            query = query.filter(Booking.stale_flagged_at.is_(None))
+        bookings = query.order_by(desc(Booking.booking_time)).all()
         
         return jsonify({
             'live_bookings': [booking.to_dict() for booking in bookings],
@@ -161,8 +249,148 @@ def get_live_bookings(current_admin):
     except Exception as e:
         return jsonify({'message': f'Failed to fetch live bookings: {str(e)}'}), 500
 
+@booking_bp.route('/bookings/stale-sweep', methods=['POST'])
+@token_required
+def run_stale_sweep(current_admin):
+    try:
+        data = request.get_json(silent=True) or {}
+        batch_size = int(data.get('batch_size', 500))
+        max_batches = data.get('max_batches')
+        if batch_size < 1:
+            return jsonify({'message': 'batch_size must be positive'}), 400
+        
+        # Per-request threshold overrides on top of STALE_BOOKING_THRESHOLDS, e.g. {"InsideCity": {"Pending": 30}}
+        run = sweep_stale_bookings(
+            stale_sweeper.thresholds(data.get('thresholds')),
+            batch_size=batch_size,
+            max_batches=int(max_batches) if max_batches is not None else None,
+            triggered_by=current_admin.admin_id
+        )
+        
+        return jsonify({
+            'message': 'Stale booking sweep finished',
+            'run': run.to_dict()
+        }), 200
+    
+    except (ValueError, AttributeError) as e:
+        db.session.rollback()
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Failed to sweep stale bookings: {str(e)}'}), 500
+
+@booking_bp.route('/bookings/stale-sweep/runs', methods=['GET'])
+@token_required
+def get_stale_sweep_runs(current_admin):
+    try:
+        limit = min(int(request.args.get('limit', 20)), 100)
+        runs = StaleSweepRun.query.order_by(desc(StaleSweepRun.run_id)).limit(limit).all()
+        
+        return jsonify({
+            'runs': [run.to_dict() for run in runs],
+            'last_periodic_run_id': stale_sweeper.last_run_id,
+            'last_periodic_error': stale_sweeper.last_error
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch stale sweep runs: {str(e)}'}), 500
+
+@booking_bp.route('/bookings/stale-sweep/runs/<int:run_id>', methods=['GET'])
+@token_required
+def get_stale_sweep_run(current_admin, run_id):
+    try:
+        run = StaleSweepRun.query.get_or_404(run_id)
+        page = int(request.args.get('page', 1))
+        per_page = min(int(request.args.get('per_page', 50)), 500)
+        action = request.args.get('action')
+        
+        query = StaleSweepItem.query.filter_by(run_id=run_id)
+        if action:
+            query = query.filter(StaleSweepItem.action == SweepAction(action))
+        items = query.order_by(StaleSweepItem.item_id).paginate(page=page, per_page=per_page, error_out=False)
+        
+        return jsonify({
+            'run': run.to_dict(),
+            'items': [item.to_dict() for item in items.items],
+            'total': items.total,
+            'pages': items.pages,
+            'current_page': page,
+            'per_page': per_page
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch stale sweep run: {str(e)}'}), 500
+
+@booking_bp.route('/bookings/scheduled', methods=['GET'])
+@token_required
+def get_scheduled_bookings(current_admin):
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        
+        # Upcoming releases from this worker's dispatcher queue, soonest first
+        upcoming = scheduled_dispatcher.upcoming(limit)
+        bookings = {
+            booking.booking_id: booking
+            for booking in Booking.query.filter(
+                Booking.booking_id.in_([entry['booking_id'] for entry in upcoming])
+            ).all()
+        } if upcoming else {}
+        
+        return jsonify({
+            'scheduled_bookings': [
+                {**entry, 'booking': bookings[entry['booking_id']].to_dict()}
+                for entry in upcoming if entry['booking_id'] in bookings
+            ],
+            'dispatcher': scheduled_dispatcher.stats()
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch scheduled bookings: {str(e)}'}), 500
+
+@booking_bp.route('/bookings/<int:booking_id>/nearby-captains', methods=['GET'])
+@token_required
+def get_nearby_captains(current_admin, booking_id):
+    try:
+        booking = Booking.query.get_or_404(booking_id)
+        if booking.status != BookingStatus.PENDING:
+            return jsonify({'message': 'Nearby captains are only looked up for pending bookings'}), 400
+        
+        k = min(int(request.args.get('k', 5)), 50)
+        # The grid walks rings of cells out to max_km under the location lock, so the radius is capped like k
+        max_km = min(float(request.args.get('max_km', 10)), 50)
+        vehicle_type = request.args.get('vehicle_type')
+        if k < 1 or not max_km > 0:
+            return jsonify({'message': 'k and max_km must be positive'}), 400
+        
+        captains, lookup_ms = captain_locations.nearest(
+            booking.pickup_location_lat,
+            booking.pickup_location_lon,
+            k=k,
+            vehicle_type=VehicleType(vehicle_type) if vehicle_type else None,
+            max_km=max_km
+        )
+        
+        return jsonify({
+            'booking_id': booking_id,
+            'pickup': {'lat': booking.pickup_location_lat, 'lon': booking.pickup_location_lon},
+            'captains': captains,
+            'lookup_ms': lookup_ms
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch nearby captains: {str(e)}'}), 500
+
 @booking_bp.route('/bookings/stats', methods=['GET'])
 @token_required
+@admission_controlled('report')
 def get_booking_stats(current_admin):
     try:
         # Get date range for filtering (default to last 30 days)
@@ -179,51 +407,244 @@ def get_booking_stats(current_admin):
         else:
             date_to = datetime.fromisoformat(date_to)
         
-        # Base query with date filter
-        base_query = Booking.query.filter(
-            Booking.booking_time >= date_from,
-            Booking.booking_time <= date_to
-        )
+        if request.args.get('async') in ('1', 'true'):
+            # Long ranges run on the job runner, poll /api/jobs/jobs/<job_id> for the result
+            # Raw arguments keep the dedupe key stable when the range defaults to "now"
+            job, created = job_runner.submit('booking_stats', {
+                'date_from': request.args.get('date_from'),
+                'date_to': request.args.get('date_to')
+            }, submitted_by=current_admin.admin_id)
+            return jsonify({
+                'message': 'Stats job submitted' if created else 'Identical stats job already exists',
+                'job': job.to_dict()
+            }), 202
         
-        # Count by status
-        total_bookings = base_query.count()
-        pending_bookings = base_query.filter_by(status=BookingStatus.PENDING).count()
-        accepted_bookings = base_query.filter_by(status=BookingStatus.ACCEPTED).count()
-        completed_bookings = base_query.filter_by(status=BookingStatus.COMPLETED).count()
-        cancelled_bookings = base_query.filter_by(status=BookingStatus.CANCELLED).count()
-        disputed_bookings = base_query.filter_by(status=BookingStatus.DISPUTED).count()
+        return jsonify(compute_booking_stats(date_from, date_to)), 200
         
-        # Count by service type
-        service_stats = {}
-        for service_type in ServiceType:
-            count = base_query.filter_by(service_type=service_type).count()
-            service_stats[service_type.value] = count
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch booking statistics: {str(e)}'}), 500
+
+@booking_bp.route('/bookings/analytics/durations', methods=['GET'])
+@token_required
+@admission_controlled('report')
+def get_duration_analytics(current_admin):
+    try:
+        service_type_filter = request.args.get('service_type')
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
         
-        # Calculate revenue statistics
-        completed_bookings_query = base_query.filter_by(status=BookingStatus.COMPLETED)
-        total_revenue = sum(booking.final_fare or 0 for booking in completed_bookings_query.all())
-        total_commission = sum(booking.app_commission or 0 for booking in completed_bookings_query.all())
+        # Local days of the reporting timezone (default to last 30 days)
+        date_to = date.fromisoformat(date_to) if date_to else local_today(reporting_timezone())
+        date_from = date.fromisoformat(date_from) if date_from else date_to - timedelta(days=29)
+        if (date_to - date_from).days > 366:
+            return jsonify({'message': 'Date range cannot exceed one year'}), 400
+        
+        # Pickup wait is start - booking (or scheduled) time, trip duration is end - start of completed trips
+        analytics = duration_percentiles(
+            date_from,
+            date_to,
+            service_type=ServiceType(service_type_filter) if service_type_filter else None
+        )
         
         return jsonify({
+            **analytics,
+            'percentiles': list(PERCENTILES),
             'date_range': {
                 'from': date_from.isoformat(),
                 'to': date_to.isoformat()
-            },
-            'booking_counts': {
-                'total': total_bookings,
-                'pending': pending_bookings,
-                'accepted': accepted_bookings,
-                'completed': completed_bookings,
-                'cancelled': cancelled_bookings,
-                'disputed': disputed_bookings
-            },
-            'service_type_stats': service_stats,
-            'revenue_stats': {
-                'total_revenue': total_revenue,
-                'total_commission': total_commission,
-                'captain_earnings': total_revenue - total_commission
             }
         }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch duration analytics: {str(e)}'}), 500
+
+@booking_bp.route('/bookings/fare-audit', methods=['GET'])
+@token_required
+@admission_controlled('report')
+@single_flight()
+def get_fare_audit(current_admin):
+    try:
+        service_type_filter = request.args.get('service_type')
+        tolerance_pct = float(request.args.get('tolerance_pct', 5))
+        tolerance_abs = float(request.args.get('tolerance_abs', 1))
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        tz_name = reporting_timezone(request.args.get('tz'))
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        
+        # Local days of the reporting timezone (default to last 30 days)
+        date_to = date.fromisoformat(date_to) if date_to else local_today(tz_name)
+        date_from = date.fromisoformat(date_from) if date_from else date_to - timedelta(days=29)
+        
+        # Stored fares against the current rate cards, computed over the columnar snapshot in one pass
+        audit = audit_fares(
+            tz_name,
+            date_from,
+            date_to,
+            service_type=ServiceType(service_type_filter) if service_type_filter else None,
+            tolerance_pct=tolerance_pct,
+            tolerance_abs=tolerance_abs,
+            limit=limit
+        )
         
+        return jsonify({
+            **audit,
+            'date_range': {
+                'from': date_from.isoformat(),
+                'to': date_to.isoformat()
+            }
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
     except Exception as e:
-        return jsonify({'message': f'Failed to fetch booking statistics: {str(e)}'}), 500
+        return jsonify({'message': f'Failed to run fare audit: {str(e)}'}), 500
+
+@booking_bp.route('/bookings/archive', methods=['POST'])
+@token_required
+def run_booking_archive(current_admin):
+    try:
+        data = request.get_json(silent=True) or {}
+        months = int(data.get('months', 6))
+        batch_size = int(data.get('batch_size', 500))
+        max_batches = data.get('max_batches')
+        
+        if months < 1 or batch_size < 1:
+            return jsonify({'message': 'months and batch_size must be positive'}), 400
+        
+        result = archive_bookings(
+            months=months,
+            batch_size=batch_size,
+            max_batches=int(max_batches) if max_batches is not None else None
+        )
+        
+        return jsonify({
+            'message': 'Booking archive run finished',
+            'result': result,
+            'state': get_archive_state().to_dict()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Failed to archive bookings: {str(e)}'}), 500
+
+@booking_bp.route('/bookings/archive/status', methods=['GET'])
+@token_required
+def get_booking_archive_status(current_admin):
+    try:
+        return jsonify(get_archive_state().to_dict()), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch archive status: {str(e)}'}), 500
+
+@job_runner.job('distance_backfill')
+def run_distance_backfill_job(params, progress):
+    return backfill_distances(
+        chunk_size=params.get('chunk_size', 5000),
+        restart=params.get('restart', False),
+        progress=progress
+    )
+
+@booking_bp.route('/bookings/distance-backfill', methods=['POST'])
+@token_required
+def run_distance_backfill(current_admin):
+    try:
+        data = request.get_json(silent=True) or {}
+        chunk_size = int(data.get('chunk_size', 5000))
+        if chunk_size < 1 or chunk_size > 50000:
+            return jsonify({'message': 'chunk_size must be between 1 and 50000'}), 400
+        
+        # The checkpoints are part of the dedupe key, so a finished run does not swallow the next one
+        job, created = job_runner.submit('distance_backfill', {
+            'chunk_size': chunk_size,
+            'restart': bool(data.get('restart', False)),
+            'checkpoints': {state['name']: state['last_id'] for state in backfill_status()}
+        }, submitted_by=current_admin.admin_id)
+        
+        return jsonify({
+            'message': 'Distance backfill submitted' if created else 'Identical distance backfill already exists',
+            'job': job.to_dict()
+        }), 202
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to submit distance backfill: {str(e)}'}), 500
+
+@booking_bp.route('/bookings/distance-backfill/status', methods=['GET'])
+@token_required
+def get_distance_backfill_status(current_admin):
+    try:
+        return jsonify({'checkpoints': backfill_status()}), 200
+    
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch distance backfill status: {str(e)}'}), 500
+
+def compute_booking_stats(date_from, date_to, progress=None):
+    """Booking counts and revenue for a booking_time range, archived bookings included."""
+    # One grouped pass over the range, live and archived rows alike
+    bookings = bookings_source(date_from, date_to)
+    rows = db.session.query(
+        bookings.c.status,
+        bookings.c.service_type,
+        func.count().label('count'),
+        func.sum(bookings.c.final_fare).label('revenue'),
+        func.sum(bookings.c.app_commission).label('commission')
+    ).filter(
+        bookings.c.booking_time >= date_from,
+        bookings.c.booking_time <= date_to
+    ).group_by(bookings.c.status, bookings.c.service_type).all()
+    if progress:
+        progress(0.7)
+    
+    # Count by status
+    status_counts = {status: 0 for status in BookingStatus}
+    service_stats = {service_type.value: 0 for service_type in ServiceType}
+    total_revenue = 0
+    total_commission = 0
+    for row in rows:
+        status_counts[row.status] = status_counts.get(row.status, 0) + row.count
+        service_stats[row.service_type.value] += row.count
+        # Calculate revenue statistics
+        if row.status == BookingStatus.COMPLETED:
+            total_revenue += row.revenue or 0
+            total_commission += row.commission or 0
+    total_bookings = sum(row.count for row in rows)
+    pending_bookings = status_counts[BookingStatus.PENDING]
+    accepted_bookings = status_counts[BookingStatus.ACCEPTED]
+    completed_bookings = status_counts[BookingStatus.COMPLETED]
+    cancelled_bookings = status_counts[BookingStatus.CANCELLED]
+    disputed_bookings = status_counts[BookingStatus.DISPUTED]
+    
+    return {
+        'date_range': {
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat()
+        },
+        'booking_counts': {
+            'total': total_bookings,
+            'pending': pending_bookings,
+            'accepted': accepted_bookings,
+            'completed': completed_bookings,
+            'cancelled': cancelled_bookings,
+            'disputed': disputed_bookings
+        },
+        'service_type_stats': service_stats,
+        'revenue_stats': {
+            'total_revenue': total_revenue,
+            'total_commission': total_commission,
+            'captain_earnings': total_revenue - total_commission
+        }
+    }
+
+@job_runner.job('booking_stats')
+def run_booking_stats_job(params, progress):
+    date_from = params.get('date_from')
+    date_to = params.get('date_to')
+    return compute_booking_stats(
+        datetime.fromisoformat(date_from) if date_from else datetime.now() - timedelta(days=30),
+        datetime.fromisoformat(date_to) if date_to else datetime.now(),
+        progress=progress
+    )
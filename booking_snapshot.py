@@ -0,0 +1,317 @@
+from flask import current_app
+from src.models.admin_models import (
+    db, Booking, ArchivedBooking, Payment, ArchivedPayment, ChangeLogEntry,
+    ServiceType, BookingStatus, PaymentMethod, PaymentStatus
+)
+from src.routes.job_runner import job_runner
+from sqlalchemy import func, select, union_all
+from datetime import datetime, timedelta
+import json
+import os
+import shutil
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    # Only the snapshot analytics need NumPy, the rest of the app runs without it
+    np = None
+
+# Column name -> (dtype, enum or None). Enums are dictionary-encoded as uint8 codes in
+# declaration order, nulls are -1 for ids, NaN for floats, NaT for times and 255 for enums
+BOOKING_COLUMNS = {
+    'booking_id': ('int64', None),
+    'user_id': ('int64', None),
+    'captain_id': ('int64', None),
+    'service_type': ('uint8', ServiceType),
+    'status': ('uint8', BookingStatus),
+    'payment_method': ('uint8', PaymentMethod),
+    'booking_time': ('datetime64[s]', None),
+    'start_time': ('datetime64[s]', None),
+    'end_time': ('datetime64[s]', None),
+    'distance_km': ('float64', None),
+    'estimated_fare': ('float64', None),
+    'final_fare': ('float64', None),
+    'app_commission': ('float64', None),
+    'captain_earning': ('float64', None)
+}
+PAYMENT_COLUMNS = {
+    'payment_id': ('int64', None),
+    'booking_id': ('int64', None),
+    'amount': ('float64', None),
+    'method': ('uint8', PaymentMethod),
+    'status': ('uint8', PaymentStatus),
+    'payment_date': ('datetime64[s]', None)
+}
+NULL_CODE = 255
+# IN-list size when re-reading changed bookings
+REFRESH_CHUNK = 5000
+# Payments updated slightly before the last refresh are re-read, their commit may have landed after it
+PAYMENT_OVERLAP = timedelta(seconds=5)
+
+def _schema():
+    return {'bookings': list(BOOKING_COLUMNS), 'payments': list(PAYMENT_COLUMNS)}
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError('NumPy is required for snapshot analytics')
+
+def enum_code(enum_member):
+    return list(type(enum_member)).index(enum_member)
+
+def _to_array(values, dtype, enum):
+    if enum is not None:
+        codes = {member: code for code, member in enumerate(enum)}
+        return np.array([codes.get(value, NULL_CODE) for value in values], dtype='uint8')
+    if dtype == 'int64':
+        return np.array([-1 if value is None else value for value in values], dtype='int64')
+    if dtype == 'float64':
+        return np.array([np.nan if value is None else value for value in values], dtype='float64')
+    return np.array([np.datetime64('NaT') if value is None else np.datetime64(value, 's') for value in values],
+                    dtype='datetime64[s]')
+
+def _rows_to_columns(rows, columns):
+    return {
+        name: _to_array([getattr(row, name) for row in rows], dtype, enum)
+        for name, (dtype, enum) in columns.items()
+    }
+
+def _empty_columns(columns):
+    return {name: np.empty(0, dtype=dtype) for name, (dtype, _) in columns.items()}
+
+def _union(live_model, archived_model, columns, *conditions):
+    """Live and archived rows as one select, archiving moves rows without changing their ids."""
+    return union_all(
+        select(*[live_model.__table__.c[name] for name in columns]).where(
+            *[condition(live_model) for condition in conditions]
+        ),
+        select(*[archived_model.__table__.c[name] for name in columns]).where(
+            *[condition(archived_model) for condition in conditions]
+        )
+    )
+
+def _fetch_bookings(*conditions):
+    rows = db.session.execute(_union(Booking, ArchivedBooking, BOOKING_COLUMNS, *conditions)).all()
+    return sorted(rows, key=lambda row: row.booking_id)
+
+def _fetch_payments(*conditions):
+    rows = db.session.execute(_union(Payment, ArchivedPayment, PAYMENT_COLUMNS, *conditions)).all()
+    return sorted(rows, key=lambda row: row.payment_id)
+
+def _patch_columns(current, new_rows, changed_rows, column_defs, id_name):
+    """Copy of `current` (sorted by id_name) with changed rows overwritten in place and new rows appended."""
+    columns = {name: np.array(values) for name, values in current.items()}
+    appended = _rows_to_columns(new_rows, column_defs) if new_rows else _empty_columns(column_defs)
+    if changed_rows:
+        changed = _rows_to_columns(changed_rows, column_defs)
+        ids = columns[id_name]
+        positions = np.minimum(np.searchsorted(ids, changed[id_name]), max(len(ids) - 1, 0))
+        found = (ids[positions] == changed[id_name]) if len(ids) else np.zeros(len(positions), dtype=bool)
+        for name in column_defs:
+            columns[name][positions[found]] = changed[name][found]
+            appended[name] = np.concatenate([appended[name], changed[name][~found]])
+    if len(appended[id_name]):
+        columns = {name: np.concatenate([columns[name], appended[name]]) for name in column_defs}
+        order = np.argsort(columns[id_name], kind='stable')
+        columns = {name: values[order] for name, values in columns.items()}
+    return columns
+
+class AnalyticsSnapshot:
+    """Columnar, memory-mapped copy of bookings and payments (live and archived) for vectorized reports.
+    
+    Every column is one .npy file inside a version directory; manifest.json names
+    the current version, so readers never see a half-written snapshot. Refreshes
+    are incremental: new ids are appended, bookings touched since the last
+    change_log seq and payments whose updated_at moved since the last refresh
+    are re-read and patched, and a full rebuild runs every
+    ANALYTICS_SNAPSHOT_FULL_EVERY_HOURS to pick up writes made outside this app.
+    
+    Reports never wait for a refresh of an existing snapshot: a stale one is
+    served while the analytics_snapshot job refreshes it in the background.
+    """
+    
+    def __init__(self, app=None):
+        self.directory = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._loaded_version = None
+        self._loaded = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('ANALYTICS_SNAPSHOT_DIR', os.path.join(app.root_path, 'database', 'analytics_snapshot'))
+        app.config.setdefault('ANALYTICS_SNAPSHOT_MAX_AGE_SECONDS', 300)
+        app.config.setdefault('ANALYTICS_SNAPSHOT_FULL_EVERY_HOURS', 24)
+        self.directory = app.config['ANALYTICS_SNAPSHOT_DIR']
+        self.max_age_seconds = app.config['ANALYTICS_SNAPSHOT_MAX_AGE_SECONDS']
+        self.full_every_seconds = app.config['ANALYTICS_SNAPSHOT_FULL_EVERY_HOURS'] * 3600
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['analytics_snapshot'] = self
+    
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+    
+    def manifest(self):
+        try:
+            with open(self._manifest_path) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return None
+    
+    def load(self):
+        """Return (manifest, {'bookings': columns, 'payments': columns}) of the current version, memory-mapped."""
+        require_numpy()
+        manifest = self.manifest()
+        if manifest is None:
+            return None, None
+        with self._lock:
+            if self._loaded_version != manifest['version']:
+                version_dir = os.path.join(self.directory, manifest['version'])
+                self._loaded = {
+                    table: {
+                        name: np.load(os.path.join(version_dir, f'{table}.{name}.npy'), mmap_mode='r')
+                        for name in columns
+                    }
+                    for table, columns in (('bookings', BOOKING_COLUMNS), ('payments', PAYMENT_COLUMNS))
+                }
+                self._loaded_version = manifest['version']
+            return manifest, self._loaded
+    
+    def _usable(self, manifest):
+        # A snapshot written with other columns or without payment tracking is rebuilt rather than patched
+        return manifest is not None and manifest.get('columns') == _schema() and 'payments_seen_at' in manifest
+    
+    def ensure_fresh(self):
+        """Load the snapshot; a stale one is served as is and refreshed by a background job.
+        
+        Only a missing or incompatible snapshot is built in the request, once per
+        process: concurrent requests wait for that build instead of starting their own.
+        """
+        manifest = self.manifest()
+        if not self._usable(manifest):
+            with self._build_lock:
+                if not self._usable(self.manifest()):
+                    self.refresh(full=True)
+            return self.load()
+        
+        now = time.time()
+        full = now - manifest['built_at'] > self.full_every_seconds
+        if full or now - manifest['refreshed_at'] > self.max_age_seconds:
+            try:
+                # The version is part of the dedupe key, so every request seeing this version shares one job
+                job_runner.submit('analytics_snapshot', {'full': full, 'from_version': manifest['version']})
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception('Submitting the analytics snapshot refresh failed')
+        return self.load()
+    
+    def _head_seq(self):
+        return db.session.query(func.max(ChangeLogEntry.seq)).filter(ChangeLogEntry.resource == 'bookings').scalar() or 0
+    
+    def refresh(self, full=False, progress=None):
+        """Build a new snapshot version and switch the manifest to it. Returns the new manifest."""
+        require_numpy()
+        started = time.perf_counter()
+        # Read the change log head and the clock first, writes that land during the refresh are re-read next time
+        head_seq = self._head_seq()
+        payments_seen_at = datetime.utcnow()
+        manifest = None if full else self.manifest()
+        if self._usable(manifest):
+            manifest, current = self.load()
+        else:
+            manifest = None
+        
+        if manifest is None:
+            bookings = _rows_to_columns(_fetch_bookings(), BOOKING_COLUMNS)
+            if progress:
+                progress(0.5)
+            payments = _rows_to_columns(_fetch_payments(), PAYMENT_COLUMNS)
+            built_at = time.time()
+            patched = len(bookings['booking_id'])
+        else:
+            bookings, patched = self._refresh_bookings(manifest, current['bookings'])
+            if progress:
+                progress(0.5)
+            payments, patched_payments = self._refresh_payments(manifest, current['payments'])
+            patched += patched_payments
+            built_at = manifest['built_at']
+        
+        new_manifest = {
+            'version': f'v{int(time.time() * 1000)}_{os.getpid()}',
+            'built_at': built_at,
+            'refreshed_at': time.time(),
+            'change_seq': head_seq,
+            'payments_seen_at': payments_seen_at.isoformat(),
+            'max_booking_id': int(bookings['booking_id'].max()) if len(bookings['booking_id']) else 0,
+            'max_payment_id': int(payments['payment_id'].max()) if len(payments['payment_id']) else 0,
+            'rows': {'bookings': len(bookings['booking_id']), 'payments': len(payments['payment_id'])},
+            'refreshed_rows': patched,
+            'refresh_ms': None,
+            'columns': _schema(),
+            'dictionaries': {
+                name: [member.value for member in enum]
+                for columns in (BOOKING_COLUMNS, PAYMENT_COLUMNS)
+                for name, (_, enum) in columns.items() if enum is not None
+            }
+        }
+        self._write_version(new_manifest, bookings, payments, started)
+        return new_manifest
+    
+    def _refresh_bookings(self, manifest, current):
+        changed_ids = sorted({row.entity_id for row in db.session.query(ChangeLogEntry.entity_id).filter(
+            ChangeLogEntry.resource == 'bookings',
+            ChangeLogEntry.seq > manifest['change_seq'],
+            ChangeLogEntry.entity_id <= manifest['max_booking_id']
+        ).all()})
+        new_rows = _fetch_bookings(lambda model: model.booking_id > manifest['max_booking_id'])
+        changed_rows = []
+        for start in range(0, len(changed_ids), REFRESH_CHUNK):
+            chunk = changed_ids[start:start + REFRESH_CHUNK]
+            changed_rows.extend(_fetch_bookings(lambda model: model.booking_id.in_(chunk)))
+        
+        columns = _patch_columns(current, new_rows, changed_rows, BOOKING_COLUMNS, 'booking_id')
+        if changed_ids:
+            # Changed ids that no longer exist in either table were deleted
+            fetched_ids = np.array([row.booking_id for row in changed_rows], dtype='int64')
+            deleted = np.setdiff1d(np.array(changed_ids, dtype='int64'), fetched_ids)
+            if len(deleted):
+                keep = ~np.isin(columns['booking_id'], deleted)
+                columns = {name: values[keep] for name, values in columns.items()}
+        return columns, len(changed_rows) + len(new_rows)
+    
+    def _refresh_payments(self, manifest, current):
+        # Archiving moves payments without changing them, so only live payments can have been updated
+        new_rows = _fetch_payments(lambda model: model.payment_id > manifest['max_payment_id'])
+        changed_rows = db.session.query(*[Payment.__table__.c[name] for name in PAYMENT_COLUMNS]).filter(
+            Payment.updated_at >= datetime.fromisoformat(manifest['payments_seen_at']) - PAYMENT_OVERLAP,
+            Payment.payment_id <= manifest['max_payment_id']
+        ).order_by(Payment.payment_id).all()
+        columns = _patch_columns(current, new_rows, changed_rows, PAYMENT_COLUMNS, 'payment_id')
+        return columns, len(changed_rows) + len(new_rows)
+    
+    def _write_version(self, manifest, bookings, payments, started):
+        version_dir = os.path.join(self.directory, manifest['version'])
+        os.makedirs(version_dir)
+        for table, columns in (('bookings', bookings), ('payments', payments)):
+            for name, values in columns.items():
+                np.save(os.path.join(version_dir, f'{table}.{name}.npy'), values)
+        manifest['refresh_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        
+        temporary_path = f'{self._manifest_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temporary_path, self._manifest_path)
+        
+        # Keep the previous version for readers that picked up the old manifest a moment ago,
+        # memory maps of older ones stay valid after the files are removed
+        versions = sorted(
+            (entry for entry in os.listdir(self.directory) if entry.startswith('v')),
+            key=lambda entry: os.path.getmtime(os.path.join(self.directory, entry))
+        )
+        for entry in versions[:-2]:
+            shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+analytics_snapshot = AnalyticsSnapshot()
@@ -0,0 +1,236 @@
+from src.models.admin_models import (
+    db, RoutingSession, Booking, ArchivedBooking, Captain, CaptainDailyStat, CalendarDay, BookingStatus
+)
+from src.routes.reporting_calendar import reporting_timezone, ensure_calendar, calendar_join
+from sqlalchemy import event, func, case, insert, select, delete, union_all
+from datetime import timedelta
+import heapq
+
+LEADERBOARD_METRICS = ('trips', 'earnings', 'rating', 'completion_rate')
+# Booking columns captain_daily_stats is aggregated from
+STAT_COLUMNS = ('captain_id', 'booking_time', 'service_type', 'status', 'captain_earning', 'captain_rating')
+
+def _booking_source():
+    """Live and archived bookings as one selectable, so rebuilds keep archived history."""
+    columns = ('captain_id', 'booking_time', 'service_type', 'status', 'captain_earning', 'captain_rating')
+    return union_all(
+        select(*[Booking.__table__.c[name] for name in columns]).where(Booking.captain_id.isnot(None)),
+        select(*[ArchivedBooking.__table__.c[name] for name in columns]).where(ArchivedBooking.captain_id.isnot(None))
+    ).subquery()
+
+def _materialize(tz_name, conditions):
+    """Insert captain_daily_stats rows for bookings matching `conditions(source)` with one grouped INSERT ... SELECT."""
+    source = _booking_source()
+    completed = source.c.status == BookingStatus.COMPLETED
+    grouped = select(
+        source.c.captain_id,
+        CalendarDay.local_date,
+        source.c.service_type,
+        func.count(),
+        func.sum(case((completed, 1), else_=0)),
+        func.sum(case((source.c.status == BookingStatus.CANCELLED, 1), else_=0)),
+        func.coalesce(func.sum(case((completed, source.c.captain_earning), else_=0)), 0),
+        func.coalesce(func.sum(source.c.captain_rating), 0),
+        func.count(source.c.captain_rating)
+    ).select_from(CalendarDay).join(
+        source, calendar_join(source.c.booking_time)
+    ).where(
+        CalendarDay.tz == tz_name, *conditions(source)
+    ).group_by(
+        source.c.captain_id, CalendarDay.local_date, source.c.service_type
+    )
+    db.session.execute(insert(CaptainDailyStat.__table__).from_select(
+        ['captain_id', 'stat_date', 'service_type', 'total_trips', 'completed_trips',
+         'cancelled_trips', 'earnings', 'rating_sum', 'rating_count'],
+        grouped
+    ))
+
+def _local_day(tz_name, booking_time):
+    """Local calendar date containing the UTC `booking_time`, adding calendar rows around it when missing."""
+    day = CalendarDay.query.filter(
+        CalendarDay.tz == tz_name,
+        CalendarDay.utc_start <= booking_time,
+        CalendarDay.utc_end > booking_time
+    ).first()
+    if not day:
+        approx_date = booking_time.date()
+        ensure_calendar(tz_name, approx_date - timedelta(days=1), approx_date + timedelta(days=1), commit=False)
+        day = CalendarDay.query.filter(
+            CalendarDay.tz == tz_name,
+            CalendarDay.utc_start <= booking_time,
+            CalendarDay.utc_end > booking_time
+        ).first()
+    return day.local_date
+
+def _refresh_local_day(tz_name, captain_id, local_date):
+    db.session.flush()
+    db.session.execute(delete(CaptainDailyStat.__table__).where(
+        CaptainDailyStat.captain_id == captain_id,
+        CaptainDailyStat.stat_date == local_date
+    ))
+    _materialize(tz_name, lambda source: [
+        source.c.captain_id == captain_id,
+        CalendarDay.local_date == local_date
+    ])
+
+def refresh_captain_day(captain_id, booking_time):
+    """Recompute one captain's rows for the local day containing `booking_time`.
+    
+    Called before the commit, from Core status changes and for every day an
+    ORM booking write touched, so the aggregate moves in the same transaction
+    as the booking.
+    """
+    if not captain_id or not booking_time:
+        return
+    tz_name = reporting_timezone()
+    _refresh_local_day(tz_name, captain_id, _local_day(tz_name, booking_time))
+
+def _mark_days(session, keys):
+    session.info.setdefault('captain_days', set()).update(
+        (captain_id, booking_time) for captain_id, booking_time in keys if captain_id and booking_time
+    )
+
+def _stored_day(connection, booking_id):
+    # The row as stored, attribute history is empty for values expired by a commit
+    row = connection.execute(select(
+        Booking.captain_id, Booking.booking_time
+    ).where(Booking.booking_id == booking_id)).first()
+    return [tuple(row)] if row else []
+
+@event.listens_for(Booking, 'after_insert')
+def _stats_on_insert(mapper, connection, booking):
+    _mark_days(db.inspect(booking).session, [(booking.captain_id, booking.booking_time)])
+
+@event.listens_for(Booking, 'before_update')
+def _stats_on_update(mapper, connection, booking):
+    state = db.inspect(booking)
+    if any(state.attrs[name].history.has_changes() for name in STAT_COLUMNS):
+        # A booking moved to another captain or day leaves its old day as well
+        _mark_days(state.session, _stored_day(connection, booking.booking_id) + [(booking.captain_id, booking.booking_time)])
+
+@event.listens_for(Booking, 'before_delete')
+def _stats_on_delete(mapper, connection, booking):
+    # Archiving deletes with Core statements and skips this, archived bookings keep counting
+    _mark_days(db.inspect(booking).session, _stored_day(connection, booking.booking_id))
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _refresh_marked_days(session):
+    """Recompute the days ORM booking writes touched, in the transaction that is about to commit."""
+    session.flush()
+    while session.info.get('captain_days'):
+        tz_name = reporting_timezone()
+        # Many bookings of one captain usually share a day, each day is recomputed once
+        days = {
+            (captain_id, _local_day(tz_name, booking_time))
+            for captain_id, booking_time in session.info.pop('captain_days')
+        }
+        for captain_id, local_date in sorted(days):
+            _refresh_local_day(tz_name, captain_id, local_date)
+        session.flush()
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _drop_marked_days(session):
+    session.info.pop('captain_days', None)
+
+def rebuild_captain_daily_stats():
+    """Full rebuild of captain_daily_stats, used for the initial backfill and repairs."""
+    tz_name = reporting_timezone()
+    first_booking = db.session.query(func.min(Booking.booking_time)).scalar()
+    first_archived = db.session.query(func.min(ArchivedBooking.booking_time)).scalar()
+    last_booking = db.session.query(func.max(Booking.booking_time)).scalar()
+    last_archived = db.session.query(func.max(ArchivedBooking.booking_time)).scalar()
+    starts = [value for value in (first_booking, first_archived) if value]
+    ends = [value for value in (last_booking, last_archived) if value]
+    
+    db.session.execute(delete(CaptainDailyStat.__table__))
+    if starts and ends:
+        # One day of slack on both ends covers any UTC offset
+        ensure_calendar(tz_name, min(starts).date() - timedelta(days=1), max(ends).date() + timedelta(days=1))
+        _materialize(tz_name, lambda source: [])
+    db.session.commit()
+    return CaptainDailyStat.query.count()
+
+def _metric_value(metric, totals):
+    trips, completed, earnings, rating_sum, rating_count = totals
+    if metric == 'trips':
+        return completed
+    if metric == 'earnings':
+        return earnings
+    if metric == 'rating':
+        return rating_sum / rating_count if rating_count else None
+    return completed / trips if trips else None
+
+def captain_leaderboard(metric, date_from, date_to, limit=10, vehicle_type=None, service_type=None, min_trips=1):
+    """Top `limit` captains by `metric` over local days date_from..date_to.
+    
+    Daily rows are streamed in captain order and folded one captain at a time
+    into a bounded min-heap, so memory stays O(limit) for any window.
+    """
+    query = db.session.query(
+        CaptainDailyStat.captain_id,
+        CaptainDailyStat.total_trips,
+        CaptainDailyStat.completed_trips,
+        CaptainDailyStat.earnings,
+        CaptainDailyStat.rating_sum,
+        CaptainDailyStat.rating_count
+    ).filter(
+        CaptainDailyStat.stat_date >= date_from,
+        CaptainDailyStat.stat_date <= date_to
+    )
+    if service_type:
+        query = query.filter(CaptainDailyStat.service_type == service_type)
+    if vehicle_type:
+        query = query.join(Captain, Captain.captain_id == CaptainDailyStat.captain_id).filter(
+            Captain.vehicle_type == vehicle_type
+        )
+    
+    heap = []
+    
+    def push(captain_id, totals):
+        if totals[0] < min_trips:
+            return
+        value = _metric_value(metric, totals)
+        if value is None:
+            return
+        entry = (value, -captain_id, captain_id, totals)
+        if len(heap) < limit:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+    
+    current_id = None
+    totals = None
+    for row in query.order_by(CaptainDailyStat.captain_id).yield_per(1000):
+        if row.captain_id != current_id:
+            if current_id is not None:
+                push(current_id, tuple(totals))
+            current_id = row.captain_id
+            totals = [0, 0, 0.0, 0, 0]
+        totals[0] += row.total_trips or 0
+        totals[1] += row.completed_trips or 0
+        totals[2] += row.earnings or 0
+        totals[3] += row.rating_sum or 0
+        totals[4] += row.rating_count or 0
+    if current_id is not None:
+        push(current_id, tuple(totals))
+    
+    ranked = sorted(heap, reverse=True)
+    captains = {captain.captain_id: captain for captain in Captain.query.filter(
+        Captain.captain_id.in_([entry[2] for entry in ranked])
+    ).all()} if ranked else {}
+    
+    leaderboard = []
+    for rank, (value, _, captain_id, (trips, completed, earnings, rating_sum, rating_count)) in enumerate(ranked, 1):
+        captain = captains.get(captain_id)
+        leaderboard.append({
+            'rank': rank,
+            'captain_id': captain_id,
+            'name': captain.name if captain else None,
+            'vehicle_type': captain.vehicle_type.value if captain and captain.vehicle_type else None,
+            'total_trips': trips,
+            'completed_trips': completed,
+            'earnings': round(earnings, 2),
+            'rating': round(rating_sum / rating_count, 2) if rating_count else None,
+            'completion_rate': round(completed / trips * 100, 2) if trips else 0
+        })
+    return leaderboard
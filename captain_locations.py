@@ -0,0 +1,346 @@
+from src.models.admin_models import db, Captain, CaptainLocation, CaptainStatus, ChangeLogEntry
+from src.routes.distance_backfill import EARTH_RADIUS_KM, great_circle_km
+from sqlalchemy import func, update, bindparam
+from datetime import datetime, timedelta, timezone
+import atexit
+import heapq
+import math
+import threading
+import time
+
+KM_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_KM / 360
+# Re-read positions persisted slightly before the last sync, their commit may have landed after it
+SYNC_OVERLAP = timedelta(seconds=5)
+# Device clocks running slightly ahead are tolerated (and clamped to now), anything further ahead is rejected
+MAX_CLOCK_SKEW = timedelta(seconds=5)
+
+def parse_reported_at(value, now=None):
+    """ISO 8601 ping timestamp as naive UTC like every other stored timestamp; missing means now."""
+    now = now or datetime.utcnow()
+    if not value:
+        return now
+    reported_at = datetime.fromisoformat(value)
+    if reported_at.tzinfo is not None:
+        reported_at = reported_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if reported_at > now + MAX_CLOCK_SKEW:
+        raise ValueError(f'reported_at {value} is in the future')
+    return min(reported_at, now)
+
+class LocationGrid:
+    """Latest position per captain, bucketed into square cells of cell_degrees.
+    
+    A k-nearest lookup scans rings of cells around the query point and stops as
+    soon as no cell outside the scanned rings can hold anything closer than the
+    k-th hit, so the cost depends on the captains nearby rather than on all of them.
+    """
+    
+    def __init__(self, cell_degrees):
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        self._positions = {}
+    
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+    
+    def __len__(self):
+        return len(self._positions)
+    
+    def get(self, captain_id):
+        return self._positions.get(captain_id)
+    
+    def upsert(self, captain_id, lat, lon, reported_at):
+        """Store the position unless a newer one is already known, returns whether it was stored."""
+        current = self._positions.get(captain_id)
+        if current is not None:
+            if current[2] >= reported_at:
+                return False
+            self._cells[current[3]].discard(captain_id)
+            if not self._cells[current[3]]:
+                del self._cells[current[3]]
+        cell = self._cell(lat, lon)
+        self._cells.setdefault(cell, set()).add(captain_id)
+        self._positions[captain_id] = (lat, lon, reported_at, cell)
+        return True
+    
+    def remove(self, captain_id):
+        current = self._positions.pop(captain_id, None)
+        if current is not None:
+            self._cells[current[3]].discard(captain_id)
+            if not self._cells[current[3]]:
+                del self._cells[current[3]]
+    
+    def _ring(self, row, col, radius):
+        if radius == 0:
+            yield row, col
+            return
+        for offset in range(-radius, radius + 1):
+            yield row - radius, col + offset
+            yield row + radius, col + offset
+        for offset in range(-radius + 1, radius):
+            yield row + offset, col - radius
+            yield row + offset, col + radius
+    
+    def _ring_clearance_km(self, lat, radius):
+        """Lower bound of the distance to anything outside rings 0..radius.
+        
+        Such a point is at least radius cells away in latitude or longitude; the
+        longitude side is the shorter one, measured at the highest latitude reached.
+        """
+        edge_lat = min(89.0, abs(lat) + (radius + 1) * self.cell_degrees)
+        return radius * self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(edge_lat))
+    
+    def nearest(self, lat, lon, k, accept=None, max_km=None):
+        """The k closest accepted captains as [(distance_km, captain_id, lat, lon, reported_at)], closest first."""
+        row, col = self._cell(lat, lon)
+        best = []
+        seen = 0
+        radius = 0
+        while seen < len(self._positions):
+            for cell in self._ring(row, col, radius):
+                for captain_id in self._cells.get(cell, ()):
+                    seen += 1
+                    if accept is not None and not accept(captain_id):
+                        continue
+                    position = self._positions[captain_id]
+                    distance = great_circle_km(lat, lon, position[0], position[1])
+                    if max_km is not None and distance > max_km:
+                        continue
+                    entry = (-distance, captain_id)
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+            clearance = self._ring_clearance_km(lat, radius)
+            if len(best) == k and -best[0][0] <= clearance:
+                break
+            if max_km is not None and clearance > max_km:
+                break
+            radius += 1
+        return [
+            (-distance, captain_id, *self._positions[captain_id][:3])
+            for distance, captain_id in sorted(best, reverse=True)
+        ]
+    
+    def stats(self):
+        return {
+            'captains': len(self._positions),
+            'cells': len(self._cells),
+            'cell_degrees': self.cell_degrees
+        }
+
+class CaptainLocations:
+    """Flask extension keeping the latest captain positions in a LocationGrid.
+    
+    Pings only touch memory; a daemon thread writes changed positions to
+    captain_locations every CAPTAIN_LOCATION_PERSIST_SECONDS, and once more at
+    interpreter exit, so other workers see them. Before every lookup the grid
+    picks up positions persisted by other workers since the last lookup and
+    captain status/vehicle changes from the change log, both via indexed queries.
+    Call init_app after db.create_all and change_feed.init_app.
+    """
+    
+    def __init__(self, app=None):
+        self.grid = None
+        self._lock = threading.Lock()
+        self._captains = {}
+        self._dirty = set()
+        self.last_seq = 0
+        self.synced_at = None
+        self.persisted_at = None
+        self.app = None
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('CAPTAIN_LOCATION_CELL_DEGREES', 0.01)
+        app.config.setdefault('CAPTAIN_LOCATION_PERSIST_SECONDS', 30)
+        # Positions older than this are not offered for dispatch
+        app.config.setdefault('CAPTAIN_LOCATION_MAX_AGE_SECONDS', 300)
+        app.config.setdefault('CAPTAIN_LOCATION_MAX_BATCH', 1000)
+        self.persist_seconds = app.config['CAPTAIN_LOCATION_PERSIST_SECONDS']
+        self.max_age_seconds = app.config['CAPTAIN_LOCATION_MAX_AGE_SECONDS']
+        self.max_batch = app.config['CAPTAIN_LOCATION_MAX_BATCH']
+        self.grid = LocationGrid(app.config['CAPTAIN_LOCATION_CELL_DEGREES'])
+        self.app = app
+        with app.app_context():
+            self.load()
+        if self.persist_seconds and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='captain-location-persist', daemon=True)
+            self._thread.start()
+            atexit.register(self._persist_in_context)
+        app.extensions['captain_locations'] = self
+    
+    def _persist_in_context(self):
+        with self.app.app_context():
+            try:
+                self.persist()
+            except Exception:
+                self.app.logger.exception('Persisting captain locations failed')
+            finally:
+                db.session.remove()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.persist_seconds)
+            if self._dirty:
+                self._persist_in_context()
+    
+    def _head_seq(self):
+        return db.session.query(func.max(ChangeLogEntry.seq)).filter(ChangeLogEntry.resource == 'captains').scalar() or 0
+    
+    @staticmethod
+    def _captain_attributes(captain):
+        return {'name': captain.name, 'status': captain.status, 'vehicle_type': captain.vehicle_type}
+    
+    def load(self):
+        head = self._head_seq()
+        self.synced_at = datetime.utcnow()
+        captains = {
+            captain.captain_id: self._captain_attributes(captain)
+            for captain in db.session.query(
+                Captain.captain_id, Captain.name, Captain.status, Captain.vehicle_type
+            ).yield_per(1000)
+        }
+        locations = CaptainLocation.query.all()
+        with self._lock:
+            self._captains = captains
+            for location in locations:
+                self.grid.upsert(location.captain_id, location.lat, location.lon, location.reported_at)
+            self.last_seq = head
+    
+    def _sync(self):
+        """Apply captain changes and other workers' persisted positions since the last sync."""
+        synced_at = datetime.utcnow()
+        changes = db.session.query(ChangeLogEntry.seq, ChangeLogEntry.entity_id).filter(
+            ChangeLogEntry.resource == 'captains',
+            ChangeLogEntry.seq > self.last_seq
+        ).order_by(ChangeLogEntry.seq).all()
+        changed_ids = {change.entity_id for change in changes}
+        rows = {
+            row.captain_id: self._captain_attributes(row)
+            for row in db.session.query(
+                Captain.captain_id, Captain.name, Captain.status, Captain.vehicle_type
+            ).filter(Captain.captain_id.in_(changed_ids)).all()
+        } if changed_ids else {}
+        locations = CaptainLocation.query.filter(CaptainLocation.persisted_at >= self.synced_at - SYNC_OVERLAP).all()
+        
+        with self._lock:
+            for captain_id in changed_ids:
+                if captain_id in rows:
+                    self._captains[captain_id] = rows[captain_id]
+                else:
+                    self._captains.pop(captain_id, None)
+                    self.grid.remove(captain_id)
+                    self._dirty.discard(captain_id)
+            for location in locations:
+                if location.captain_id in self._captains:
+                    self.grid.upsert(location.captain_id, location.lat, location.lon, location.reported_at)
+            if changes:
+                self.last_seq = changes[-1].seq
+            self.synced_at = synced_at
+    
+    def ingest(self, pings):
+        """Apply (captain_id, lat, lon, reported_at) pings, keeping only the newest position per captain."""
+        self._sync()
+        accepted = stale = unknown = 0
+        with self._lock:
+            for captain_id, lat, lon, reported_at in pings:
+                if captain_id not in self._captains:
+                    unknown += 1
+                elif self.grid.upsert(captain_id, lat, lon, reported_at):
+                    self._dirty.add(captain_id)
+                    accepted += 1
+                else:
+                    stale += 1
+        if self.persisted_at is None or time.time() - self.persisted_at >= self.persist_seconds:
+            self.persist()
+        return {'accepted': accepted, 'stale': stale, 'unknown_captain': unknown}
+    
+    def persist(self):
+        """Write the positions changed since the last persist, one executemany per statement."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            positions = {captain_id: self.grid.get(captain_id) for captain_id in dirty}
+        self.persisted_at = time.time()
+        if not positions:
+            return 0
+        
+        now = datetime.utcnow()
+        rows = [
+            {'b_captain_id': captain_id, 'b_lat': lat, 'b_lon': lon, 'b_reported_at': reported_at, 'b_persisted_at': now}
+            for captain_id, (lat, lon, reported_at, _) in positions.items()
+        ]
+        try:
+            existing = {
+                row.captain_id for row in db.session.query(CaptainLocation.captain_id).filter(
+                    CaptainLocation.captain_id.in_(list(positions))
+                ).all()
+            }
+            table = CaptainLocation.__table__
+            updates = [row for row in rows if row['b_captain_id'] in existing]
+            inserts = [
+                {key[2:]: value for key, value in row.items()}
+                for row in rows if row['b_captain_id'] not in existing
+            ]
+            if updates:
+                db.session.execute(update(table).where(
+                    table.c.captain_id == bindparam('b_captain_id'),
+                    table.c.reported_at < bindparam('b_reported_at')
+                ).values(
+                    lat=bindparam('b_lat'), lon=bindparam('b_lon'),
+                    reported_at=bindparam('b_reported_at'), persisted_at=bindparam('b_persisted_at')
+                ), updates)
+            if inserts:
+                db.session.execute(table.insert(), inserts)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Retry these positions with the next persist
+            with self._lock:
+                self._dirty |= dirty
+            raise
+        return len(rows)
+    
+    def nearest(self, lat, lon, k=5, vehicle_type=None, max_km=None):
+        """Return (captains, lookup_ms) for the k closest active captains with a recent position."""
+        self._sync()
+        fresh_after = datetime.utcnow() - timedelta(seconds=self.max_age_seconds)
+        
+        def accept(captain_id):
+            captain = self._captains.get(captain_id)
+            return (
+                captain is not None
+                and captain['status'] == CaptainStatus.ACTIVE
+                and (vehicle_type is None or captain['vehicle_type'] == vehicle_type)
+                and self.grid.get(captain_id)[2] >= fresh_after
+            )
+        
+        with self._lock:
+            started = time.perf_counter()
+            hits = self.grid.nearest(lat, lon, k, accept=accept, max_km=max_km)
+            lookup_ms = round((time.perf_counter() - started) * 1000, 3)
+            captains = [
+                {
+                    'captain_id': captain_id,
+                    'name': self._captains[captain_id]['name'],
+                    'vehicle_type': self._captains[captain_id]['vehicle_type'].value,
+                    'distance_km': round(distance, 3),
+                    'lat': captain_lat,
+                    'lon': captain_lon,
+                    'reported_at': reported_at.isoformat()
+                }
+                for distance, captain_id, captain_lat, captain_lon, reported_at in hits
+            ]
+        return captains, lookup_ms
+    
+    def stats(self):
+        with self._lock:
+            return {
+                **self.grid.stats(),
+                'pending_persist': len(self._dirty),
+                'last_seq': self.last_seq,
+                'persisted_at': datetime.utcfromtimestamp(self.persisted_at).isoformat() if self.persisted_at else None
+            }
+
+captain_locations = CaptainLocations()
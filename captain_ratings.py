@@ -0,0 +1,180 @@
+from src.models.admin_models import (
+    db, Booking, ArchivedBooking, Captain, BackfillCheckpoint, ChangeLogEntry, ChangeOperation
+)
+from src.routes.change_feed import record_changes
+from src.routes.distance_backfill import get_checkpoint
+from sqlalchemy import event, select, update, insert, case, bindparam, union_all
+from datetime import datetime
+import time
+
+DEFAULT_RATING = 5.0
+# The recent rating weights every rating by 2 ** ((booking_time - RATING_DECAY_EPOCH) / half-life).
+# Weights grow forward in time instead of shrinking, so a new rating is a plain increment of two
+# running sums and the ratio sum / weight is the same whenever it is read. Changing either
+# constant needs a recompute_captain_ratings run.
+RECENT_RATING_HALF_LIFE_DAYS = 30
+RATING_DECAY_EPOCH = datetime(2020, 1, 1)
+
+def decay_weight(booking_time):
+    days = (booking_time - RATING_DECAY_EPOCH).total_seconds() / 86400
+    return 2.0 ** (days / RECENT_RATING_HALF_LIFE_DAYS)
+
+def _captain_rating_update(captain_id, sum_delta, count_delta, recent_sum_delta, weight_delta):
+    """One UPDATE applying rating deltas; SET expressions read the pre-update values, so the means stay in step."""
+    rating_sum = Captain.rating_sum + sum_delta
+    rating_count = Captain.rating_count + count_delta
+    recent_sum = Captain.recent_rating_sum + recent_sum_delta
+    weight = Captain.recent_rating_weight + weight_delta
+    # Not a status write, so the version the admin UI holds stays valid
+    # Weights are around 1e24, so removing the last rating leaves noise far from zero in both
+    # running sums; the count decides instead, and the sums restart from exact zeros
+    rated = rating_count > 0
+    return update(Captain.__table__).where(Captain.captain_id == captain_id).values(
+        rating_sum=rating_sum,
+        rating_count=rating_count,
+        rating=case((rated, rating_sum * 1.0 / rating_count), else_=DEFAULT_RATING),
+        recent_rating_sum=case((rated, recent_sum), else_=0.0),
+        recent_rating_weight=case((rated, weight), else_=0.0),
+        recent_rating=case((rated, recent_sum / weight), else_=None)
+    )
+
+def _apply_rating_deltas(connection, removed, added):
+    """Shift captain aggregates by the (captain_id, rating, booking_time) ratings removed and added."""
+    deltas = {}
+    for sign, ratings in ((-1, removed), (1, added)):
+        for captain_id, rating, booking_time in ratings:
+            if captain_id is None or rating is None or booking_time is None:
+                continue
+            weight = decay_weight(booking_time)
+            delta = deltas.setdefault(captain_id, [0, 0, 0.0, 0.0])
+            delta[0] += sign * rating
+            delta[1] += sign
+            delta[2] += sign * rating * weight
+            delta[3] += sign * weight
+    deltas = {captain_id: delta for captain_id, delta in deltas.items() if any(delta)}
+    for captain_id, delta in deltas.items():
+        connection.execute(_captain_rating_update(captain_id, *delta))
+    if deltas:
+        now = datetime.utcnow()
+        connection.execute(insert(ChangeLogEntry.__table__), [
+            {'resource': 'captains', 'entity_id': captain_id, 'operation': ChangeOperation.UPDATED, 'changed_at': now}
+            for captain_id in deltas
+        ])
+
+def _stored_rating(connection, booking_id):
+    # The row as stored, attribute history is empty for values expired by a commit
+    row = connection.execute(select(
+        Booking.captain_id, Booking.captain_rating, Booking.booking_time
+    ).where(Booking.booking_id == booking_id)).first()
+    return [tuple(row)] if row else []
+
+def _rating_changed(booking):
+    state = db.inspect(booking)
+    return any(state.attrs[name].history.has_changes() for name in ('captain_id', 'captain_rating', 'booking_time'))
+
+@event.listens_for(Booking, 'after_insert')
+def _rate_on_insert(mapper, connection, booking):
+    _apply_rating_deltas(connection, [], [(booking.captain_id, booking.captain_rating, booking.booking_time)])
+
+@event.listens_for(Booking, 'before_update')
+def _rate_on_update(mapper, connection, booking):
+    if _rating_changed(booking):
+        _apply_rating_deltas(
+            connection,
+            _stored_rating(connection, booking.booking_id),
+            [(booking.captain_id, booking.captain_rating, booking.booking_time)]
+        )
+
+@event.listens_for(Booking, 'before_delete')
+def _rate_on_delete(mapper, connection, booking):
+    # Archiving deletes with Core statements and skips this, archived ratings keep counting
+    _apply_rating_deltas(connection, _stored_rating(connection, booking.booking_id), [])
+
+def recompute_captain_ratings(chunk_size=500, restart=False, max_chunks=None, progress=None):
+    """Rebuild the rating aggregates of every captain from live and archived bookings.
+    
+    For repairs and after changing the decay constants. Captains are processed
+    in captain_id chunks: one query streams the chunk's rated bookings, and one
+    executemany writes the chunk's totals, committed with a checkpoint so an
+    interrupted run continues after the last committed chunk.
+    """
+    checkpoint = get_checkpoint('captain_ratings')
+    if restart or checkpoint.finished_at is not None:
+        checkpoint.last_id = 0
+        checkpoint.processed_rows = 0
+        checkpoint.updated_rows = 0
+    checkpoint.started_at = datetime.utcnow()
+    checkpoint.finished_at = None
+    db.session.commit()
+    
+    total = db.session.query(db.func.count(Captain.captain_id)).filter(Captain.captain_id > checkpoint.last_id).scalar() or 0
+    table = Captain.__table__
+    statement = update(table).where(table.c.captain_id == bindparam('b_captain_id')).values(
+        rating_sum=bindparam('b_rating_sum'),
+        rating_count=bindparam('b_rating_count'),
+        rating=bindparam('b_rating'),
+        recent_rating_sum=bindparam('b_recent_rating_sum'),
+        recent_rating_weight=bindparam('b_recent_rating_weight'),
+        recent_rating=bindparam('b_recent_rating')
+    )
+    started = time.perf_counter()
+    processed = 0
+    chunks = 0
+    
+    while max_chunks is None or chunks < max_chunks:
+        captain_ids = db.session.execute(select(Captain.captain_id).where(
+            Captain.captain_id > checkpoint.last_id
+        ).order_by(Captain.captain_id).limit(chunk_size)).scalars().all()
+        if not captain_ids:
+            checkpoint.finished_at = datetime.utcnow()
+            break
+        
+        ratings = union_all(*[
+            select(model.captain_id, model.captain_rating, model.booking_time).where(
+                model.captain_id.in_(captain_ids), model.captain_rating.isnot(None)
+            )
+            for model in (Booking, ArchivedBooking)
+        ])
+        totals = {captain_id: [0, 0, 0.0, 0.0] for captain_id in captain_ids}
+        for captain_id, rating, booking_time in db.session.execute(ratings).yield_per(5000):
+            weight = decay_weight(booking_time)
+            total_row = totals[captain_id]
+            total_row[0] += rating
+            total_row[1] += 1
+            total_row[2] += rating * weight
+            total_row[3] += weight
+        
+        try:
+            db.session.execute(statement, [
+                {
+                    'b_captain_id': captain_id,
+                    'b_rating_sum': rating_sum,
+                    'b_rating_count': rating_count,
+                    'b_rating': rating_sum / rating_count if rating_count else DEFAULT_RATING,
+                    'b_recent_rating_sum': recent_sum,
+                    'b_recent_rating_weight': weight,
+                    'b_recent_rating': recent_sum / weight if rating_count else None
+                }
+                for captain_id, (rating_sum, rating_count, recent_sum, weight) in totals.items()
+            ])
+            record_changes('captains', captain_ids, ChangeOperation.UPDATED)
+            checkpoint.last_id = captain_ids[-1]
+            checkpoint.processed_rows = (checkpoint.processed_rows or 0) + len(captain_ids)
+            checkpoint.updated_rows = (checkpoint.updated_rows or 0) + sum(1 for row in totals.values() if row[1])
+            processed += len(captain_ids)
+            checkpoint.rows_per_second = round(processed / max(time.perf_counter() - started, 1e-9), 1)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        chunks += 1
+        if progress and total:
+            progress(min(processed / total, 1.0))
+    
+    db.session.commit()
+    return checkpoint.to_dict()
+
+def rating_recompute_status():
+    checkpoint = BackfillCheckpoint.query.get('captain_ratings')
+    return checkpoint.to_dict() if checkpoint else None
@@ -1,10 +1,28 @@
 from flask import Blueprint, request, jsonify
-from src.models.admin_models import db, Captain, CaptainRate, CaptainStatus, ServiceType
+from src.models.admin_models import db, Captain, CaptainRate, CaptainStatus, ServiceType, VehicleType
 from src.routes.admin_auth import token_required
+from src.routes.admission_control import admission_controlled
+from src.routes.reporting_calendar import reporting_timezone, local_today
+from src.routes.captain_leaderboard import LEADERBOARD_METRICS, captain_leaderboard, rebuild_captain_daily_stats
+from src.routes.change_feed import changes_since
+from src.routes.typeahead_index import typeahead
+from src.routes.captain_locations import captain_locations, parse_reported_at
+from src.routes.state_transitions import TransitionRejected, transition_captain, expected_version
+from src.routes.admin_audit import audit_log, state_of, transition_before
+from src.routes.fare_engine import rate_cards
+from src.routes.captain_ratings import recompute_captain_ratings, rating_recompute_status
+from src.routes.captain_utilization import captain_utilization, fleet_concurrency
+from src.routes.job_runner import job_runner
 from sqlalchemy import or_
+from datetime import date, datetime, timedelta
 
 captain_bp = Blueprint('captain', __name__)
 
+RATING_SORTS = {
+    'rating': Captain.rating,
+    'recent_rating': Captain.recent_rating
+}
+
 @captain_bp.route('/captains', methods=['GET'])
 @token_required
 def get_captains(current_admin):
@@ -15,6 +33,11 @@ def get_captains(current_admin):
         search = request.args.get('search', '')
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
+        min_rating = request.args.get('min_rating')
+        max_rating = request.args.get('max_rating')
+        min_ratings = request.args.get('min_ratings')
+        sort_by = request.args.get('sort_by')
+        sort_order = request.args.get('sort_order', 'desc')
         
         # Build query
         query = Captain.query
@@ -34,6 +57,22 @@ def get_captains(current_admin):
                 Captain.plate_number.ilike(f'%{search}%')
             ))
         
+        # Ratings are maintained on the captain row, so these use the rating indexes instead of scanning bookings
+        if min_rating is not None:
+            query = query.filter(Captain.rating >= float(min_rating))
+        if max_rating is not None:
+            query = query.filter(Captain.rating <= float(max_rating))
+        if min_ratings is not None:
+            query = query.filter(Captain.rating_count >= int(min_ratings))
+        if sort_by:
+            if sort_by not in RATING_SORTS:
+                raise ValueError(f'sort_by must be one of {", ".join(RATING_SORTS)}')
+            sort_column = RATING_SORTS[sort_by]
+            if sort_order == 'asc':
+                query = query.order_by(sort_column.asc(), Captain.captain_id)
+            else:
+                query = query.order_by(sort_column.desc(), Captain.captain_id.desc())
+        
         # Paginate
         captains = query.paginate(page=page, per_page=per_page, error_out=False)
         
@@ -45,9 +84,78 @@ def get_captains(current_admin):
             'per_page': per_page
         }), 200
         
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'message': f'Failed to fetch captains: {str(e)}'}), 500
 
+@captain_bp.route('/captains/suggest', methods=['GET'])
+@token_required
+def suggest_captains(current_admin):
+    try:
+        query = request.args.get('q', '')
+        limit = min(int(request.args.get('limit', 10)), 50)
+        
+        # Served from the in-process prefix index instead of a leading-wildcard ilike scan
+        matches, lookup_ms = typeahead.suggest('captains', query, limit)
+        
+        return jsonify({
+            'query': query,
+            'suggestions': matches,
+            'lookup_ms': lookup_ms
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch captain suggestions: {str(e)}'}), 500
+
+@captain_bp.route('/captains/locations', methods=['POST'])
+@token_required
+def ingest_captain_locations(current_admin):
+    try:
+        data = request.get_json(silent=True) or {}
+        pings = data.get('pings')
+        if not isinstance(pings, list) or not pings:
+            return jsonify({'message': 'pings must be a non-empty list'}), 400
+        if len(pings) > captain_locations.max_batch:
+            return jsonify({'message': f'At most {captain_locations.max_batch} pings per request'}), 400
+        
+        parsed = []
+        for ping in pings:
+            lat = float(ping['lat'])
+            lon = float(ping['lon'])
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                raise ValueError(f'coordinates out of range for captain {ping.get("captain_id")}')
+            parsed.append((int(ping['captain_id']), lat, lon, parse_reported_at(ping.get('reported_at'))))
+        
+        # Only the newest position per captain is kept, in memory; it is persisted periodically
+        result = captain_locations.ingest(parsed)
+        
+        return jsonify({'message': 'Locations ingested', **result}), 200
+    
+    except (KeyError, TypeError) as e:
+        return jsonify({'message': f'Invalid ping: {str(e)}'}), 400
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to ingest captain locations: {str(e)}'}), 500
+
+@captain_bp.route('/captains/changes', methods=['GET'])
+@token_required
+def get_captain_changes(current_admin):
+    try:
+        since = request.args.get('since')
+        since = int(since) if since else None
+        limit = min(int(request.args.get('limit', 500)), 5000)
+        
+        return jsonify(changes_since('captains', since, limit)), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch captain changes: {str(e)}'}), 500
+
 @captain_bp.route('/captains/<int:captain_id>', methods=['GET'])
 @token_required
 def get_captain_details(current_admin, captain_id):
@@ -88,20 +196,26 @@ def update_captain_status(current_admin, captain_id):
         if not new_status:
             return jsonify({'message': 'Status is required'}), 400
         
-        captain = Captain.query.get_or_404(captain_id)
-        
         try:
-            captain.status = CaptainStatus(new_status)
+            new_status = CaptainStatus(new_status)
         except ValueError:
             return jsonify({'message': 'Invalid status value'}), 400
         
+        captain = transition_captain(captain_id, new_status, expected_version(data))
         db.session.commit()
+        audit_log.record('captain.status', 'captain', captain_id, transition_before(captain), state_of(captain, 'status', 'version'))
         
         return jsonify({
             'message': 'Captain status updated successfully',
             'captain': captain.to_dict()
         }), 200
         
+    except TransitionRejected as rejection:
+        db.session.rollback()
+        return jsonify({'message': rejection.reason, 'current': rejection.current}), rejection.status_code
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Failed to update captain status: {str(e)}'}), 500
@@ -110,19 +224,24 @@ def update_captain_status(current_admin, captain_id):
 @token_required
 def approve_captain(current_admin, captain_id):
     try:
-        captain = Captain.query.get_or_404(captain_id)
-        
-        if captain.status != CaptainStatus.PENDING:
-            return jsonify({'message': 'Captain is not in pending status'}), 400
-        
-        captain.status = CaptainStatus.ACTIVE
+        captain = transition_captain(
+            captain_id, CaptainStatus.ACTIVE, expected_version(request.get_json(silent=True)),
+            from_statuses=[CaptainStatus.PENDING]
+        )
         db.session.commit()
+        audit_log.record('captain.approve', 'captain', captain_id, transition_before(captain), state_of(captain, 'status', 'version'))
         
         return jsonify({
             'message': 'Captain approved successfully',
             'captain': captain.to_dict()
         }), 200
         
+    except TransitionRejected as rejection:
+        db.session.rollback()
+        return jsonify({'message': rejection.reason, 'current': rejection.current}), rejection.status_code
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Failed to approve captain: {str(e)}'}), 500
@@ -131,19 +250,24 @@ def approve_captain(current_admin, captain_id):
 @token_required
 def reject_captain(current_admin, captain_id):
     try:
-        captain = Captain.query.get_or_404(captain_id)
-        
-        if captain.status != CaptainStatus.PENDING:
-            return jsonify({'message': 'Captain is not in pending status'}), 400
-        
-        captain.status = CaptainStatus.DEACTIVATED
+        captain = transition_captain(
+            captain_id, CaptainStatus.DEACTIVATED, expected_version(request.get_json(silent=True)),
+            from_statuses=[CaptainStatus.PENDING]
+        )
         db.session.commit()
+        audit_log.record('captain.reject', 'captain', captain_id, transition_before(captain), state_of(captain, 'status', 'version'))
         
         return jsonify({
             'message': 'Captain rejected successfully',
             'captain': captain.to_dict()
         }), 200
         
+    except TransitionRejected as rejection:
+        db.session.rollback()
+        return jsonify({'message': rejection.reason, 'current': rejection.current}), rejection.status_code
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Failed to reject captain: {str(e)}'}), 500
@@ -180,6 +304,8 @@ def update_captain_rates(current_admin, captain_id):
             service_type=ServiceType(service_type)
         ).first()
         
+        rate_fields = ('service_type', 'rate_per_km', 'minimum_fare', 'waiting_time_rate')
+        before = state_of(existing_rate, *rate_fields) if existing_rate else None
         if existing_rate:
             # Update existing rate
             existing_rate.rate_per_km = rate_per_km
@@ -197,6 +323,9 @@ def update_captain_rates(current_admin, captain_id):
             db.session.add(new_rate)
         
         db.session.commit()
+        # Every worker reloads its cached rate cards before the next fare computation
+        rate_cards.invalidate()
+        audit_log.record('captain.rates', 'captain', captain_id, before, state_of(existing_rate or new_rate, *rate_fields))
         
         return jsonify({'message': 'Captain rates updated successfully'}), 200
         
@@ -215,3 +344,154 @@ def get_pending_captains_count(current_admin):
         
     except Exception as e:
         return jsonify({'message': f'Failed to fetch pending captains count: {str(e)}'}), 500
+
+@captain_bp.route('/captains/leaderboard', methods=['GET'])
+@token_required
+@admission_controlled('report')
+def get_captain_leaderboard(current_admin):
+    try:
+        metric = request.args.get('metric', 'trips')
+        limit = min(int(request.args.get('limit', 10)), 100)
+        min_trips = int(request.args.get('min_trips', 1))
+        vehicle_type_filter = request.args.get('vehicle_type')
+        service_type_filter = request.args.get('service_type')
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        
+        if metric not in LEADERBOARD_METRICS:
+            return jsonify({'message': f'Invalid metric, expected one of {", ".join(LEADERBOARD_METRICS)}'}), 400
+        
+        # Windows are local days of the reporting timezone (default to last 30 days)
+        date_to = date.fromisoformat(date_to) if date_to else local_today(reporting_timezone())
+        date_from = date.fromisoformat(date_from) if date_from else date_to - timedelta(days=29)
+        
+        leaderboard = captain_leaderboard(
+            metric,
+            date_from,
+            date_to,
+            limit=limit,
+            vehicle_type=VehicleType(vehicle_type_filter) if vehicle_type_filter else None,
+            service_type=ServiceType(service_type_filter) if service_type_filter else None,
+            min_trips=min_trips
+        )
+        
+        return jsonify({
+            'leaderboard': leaderboard,
+            'metric': metric,
+            'date_range': {
+                'from': date_from.isoformat(),
+                'to': date_to.isoformat()
+            }
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch captain leaderboard: {str(e)}'}), 500
+
+@captain_bp.route('/captains/<int:captain_id>/utilization', methods=['GET'])
+@token_required
+@admission_controlled('report')
+def get_captain_utilization(current_admin, captain_id):
+    try:
+        Captain.query.get_or_404(captain_id)
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        
+        # Local days of the reporting timezone (default to last 30 days)
+        date_to = date.fromisoformat(date_to) if date_to else local_today(reporting_timezone())
+        date_from = date.fromisoformat(date_from) if date_from else date_to - timedelta(days=29)
+        if (date_to - date_from).days > 366:
+            return jsonify({'message': 'Date range cannot exceed one year'}), 400
+        
+        # Busy time is the union of the captain's trip intervals, overlapping trips count once
+        utilization = captain_utilization(captain_id, date_from, date_to)
+        
+        return jsonify({
+            'captain_id': captain_id,
+            **utilization,
+            'date_range': {
+                'from': date_from.isoformat(),
+                'to': date_to.isoformat()
+            }
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch captain utilization: {str(e)}'}), 500
+
+@captain_bp.route('/captains/utilization/fleet', methods=['GET'])
+@token_required
+@admission_controlled('report')
+def get_fleet_utilization(current_admin):
+    try:
+        bucket_minutes = int(request.args.get('bucket_minutes', 60))
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        
+        # Local days of the reporting timezone (default to last 7 days)
+        date_to = date.fromisoformat(date_to) if date_to else local_today(reporting_timezone())
+        date_from = date.fromisoformat(date_from) if date_from else date_to - timedelta(days=6)
+        if (date_to - date_from).days > 92:
+            return jsonify({'message': 'Date range cannot exceed 92 days'}), 400
+        
+        concurrency = fleet_concurrency(date_from, date_to, bucket_minutes)
+        
+        return jsonify({
+            **concurrency,
+            'date_range': {
+                'from': date_from.isoformat(),
+                'to': date_to.isoformat()
+            }
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch fleet utilization: {str(e)}'}), 500
+
+@captain_bp.route('/captains/leaderboard/rebuild', methods=['POST'])
+@token_required
+def rebuild_captain_leaderboard(current_admin):
+    try:
+        rows = rebuild_captain_daily_stats()
+        return jsonify({'message': 'Captain leaderboard rebuilt successfully', 'rows': rows}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Failed to rebuild captain leaderboard: {str(e)}'}), 500
+
+@job_runner.job('captain_rating_recompute')
+def run_captain_rating_recompute_job(params, progress):
+    return recompute_captain_ratings(
+        chunk_size=params.get('chunk_size', 500),
+        restart=params.get('restart', False),
+        progress=progress
+    )
+
+@captain_bp.route('/captains/ratings/recompute', methods=['POST'])
+@token_required
+def recompute_ratings(current_admin):
+    try:
+        data = request.get_json(silent=True) or {}
+        chunk_size = int(data.get('chunk_size', 500))
+        if chunk_size < 1 or chunk_size > 10000:
+            return jsonify({'message': 'chunk_size must be between 1 and 10000'}), 400
+        
+        # The checkpoint is part of the dedupe key, so a finished run does not swallow the next one
+        job, created = job_runner.submit('captain_rating_recompute', {
+            'chunk_size': chunk_size,
+            'restart': bool(data.get('restart', False)),
+            'checkpoint': rating_recompute_status()
+        }, submitted_by=current_admin.admin_id)
+        
+        return jsonify({
+            'message': 'Captain rating recompute submitted' if created else 'Identical captain rating recompute already exists',
+            'job': job.to_dict()
+        }), 202
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to submit captain rating recompute: {str(e)}'}), 500
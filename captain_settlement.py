@@ -0,0 +1,118 @@
+from src.models.admin_models import (
+    db, Booking, ArchivedBooking, Captain, SettlementBatch, SettlementLine, BookingStatus, PaymentMethod
+)
+from src.models.admin_models import ChangeOperation
+from src.routes.change_feed import record_changes
+from sqlalchemy import func, case, insert, select, update, union_all, literal
+import csv
+import io
+
+SETTLEMENT_CSV_COLUMNS = [
+    'batch_id', 'captain_id', 'captain_name', 'booking_count', 'earnings', 'cash_collected', 'balance'
+]
+
+def create_settlement(period_start, period_end, created_by=None):
+    """Settle every unsettled completed booking in [period_start, period_end) in one batch.
+    
+    Bookings are claimed with a single UPDATE first and the lines are then
+    aggregated from exactly the claimed rows, so a booking completed while the
+    batch runs is either fully in it or left for the next run. Archived bookings
+    are claimed the same way, so a booking the archive job moved before it was
+    settled is still paid out. Returns None when there is nothing new to settle.
+    """
+    try:
+        batch = SettlementBatch(period_start=period_start, period_end=period_end, created_by=created_by)
+        db.session.add(batch)
+        db.session.flush()
+        
+        claimed = db.session.execute(update(Booking.__table__).where(
+            Booking.status == BookingStatus.COMPLETED,
+            Booking.settlement_batch_id.is_(None),
+            Booking.captain_id.isnot(None),
+            Booking.booking_time >= period_start,
+            Booking.booking_time < period_end
+        ).values(settlement_batch_id=batch.batch_id, version=Booking.version + 1)).rowcount
+        claimed += db.session.execute(update(ArchivedBooking.__table__).where(
+            ArchivedBooking.status == BookingStatus.COMPLETED,
+            ArchivedBooking.settlement_batch_id.is_(None),
+            ArchivedBooking.captain_id.isnot(None),
+            ArchivedBooking.booking_time >= period_start,
+            ArchivedBooking.booking_time < period_end
+        ).values(settlement_batch_id=batch.batch_id)).rowcount
+        
+        if not claimed:
+            db.session.rollback()
+            return None
+        record_changes('bookings', db.session.scalars(
+            select(Booking.booking_id).where(Booking.settlement_batch_id == batch.batch_id)
+        ).all(), ChangeOperation.UPDATED)
+        
+        claimed_rows = union_all(*[
+            select(
+                model.captain_id,
+                model.booking_id,
+                model.captain_earning,
+                case((model.payment_method == PaymentMethod.CASH, model.final_fare), else_=0).label('cash')
+            ).where(model.settlement_batch_id == batch.batch_id)
+            for model in (Booking, ArchivedBooking)
+        ]).subquery()
+        earnings = func.coalesce(func.sum(claimed_rows.c.captain_earning), 0)
+        cash_collected = func.coalesce(func.sum(claimed_rows.c.cash), 0)
+        db.session.execute(insert(SettlementLine.__table__).from_select(
+            ['batch_id', 'captain_id', 'booking_count', 'earnings', 'cash_collected', 'balance'],
+            select(
+                literal(batch.batch_id),
+                claimed_rows.c.captain_id,
+                func.count(claimed_rows.c.booking_id),
+                earnings,
+                cash_collected,
+                earnings - cash_collected
+            ).group_by(claimed_rows.c.captain_id)
+        ))
+        
+        totals = db.session.query(
+            func.count(SettlementLine.line_id),
+            func.coalesce(func.sum(SettlementLine.booking_count), 0),
+            func.coalesce(func.sum(SettlementLine.earnings), 0),
+            func.coalesce(func.sum(SettlementLine.cash_collected), 0),
+            func.coalesce(func.sum(SettlementLine.balance), 0)
+        ).filter(SettlementLine.batch_id == batch.batch_id).one()
+        batch.captain_count, batch.booking_count, batch.total_earnings, batch.total_cash_collected, batch.net_payable = totals
+        
+        db.session.commit()
+        return batch
+    except Exception:
+        db.session.rollback()
+        raise
+
+def stream_settlement_csv(batch_id, chunk_size=1000):
+    """Yield a settlement batch as CSV text chunks without loading all lines in memory."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SETTLEMENT_CSV_COLUMNS)
+    
+    rows = db.session.query(
+        SettlementLine.batch_id,
+        SettlementLine.captain_id,
+        Captain.name,
+        SettlementLine.booking_count,
+        SettlementLine.earnings,
+        SettlementLine.cash_collected,
+        SettlementLine.balance
+    ).outerjoin(
+        Captain, Captain.captain_id == SettlementLine.captain_id
+    ).filter(
+        SettlementLine.batch_id == batch_id
+    ).order_by(SettlementLine.line_id).yield_per(chunk_size)
+    
+    for index, row in enumerate(rows, 1):
+        writer.writerow([
+            row.batch_id, row.captain_id, row.name, row.booking_count,
+            round(row.earnings, 2), round(row.cash_collected, 2), round(row.balance, 2)
+        ])
+        if index % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    
+    yield buffer.getvalue()
@@ -0,0 +1,328 @@
+from src.models.admin_models import (
+    db, Booking, ArchivedBooking, CaptainUtilizationDaily, FleetConcurrencyBucket, CalendarDay, BookingStatus
+)
+from src.routes.reporting_calendar import reporting_timezone, ensure_calendar, local_today
+from sqlalchemy import func, select, delete, insert, union_all
+from datetime import datetime, timedelta
+import bisect
+import heapq
+import math
+
+BUCKET_MINUTES = 15
+# Trips are capped at this length: it bounds the start_time range scanned for a day and keeps
+# a trip that was never closed from counting as busy for days
+MAX_TRIP_DURATION = timedelta(hours=24)
+# Days are recomputed on read until this long after they end, late trip end times land in time
+FINALIZE_AFTER = timedelta(days=1)
+
+def _interval_source(range_start, range_end):
+    """Trip intervals overlapping [range_start, range_end) of live and archived bookings, by captain and start."""
+    columns = ('captain_id', 'start_time', 'end_time')
+    selects = [
+        select(*[model.__table__.c[name] for name in columns]).where(
+            model.start_time >= range_start - MAX_TRIP_DURATION,
+            model.start_time < range_end,
+            model.end_time > range_start,
+            model.end_time > model.start_time,
+            model.captain_id.isnot(None),
+            model.status != BookingStatus.CANCELLED
+        )
+        for model in (Booking, ArchivedBooking)
+    ]
+    source = union_all(*selects).subquery()
+    return select(source.c.captain_id, source.c.start_time, source.c.end_time).order_by(
+        source.c.captain_id, source.c.start_time
+    )
+
+class _CaptainDay:
+    """Sweep state of one captain and day; pieces must arrive in start order."""
+    
+    def __init__(self):
+        self.trips = 0
+        self.busy_seconds = 0.0
+        self.peak = 0
+        self.first_start = None
+        self.last_end = None
+        self._ends = []
+        self._run_start = None
+        self._run_end = None
+    
+    def add(self, start, end):
+        self.trips += 1
+        if self.first_start is None:
+            self.first_start = start
+        self.last_end = end if self.last_end is None else max(self.last_end, end)
+        # Union of intervals: extend the current busy run or close it and open a new one
+        if self._run_end is None or start > self._run_end:
+            self._close_run()
+            self._run_start, self._run_end = start, end
+        else:
+            self._run_end = max(self._run_end, end)
+        # Concurrency: trips still running when this one starts
+        while self._ends and self._ends[0] <= start:
+            heapq.heappop(self._ends)
+        heapq.heappush(self._ends, end)
+        self.peak = max(self.peak, len(self._ends))
+    
+    def _close_run(self):
+        if self._run_end is not None:
+            self.busy_seconds += (self._run_end - self._run_start).total_seconds()
+        self._run_start = self._run_end = None
+    
+    def finish(self):
+        self._close_run()
+        return self
+
+def _fleet_buckets(day_start, day_end, pieces):
+    """Peak and time-weighted mean of trips in progress per bucket, pieces sorted by start.
+    
+    Classic sweep-line: a min-heap holds the end times of running trips, and the
+    clock only moves forward between consecutive start and end events.
+    """
+    width = timedelta(minutes=BUCKET_MINUTES)
+    count = math.ceil((day_end - day_start) / width)
+    area = [0.0] * count
+    peak = [0] * count
+    clock = day_start
+    running = 0
+    
+    def advance(until):
+        nonlocal clock
+        while clock < until:
+            index = int((clock - day_start) / width)
+            boundary = min(day_start + (index + 1) * width, day_end, until)
+            area[index] += running * (boundary - clock).total_seconds()
+            peak[index] = max(peak[index], running)
+            clock = boundary
+    
+    ends = []
+    for start, end in pieces:
+        while ends and ends[0] <= start:
+            advance(heapq.heappop(ends))
+            running -= 1
+        advance(start)
+        running += 1
+        heapq.heappush(ends, end)
+    while ends:
+        advance(heapq.heappop(ends))
+        running -= 1
+    advance(day_end)
+    
+    buckets = []
+    for index in range(count):
+        bucket_start = day_start + index * width
+        seconds = (min(bucket_start + width, day_end) - bucket_start).total_seconds()
+        buckets.append((bucket_start, peak[index], area[index] / seconds))
+    return buckets
+
+def rollup_utilization_days(local_dates):
+    """Recompute captain busy time and fleet concurrency of the given local days in one pass.
+    
+    Intervals are streamed once, ordered by captain and start time, and split
+    at local midnight; a trip across midnight counts towards both days. Every
+    day gets its fleet buckets, also when it had no trips, so empty days are
+    not rescanned.
+    """
+    if not local_dates:
+        return 0
+    tz_name = reporting_timezone()
+    ensure_calendar(tz_name, min(local_dates), max(local_dates))
+    days = CalendarDay.query.filter(
+        CalendarDay.tz == tz_name,
+        CalendarDay.local_date.in_(local_dates)
+    ).order_by(CalendarDay.utc_start).all()
+    day_starts = [day.utc_start for day in days]
+    
+    captain_days = {}
+    pieces = {day.local_date: [] for day in days}
+    current_captain = None
+    open_days = {}
+    rows = db.session.execute(_interval_source(days[0].utc_start, days[-1].utc_end)).yield_per(1000)
+    for captain_id, start, end in rows:
+        if captain_id != current_captain:
+            captain_days.update(((current_captain, local_date), sweep.finish()) for local_date, sweep in open_days.items())
+            current_captain = captain_id
+            open_days = {}
+        end = min(end, start + MAX_TRIP_DURATION)
+        # Requested days overlapping the trip, a gap in local_dates is skipped
+        index = max(bisect.bisect_right(day_starts, start) - 1, 0)
+        while index < len(days) and days[index].utc_start < end:
+            day = days[index]
+            piece = (max(start, day.utc_start), min(end, day.utc_end))
+            if piece[0] < piece[1]:
+                open_days.setdefault(day.local_date, _CaptainDay()).add(*piece)
+                pieces[day.local_date].append(piece)
+            index += 1
+    captain_days.update(((current_captain, local_date), sweep.finish()) for local_date, sweep in open_days.items())
+    
+    now = datetime.utcnow()
+    buckets = []
+    for day in days:
+        day_pieces = sorted(pieces[day.local_date])
+        buckets.extend(
+            {
+                'bucket_start': bucket_start,
+                'stat_date': day.local_date,
+                'peak_trips': peak_trips,
+                'mean_trips': mean_trips,
+                'computed_at': now
+            }
+            for bucket_start, peak_trips, mean_trips in _fleet_buckets(day.utc_start, day.utc_end, day_pieces)
+        )
+    
+    try:
+        db.session.execute(delete(CaptainUtilizationDaily.__table__).where(
+            CaptainUtilizationDaily.stat_date.in_(local_dates)
+        ))
+        db.session.execute(delete(FleetConcurrencyBucket.__table__).where(
+            FleetConcurrencyBucket.stat_date.in_(local_dates)
+        ))
+        if captain_days:
+            db.session.execute(insert(CaptainUtilizationDaily.__table__), [
+                {
+                    'captain_id': captain_id,
+                    'stat_date': local_date,
+                    'trips': sweep.trips,
+                    'busy_seconds': sweep.busy_seconds,
+                    'peak_concurrency': sweep.peak,
+                    'first_start': sweep.first_start,
+                    'last_end': sweep.last_end,
+                    'computed_at': now
+                }
+                for (captain_id, local_date), sweep in captain_days.items()
+            ])
+        db.session.execute(insert(FleetConcurrencyBucket.__table__), buckets)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(days)
+
+def invalidate_utilization(start_time, end_time):
+    """Drop the rollups of the local days a trip touches, they are rebuilt on the next read.
+    
+    Called from booking status changes before the commit, since cancelled trips
+    do not count as busy time.
+    """
+    if not start_time or not end_time:
+        return
+    end_time = min(end_time, start_time + MAX_TRIP_DURATION)
+    local_dates = [row.local_date for row in db.session.query(CalendarDay.local_date).filter(
+        CalendarDay.tz == reporting_timezone(),
+        CalendarDay.utc_start < end_time,
+        CalendarDay.utc_end > start_time
+    ).all()]
+    if local_dates:
+        db.session.execute(delete(CaptainUtilizationDaily.__table__).where(
+            CaptainUtilizationDaily.stat_date.in_(local_dates)
+        ))
+        db.session.execute(delete(FleetConcurrencyBucket.__table__).where(
+            FleetConcurrencyBucket.stat_date.in_(local_dates)
+        ))
+
+def _ensure_days(date_from, date_to):
+    """Roll up the local days in the range that have no rollup yet or were rolled up before they were final."""
+    tz_name = reporting_timezone()
+    ensure_calendar(tz_name, date_from, date_to)
+    days = CalendarDay.query.filter(
+        CalendarDay.tz == tz_name,
+        CalendarDay.local_date >= date_from,
+        CalendarDay.local_date <= date_to
+    ).order_by(CalendarDay.local_date).all()
+    computed_at = dict(db.session.query(
+        FleetConcurrencyBucket.stat_date, func.min(FleetConcurrencyBucket.computed_at)
+    ).filter(
+        FleetConcurrencyBucket.stat_date >= date_from,
+        FleetConcurrencyBucket.stat_date <= date_to
+    ).group_by(FleetConcurrencyBucket.stat_date).all())
+    stale = [
+        day.local_date for day in days
+        if day.local_date not in computed_at or computed_at[day.local_date] < day.utc_end + FINALIZE_AFTER
+    ]
+    return days, rollup_utilization_days(stale)
+
+def captain_utilization(captain_id, date_from, date_to):
+    """Daily busy time of one captain; only days without a final rollup touch the bookings table."""
+    date_to = min(date_to, local_today(reporting_timezone()))
+    if date_from > date_to:
+        return {'days': [], 'totals': {}, 'recomputed_days': 0}
+    days, recomputed = _ensure_days(date_from, date_to)
+    stored = {
+        row.stat_date: row for row in CaptainUtilizationDaily.query.filter(
+            CaptainUtilizationDaily.captain_id == captain_id,
+            CaptainUtilizationDaily.stat_date >= date_from,
+            CaptainUtilizationDaily.stat_date <= date_to
+        ).all()
+    }
+    
+    result = []
+    busy_seconds = 0.0
+    day_seconds = 0.0
+    trips = 0
+    peak = 0
+    for day in days:
+        row = stored.get(day.local_date)
+        # 23 or 25 hours on DST changes
+        seconds = (day.utc_end - day.utc_start).total_seconds()
+        entry = row.to_dict() if row else {
+            'date': day.local_date.isoformat(), 'trips': 0, 'busy_seconds': 0.0,
+            'peak_concurrency': 0, 'first_start': None, 'last_end': None
+        }
+        entry['busy_share'] = round(entry['busy_seconds'] / seconds, 4)
+        result.append(entry)
+        busy_seconds += row.busy_seconds if row else 0
+        day_seconds += seconds
+        trips += row.trips if row else 0
+        peak = max(peak, row.peak_concurrency if row else 0)
+    
+    return {
+        'days': result,
+        'totals': {
+            'trips': trips,
+            'busy_seconds': round(busy_seconds, 1),
+            'busy_hours': round(busy_seconds / 3600, 2),
+            'busy_share': round(busy_seconds / day_seconds, 4) if day_seconds else None,
+            'peak_concurrency': peak
+        },
+        'recomputed_days': recomputed
+    }
+
+def fleet_concurrency(date_from, date_to, bucket_minutes=60):
+    """Fleet-wide trips in progress over time, stored buckets merged into bucket_minutes steps."""
+    if bucket_minutes % BUCKET_MINUTES or not BUCKET_MINUTES <= bucket_minutes <= 1440:
+        raise ValueError(f'bucket_minutes must be a multiple of {BUCKET_MINUTES} up to 1440')
+    date_to = min(date_to, local_today(reporting_timezone()))
+    if date_from > date_to:
+        return {'series': [], 'peak': None, 'recomputed_days': 0}
+    days, recomputed = _ensure_days(date_from, date_to)
+    day_starts = {day.local_date: day.utc_start for day in days}
+    width = timedelta(minutes=bucket_minutes)
+    
+    merged = {}
+    for row in FleetConcurrencyBucket.query.filter(
+        FleetConcurrencyBucket.stat_date >= date_from,
+        FleetConcurrencyBucket.stat_date <= date_to
+    ).order_by(FleetConcurrencyBucket.bucket_start).all():
+        # Steps restart at every local midnight, so a day never shares a step with the next one
+        day_start = day_starts[row.stat_date]
+        step_start = day_start + int((row.bucket_start - day_start) / width) * width
+        step = merged.setdefault(step_start, {'peak_trips': 0, 'area': 0.0, 'buckets': 0})
+        step['peak_trips'] = max(step['peak_trips'], row.peak_trips)
+        step['area'] += row.mean_trips
+        step['buckets'] += 1
+    
+    series = [
+        {
+            'bucket_start': step_start.isoformat(),
+            'peak_trips': step['peak_trips'],
+            'mean_trips': round(step['area'] / step['buckets'], 3)
+        }
+        for step_start, step in merged.items()
+    ]
+    peak = max(series, key=lambda point: point['peak_trips'], default=None)
+    return {
+        'series': series,
+        'peak': {'bucket_start': peak['bucket_start'], 'peak_trips': peak['peak_trips']} if peak else None,
+        'bucket_minutes': bucket_minutes,
+        'recomputed_days': recomputed
+    }
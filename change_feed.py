@@ -0,0 +1,119 @@
+from src.models.admin_models import db, RoutingSession, AppUser, Captain, Booking, ChangeLogEntry, ChangeOperation
+from sqlalchemy import event, func, insert
+from datetime import datetime
+
+# Resources clients can delta-sync, keyed by the name used in /<resource>/changes
+SYNCED_RESOURCES = {
+    'users': AppUser,
+    'captains': Captain,
+    'bookings': Booking
+}
+_RESOURCE_BY_MODEL = {model: resource for resource, model in SYNCED_RESOURCES.items()}
+
+def _entity_id(obj):
+    # identity is not assigned to new objects until the flush completes, read the key attribute instead
+    return db.inspect(obj).mapper.primary_key_from_instance(obj)[0]
+
+def record_changes(resource, entity_ids, operation):
+    """Append change log rows for writes that bypass the ORM unit of work (bulk UPDATE/DELETE)."""
+    rows = [
+        {'resource': resource, 'entity_id': entity_id, 'operation': operation, 'changed_at': datetime.utcnow()}
+        for entity_id in entity_ids
+    ]
+    if rows:
+        db.session.execute(insert(ChangeLogEntry.__table__), rows)
+
+def _log_flush(session, flush_context):
+    changes = []
+    for obj in session.new:
+        if type(obj) in _RESOURCE_BY_MODEL:
+            changes.append((_RESOURCE_BY_MODEL[type(obj)], _entity_id(obj), ChangeOperation.CREATED))
+    for obj in session.dirty:
+        if type(obj) in _RESOURCE_BY_MODEL and session.is_modified(obj, include_collections=False):
+            changes.append((_RESOURCE_BY_MODEL[type(obj)], _entity_id(obj), ChangeOperation.UPDATED))
+    for obj in session.deleted:
+        if type(obj) in _RESOURCE_BY_MODEL:
+            changes.append((_RESOURCE_BY_MODEL[type(obj)], _entity_id(obj), ChangeOperation.DELETED))
+    
+    if changes:
+        # Same connection and transaction as the flush, so the log commits or rolls back with the rows
+        now = datetime.utcnow()
+        session.connection().execute(insert(ChangeLogEntry.__table__), [
+            {'resource': resource, 'entity_id': entity_id, 'operation': operation, 'changed_at': now}
+            for resource, entity_id, operation in changes
+        ])
+
+class ChangeFeed:
+    """Record every ORM insert, update and delete of the synced models in change_log.
+    
+    Sequence numbers come from an AUTOINCREMENT key, so they only grow and a
+    client that stores the last seq it saw can ask for everything after it.
+    """
+    
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        if not event.contains(RoutingSession, 'after_flush', _log_flush):
+            event.listen(RoutingSession, 'after_flush', _log_flush)
+        app.extensions['change_feed'] = self
+
+change_feed = ChangeFeed()
+
+def changes_since(resource, since=None, limit=500):
+    """Net changes of one resource after `since`, at most `limit` log entries per call.
+    
+    Several changes to the same entity collapse into one: created (possibly
+    updated afterwards), updated, or deleted. An entity created and deleted
+    within the window is left out. Rows that are no longer in the live table
+    (e.g. moved to the archive by a bulk delete) are reported as deleted.
+    Without `since` only the current cursor is returned, to be fetched before
+    the initial full load.
+    """
+    model = SYNCED_RESOURCES[resource]
+    if since is None:
+        head = db.session.query(func.max(ChangeLogEntry.seq)).filter(ChangeLogEntry.resource == resource).scalar()
+        return {'created': [], 'updated': [], 'deleted': [], 'cursor': head or 0, 'has_more': False}
+    
+    entries = db.session.query(
+        ChangeLogEntry.seq, ChangeLogEntry.entity_id, ChangeLogEntry.operation
+    ).filter(
+        ChangeLogEntry.resource == resource,
+        ChangeLogEntry.seq > since
+    ).order_by(ChangeLogEntry.seq).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    
+    # entity_id -> (first operation, last operation) within the window
+    net = {}
+    for entry in entries:
+        first = net[entry.entity_id][0] if entry.entity_id in net else entry.operation
+        net[entry.entity_id] = (first, entry.operation)
+    
+    created_ids, updated_ids, deleted_ids = [], [], []
+    for entity_id, (first, last) in net.items():
+        if last == ChangeOperation.DELETED:
+            if first != ChangeOperation.CREATED:
+                deleted_ids.append(entity_id)
+        elif first == ChangeOperation.CREATED:
+            created_ids.append(entity_id)
+        else:
+            updated_ids.append(entity_id)
+    
+    primary_key = db.inspect(model).primary_key[0]
+    rows = {}
+    if created_ids or updated_ids:
+        rows = {
+            _entity_id(row): row
+            for row in model.query.filter(primary_key.in_(created_ids + updated_ids)).all()
+        }
+    deleted_ids.extend(entity_id for entity_id in created_ids + updated_ids if entity_id not in rows)
+    
+    return {
+        'created': [rows[entity_id].to_dict() for entity_id in created_ids if entity_id in rows],
+        'updated': [rows[entity_id].to_dict() for entity_id in updated_ids if entity_id in rows],
+        'deleted': sorted(deleted_ids),
+        'cursor': entries[-1].seq if entries else since,
+        'has_more': has_more
+    }
@@ -1,24 +1,40 @@
 from flask import Blueprint, request, jsonify
-from src.models.admin_models import db, AppUser, Captain, Booking, Payment, UserStatus, CaptainStatus, BookingStatus
+from src.models.admin_models import db, AppUser, Captain, Booking, Payment, UserStatus, CaptainStatus, BookingStatus, CalendarDay
+from src.models.admin_models import ServiceType, VehicleType
 from src.routes.admin_auth import token_required
-from sqlalchemy import func, desc
+from src.routes.single_flight import single_flight, single_flight_group
+from src.routes.shared_state import metric_totals
+from src.routes.admission_control import admission_controlled, admission_stats
+from src.routes.typeahead_index import typeahead
+from src.routes.captain_locations import captain_locations
+from src.routes.booking_archive import bookings_source
+from src.routes.reporting_calendar import (
+    parse_calendar_args, reporting_timezone, local_today, local_range_utc,
+    ensure_calendar, bucket_column, bucket_start, calendar_join
+)
+from sqlalchemy import func, desc, select, literal, null, cast, String, union_all, and_, or_
 from datetime import datetime, timedelta
 
 dashboard_bp = Blueprint("dashboard", __name__)
 
 @dashboard_bp.route("/overview", methods=["GET"])
 @token_required
+@admission_controlled('report')
+@single_flight()
 def get_dashboard_overview(current_admin):
     try:
-        # Get current date for filtering
-        today = datetime.now().date()
-        this_month_start = datetime(today.year, today.month, 1)
+        # Get current local date and its UTC boundaries for filtering
+        tz_name = reporting_timezone(request.args.get('tz'))
+        today = local_today(tz_name)
+        today_start, today_end = local_range_utc(tz_name, today, today)
+        this_month_start, _ = local_range_utc(tz_name, today.replace(day=1), today)
         
         # User Statistics
         total_users = AppUser.query.count()
         active_users = AppUser.query.filter_by(status=UserStatus.ACTIVE).count()
         new_users_today = AppUser.query.filter(
-            func.date(AppUser.created_at) == today
+            AppUser.created_at >= today_start,
+            AppUser.created_at < today_end
         ).count()
         
         # Captain Statistics
@@ -26,13 +42,15 @@ def get_dashboard_overview(current_admin):
         active_captains = Captain.query.filter_by(status=CaptainStatus.ACTIVE).count()
         pending_captains = Captain.query.filter_by(status=CaptainStatus.PENDING).count()
         new_captains_today = Captain.query.filter(
-            func.date(Captain.created_at) == today
+            Captain.created_at >= today_start,
+            Captain.created_at < today_end
         ).count()
         
         # Booking Statistics
         total_bookings = Booking.query.count()
         bookings_today = Booking.query.filter(
-            func.date(Booking.booking_time) == today
+            Booking.booking_time >= today_start,
+            Booking.booking_time < today_end
         ).count()
         active_bookings = Booking.query.filter(
             Booking.status.in_([
@@ -40,10 +58,14 @@ def get_dashboard_overview(current_admin):
                 BookingStatus.ACCEPTED,
                 BookingStatus.EN_ROUTE,
                 BookingStatus.ARRIVED
-            ])
+            ]),
+            # Bookings the stale sweeper flagged as stuck are counted separately
+            Booking.stale_flagged_at.is_(None)
         ).count()
+        stale_flagged_bookings = Booking.query.filter(Booking.stale_flagged_at.isnot(None)).count()
         completed_bookings_today = Booking.query.filter(
-            func.date(Booking.booking_time) == today,
+            Booking.booking_time >= today_start,
+            Booking.booking_time < today_end,
             Booking.status == BookingStatus.COMPLETED
         ).count()
         
@@ -51,14 +73,16 @@ def get_dashboard_overview(current_admin):
         revenue_today = db.session.query(
             func.sum(Booking.final_fare)
         ).filter(
-            func.date(Booking.booking_time) == today,
+            Booking.booking_time >= today_start,
+            Booking.booking_time < today_end,
             Booking.status == BookingStatus.COMPLETED
         ).scalar() or 0
         
         commission_today = db.session.query(
             func.sum(Booking.app_commission)
         ).filter(
-            func.date(Booking.booking_time) == today,
+            Booking.booking_time >= today_start,
+            Booking.booking_time < today_end,
             Booking.status == BookingStatus.COMPLETED
         ).scalar() or 0
         
@@ -92,6 +116,7 @@ def get_dashboard_overview(current_admin):
                 'total': total_bookings,
                 'today': bookings_today,
                 'active': active_bookings,
+                'stale_flagged': stale_flagged_bookings,
                 'completed_today': completed_bookings_today
             },
             'revenue': {
@@ -102,108 +127,180 @@ def get_dashboard_overview(current_admin):
             }
         }), 200
         
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'message': f'Failed to fetch dashboard overview: {str(e)}'}), 500
 
 @dashboard_bp.route("/recent-activity", methods=["GET"])
 @token_required
+@single_flight()
 def get_recent_activity(current_admin):
     try:
         limit = int(request.args.get('limit', 10))
+        since = request.args.get('since')
+        # Cursor of the last item seen: "<timestamp>,<type>,<id>"; a bare timestamp from older clients
+        # resumes at the start of that instant, repeating rather than skipping items that share it
+        cursor = None
+        if since:
+            parts = since.split(',')
+            if len(parts) not in (1, 3):
+                raise ValueError('since must be a cursor returned by this endpoint')
+            cursor = (datetime.fromisoformat(parts[0]), parts[1], int(parts[2])) if len(parts) == 3 else (
+                datetime.fromisoformat(parts[0]), '', 0
+            )
         
-        # Recent bookings
-        recent_bookings = Booking.query.order_by(
-            desc(Booking.booking_time)
-        ).limit(limit).all()
+        # One UNION ALL over the three feeds; every branch is limited on its own indexed timestamp first,
+        # then the merged rows are ordered by (timestamp, type, id) and limited once more. Without a cursor
+        # this is the newest page; after a cursor the items are read oldest first, so a client that fell
+        # more than `limit` items behind catches up page by page instead of jumping to the newest one
+        def branch(kind, key, *columns, timestamp, joins=()):
+            query = select(literal(kind).label('type'), key.label('id'), *columns, timestamp.label('ts'))
+            for target, condition in joins:
+                query = query.outerjoin(target, condition)
+            if not cursor:
+                return select(query.order_by(desc(timestamp), desc(key)).limit(limit).subquery())
+            cursor_ts, cursor_type, cursor_id = cursor
+            if kind > cursor_type:
+                after = timestamp >= cursor_ts
+            elif kind < cursor_type:
+                after = timestamp > cursor_ts
+            else:
+                after = or_(timestamp > cursor_ts, and_(timestamp == cursor_ts, key > cursor_id))
+            return select(query.where(timestamp >= cursor_ts, after).order_by(timestamp, key).limit(limit + 1).subquery())
         
-        # Recent captain registrations
-        recent_captains = Captain.query.order_by(
-            desc(Captain.created_at)
-        ).limit(limit).all()
+        bookings = branch(
+            'booking',
+            Booking.booking_id,
+            cast(Booking.status, String).label('status'),
+            cast(Booking.service_type, String).label('detail'),
+            AppUser.name.label('user_name'),
+            Captain.name.label('captain_name'),
+            timestamp=Booking.booking_time,
+            joins=[(AppUser, AppUser.user_id == Booking.user_id), (Captain, Captain.captain_id == Booking.captain_id)]
+        )
+        captains = branch(
+            'captain_registration',
+            Captain.captain_id,
+            cast(Captain.status, String).label('status'),
+            cast(Captain.vehicle_type, String).label('detail'),
+            null().label('user_name'),
+            Captain.name.label('captain_name'),
+            timestamp=Captain.created_at
+        )
+        users = branch(
+            'user_registration',
+            AppUser.user_id,
+            cast(AppUser.status, String).label('status'),
+            null().label('detail'),
+            AppUser.name.label('user_name'),
+            null().label('captain_name'),
+            timestamp=AppUser.created_at
+        )
+        feed = union_all(bookings, captains, users).subquery()
+        has_more = False
+        if cursor:
+            rows = db.session.execute(
+                select(feed).order_by(feed.c.ts, feed.c.type, feed.c.id).limit(limit + 1)
+            ).all()
+            has_more = len(rows) > limit
+            # Newest first within the page, like the first page
+            rows = rows[:limit][::-1]
+        else:
+            rows = db.session.execute(
+                select(feed).order_by(desc(feed.c.ts), desc(feed.c.type), desc(feed.c.id)).limit(limit)
+            ).all()
         
-        # Recent user registrations
-        recent_users = AppUser.query.order_by(
-            desc(AppUser.created_at)
-        ).limit(limit).all()
-        
-        # Format activity feed
+        # Format activity feed (enums come back as their stored names)
         activities = []
+        for row in rows:
+            timestamp = row.ts.isoformat() if row.ts else None
+            if row.type == 'booking':
+                service_type = ServiceType[row.detail].value
+                activities.append({
+                    'type': 'booking',
+                    'id': row.id,
+                    'title': f'New {service_type} booking',
+                    'description': f'{row.user_name or "Unknown"} booked a ride',
+                    'timestamp': timestamp,
+                    'status': BookingStatus[row.status].value,
+                    'details': {
+                        'user_name': row.user_name,
+                        'captain_name': row.captain_name,
+                        'service_type': service_type
+                    }
+                })
+            elif row.type == 'captain_registration':
+                activities.append({
+                    'type': 'captain_registration',
+                    'id': row.id,
+                    'title': 'New captain registration',
+                    'description': f'{row.captain_name} registered as a captain',
+                    'timestamp': timestamp,
+                    'status': CaptainStatus[row.status].value if row.status else None,
+                    'details': {
+                        'captain_name': row.captain_name,
+                        'vehicle_type': VehicleType[row.detail].value if row.detail else None
+                    }
+                })
+            else:
+                activities.append({
+                    'type': 'user_registration',
+                    'id': row.id,
+                    'title': 'New user registration',
+                    'description': f'{row.user_name} joined the platform',
+                    'timestamp': timestamp,
+                    'status': UserStatus[row.status].value if row.status else None,
+                    'details': {
+                        'user_name': row.user_name
+                    }
+                })
         
-        # Add booking activities
-        for booking in recent_bookings:
-            activities.append({
-                'type': 'booking',
-                'id': booking.booking_id,
-                'title': f'New {booking.service_type.value} booking',
-                'description': f'{booking.user.name if booking.user else "Unknown"} booked a ride',
-                'timestamp': booking.booking_time.isoformat() if booking.booking_time else None,
-                'status': booking.status.value,
-                'details': {
-                    'user_name': booking.user.name if booking.user else None,
-                    'captain_name': booking.captain.name if booking.captain else None,
-                    'service_type': booking.service_type.value
-                }
-            })
-        
-        # Add captain registration activities
-        for captain in recent_captains:
-            activities.append({
-                'type': 'captain_registration',
-                'id': captain.captain_id,
-                'title': 'New captain registration',
-                'description': f'{captain.name} registered as a captain',
-                'timestamp': captain.created_at.isoformat() if captain.created_at else None,
-                'status': captain.status.value,
-                'details': {
-                    'captain_name': captain.name,
-                    'vehicle_type': captain.vehicle_type.value if captain.vehicle_type else None
-                }
-            })
-        
-        # Add user registration activities
-        for user in recent_users:
-            activities.append({
-                'type': 'user_registration',
-                'id': user.user_id,
-                'title': 'New user registration',
-                'description': f'{user.name} joined the platform',
-                'timestamp': user.created_at.isoformat() if user.created_at else None,
-                'status': user.status.value,
-                'details': {
-                    'user_name': user.name
-                }
-            })
-        
-        # Sort activities by timestamp (most recent first)
-        activities.sort(key=lambda x: x['timestamp'] or '', reverse=True)
-        
+        newest = rows[0] if rows else None
         return jsonify({
-            'activities': activities[:limit]
+            'activities': activities,
+            # Pass back as `since` to fetch the items after the newest one returned
+            'cursor': f'{newest.ts.isoformat()},{newest.type},{newest.id}' if newest and newest.ts else since,
+            # More items follow the cursor already, fetch again right away
+            'has_more': has_more
         }), 200
         
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'message': f'Failed to fetch recent activity: {str(e)}'}), 500
 
 @dashboard_bp.route("/charts/bookings-trend", methods=["GET"])
 @token_required
+@admission_controlled('report')
+@single_flight()
 def get_bookings_trend(current_admin):
     try:
-        # Get date range (default to last 7 days)
+        # Get date range (default to last 7 local days)
         days = int(request.args.get('days', 7))
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=days-1)
+        tz_name, granularity = parse_calendar_args(request.args)
+        end_date = local_today(tz_name)
+        # Snapped back to a bucket boundary, so the first week or month is complete
+        start_date = bucket_start(granularity, end_date - timedelta(days=days-1))
+        ensure_calendar(tz_name, start_date, end_date)
         
-        # Query for daily booking counts
+        # Bucket bookings by range-matching booking_time against the calendar dimension,
+        # archived bookings included once the range reaches past the archive cutoff
+        bookings = bookings_source(*local_range_utc(tz_name, start_date, end_date))
+        bucket = bucket_column(granularity)
         daily_bookings = db.session.query(
-            func.date(Booking.booking_time).label('date'),
-            func.count(Booking.booking_id).label('count')
+            bucket.label('date'),
+            func.count(bookings.c.booking_id).label('count')
+        ).select_from(CalendarDay).join(
+            bookings, calendar_join(bookings.c.booking_time)
         ).filter(
-            func.date(Booking.booking_time) >= start_date,
-            func.date(Booking.booking_time) <= end_date
+            CalendarDay.tz == tz_name,
+            CalendarDay.local_date >= start_date,
+            CalendarDay.local_date <= end_date
         ).group_by(
-            func.date(Booking.booking_time)
+            bucket
         ).order_by(
-            func.date(Booking.booking_time)
+            bucket
         ).all()
         
         # Format the data
@@ -216,37 +313,52 @@ def get_bookings_trend(current_admin):
         
         return jsonify({
             'trend_data': trend_data,
+            'granularity': granularity,
+            'timezone': tz_name,
             'date_range': {
                 'start_date': start_date.isoformat(),
                 'end_date': end_date.isoformat()
             }
         }), 200
         
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'message': f'Failed to fetch bookings trend: {str(e)}'}), 500
 
 @dashboard_bp.route("/charts/revenue-trend", methods=["GET"])
 @token_required
+@admission_controlled('report')
+@single_flight()
 def get_revenue_trend(current_admin):
     try:
-        # Get date range (default to last 7 days)
+        # Get date range (default to last 7 local days)
         days = int(request.args.get('days', 7))
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=days-1)
+        tz_name, granularity = parse_calendar_args(request.args)
+        end_date = local_today(tz_name)
+        # Snapped back to a bucket boundary, so the first week or month is complete
+        start_date = bucket_start(granularity, end_date - timedelta(days=days-1))
+        ensure_calendar(tz_name, start_date, end_date)
         
-        # Query for daily revenue
+        # Bucket revenue by range-matching booking_time against the calendar dimension,
+        # archived bookings included once the range reaches past the archive cutoff
+        bookings = bookings_source(*local_range_utc(tz_name, start_date, end_date))
+        bucket = bucket_column(granularity)
         daily_revenue = db.session.query(
-            func.date(Booking.booking_time).label('date'),
-            func.sum(Booking.final_fare).label('revenue'),
-            func.sum(Booking.app_commission).label('commission')
+            bucket.label('date'),
+            func.sum(bookings.c.final_fare).label('revenue'),
+            func.sum(bookings.c.app_commission).label('commission')
+        ).select_from(CalendarDay).join(
+            bookings, calendar_join(bookings.c.booking_time)
         ).filter(
-            Booking.status == BookingStatus.COMPLETED,
-            func.date(Booking.booking_time) >= start_date,
-            func.date(Booking.booking_time) <= end_date
+            bookings.c.status == BookingStatus.COMPLETED,
+            CalendarDay.tz == tz_name,
+            CalendarDay.local_date >= start_date,
+            CalendarDay.local_date <= end_date
         ).group_by(
-            func.date(Booking.booking_time)
+            bucket
         ).order_by(
-            func.date(Booking.booking_time)
+            bucket
         ).all()
         
         # Format the data
@@ -260,17 +372,23 @@ def get_revenue_trend(current_admin):
         
         return jsonify({
             'trend_data': trend_data,
+            'granularity': granularity,
+            'timezone': tz_name,
             'date_range': {
                 'start_date': start_date.isoformat(),
                 'end_date': end_date.isoformat()
             }
         }), 200
         
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'message': f'Failed to fetch revenue trend: {str(e)}'}), 500
 
 @dashboard_bp.route("/charts/service-distribution", methods=["GET"])
 @token_required
+@admission_controlled('report')
+@single_flight()
 def get_service_distribution(current_admin):
     try:
         # Get date range (default to last 30 days)
@@ -305,3 +423,46 @@ def get_service_distribution(current_admin):
         
     except Exception as e:
         return jsonify({'message': f'Failed to fetch service distribution: {str(e)}'}), 500
+
+@dashboard_bp.route("/system/admission", methods=["GET"])
+@token_required
+def get_admission_stats(current_admin):
+    try:
+        # Queue depth and active requests of this worker, admissions and rejections of all workers
+        return jsonify({'cost_classes': admission_stats()}), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch admission stats: {str(e)}'}), 500
+
+@dashboard_bp.route("/system/single-flight", methods=["GET"])
+@token_required
+def get_single_flight_stats(current_admin):
+    try:
+        # Executed versus coalesced identical requests, for this worker and for all workers
+        return jsonify({
+            'worker': single_flight_group.stats(),
+            'all_workers': metric_totals('single_flight:')
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch single-flight stats: {str(e)}'}), 500
+
+@dashboard_bp.route("/system/typeahead", methods=["GET"])
+@token_required
+def get_typeahead_stats(current_admin):
+    try:
+        # Size and estimated memory of this worker's captain and user suggestion indexes
+        return jsonify({'indexes': typeahead.stats()}), 200
+    
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch typeahead stats: {str(e)}'}), 500
+
+@dashboard_bp.route("/system/captain-locations", methods=["GET"])
+@token_required
+def get_captain_location_stats(current_admin):
+    try:
+        # Size of this worker's location grid and positions not yet written to captain_locations
+        return jsonify({'locations': captain_locations.stats()}), 200
+    
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch captain location stats: {str(e)}'}), 500
@@ -0,0 +1,125 @@
+from src.models.admin_models import db, Booking, ArchivedBooking, BackfillCheckpoint, ChangeOperation
+from src.routes.booking_snapshot import require_numpy, np
+from src.routes.change_feed import record_changes
+from sqlalchemy import event, select, update, bindparam
+from datetime import datetime
+import math
+import time
+
+EARTH_RADIUS_KM = 6371.0088
+
+def great_circle_km(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon):
+    """Haversine distance of one trip; straight-line, so it is a lower bound of the road distance."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (pickup_lat, pickup_lon, dropoff_lat, dropoff_lon))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+def haversine_km(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon):
+    """great_circle_km over coordinate arrays in one vectorized pass."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(values, dtype='float64'))
+                              for values in (pickup_lat, pickup_lon, dropoff_lat, dropoff_lon))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+@event.listens_for(Booking, 'before_insert')
+def _fill_distance_on_insert(mapper, connection, booking):
+    coordinates = (booking.pickup_location_lat, booking.pickup_location_lon,
+                   booking.dropoff_location_lat, booking.dropoff_location_lon)
+    if booking.distance_km is None and None not in coordinates:
+        booking.distance_km = round(great_circle_km(*coordinates), 3)
+
+def get_checkpoint(name):
+    checkpoint = BackfillCheckpoint.query.get(name)
+    if not checkpoint:
+        checkpoint = BackfillCheckpoint(name=name, last_id=0, processed_rows=0, updated_rows=0)
+        db.session.add(checkpoint)
+        db.session.flush()
+    return checkpoint
+
+def _backfill_table(model, chunk_size, restart, max_chunks, progress):
+    table = model.__table__
+    checkpoint = get_checkpoint(f'distance_km:{table.name}')
+    if restart:
+        checkpoint.last_id = 0
+        checkpoint.processed_rows = 0
+        checkpoint.updated_rows = 0
+    checkpoint.started_at = datetime.utcnow()
+    checkpoint.finished_at = None
+    db.session.commit()
+    
+    pending = db.session.query(db.func.count(table.c.booking_id)).filter(
+        table.c.booking_id > checkpoint.last_id, table.c.distance_km.is_(None)
+    ).scalar() or 0
+    values = {'distance_km': bindparam('b_distance_km')}
+    if 'version' in table.c:
+        # A write like any other, a client holding the old version must not overwrite it unnoticed
+        values['version'] = table.c.version + 1
+    statement = update(table).where(table.c.booking_id == bindparam('b_booking_id')).values(**values)
+    started = time.perf_counter()
+    processed = 0
+    chunks = 0
+    
+    while max_chunks is None or chunks < max_chunks:
+        rows = db.session.execute(select(
+            table.c.booking_id,
+            table.c.pickup_location_lat, table.c.pickup_location_lon,
+            table.c.dropoff_location_lat, table.c.dropoff_location_lon
+        ).where(
+            table.c.booking_id > checkpoint.last_id,
+            table.c.distance_km.is_(None)
+        ).order_by(table.c.booking_id).limit(chunk_size)).all()
+        if not rows:
+            checkpoint.finished_at = datetime.utcnow()
+            break
+        
+        columns = np.array([row[1:] for row in rows], dtype='float64').T
+        distances = np.round(haversine_km(*columns), 3)
+        valid = np.isfinite(distances)
+        booking_ids = [row.booking_id for row in rows]
+        try:
+            # One executemany per chunk, committed together with the checkpoint
+            parameters = [
+                {'b_booking_id': booking_id, 'b_distance_km': float(distance)}
+                for booking_id, distance, ok in zip(booking_ids, distances, valid) if ok
+            ]
+            if parameters:
+                db.session.execute(statement, parameters)
+                # Archived ids too: the analytics snapshot patches both tables from the bookings log
+                record_changes('bookings', [item['b_booking_id'] for item in parameters], ChangeOperation.UPDATED)
+            checkpoint.last_id = booking_ids[-1]
+            checkpoint.processed_rows = (checkpoint.processed_rows or 0) + len(rows)
+            checkpoint.updated_rows = (checkpoint.updated_rows or 0) + len(parameters)
+            processed += len(rows)
+            checkpoint.rows_per_second = round(processed / max(time.perf_counter() - started, 1e-9), 1)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        chunks += 1
+        if progress and pending:
+            progress(min(processed / pending, 1.0))
+    
+    db.session.commit()
+    return checkpoint.to_dict()
+
+def backfill_distances(chunk_size=5000, restart=False, max_chunks=None, progress=None):
+    """Fill null distance_km of live and archived bookings with the haversine distance.
+    
+    Rows are streamed in booking_id chunks; each chunk is one vectorized distance
+    computation and one executemany UPDATE, committed with its checkpoint, so an
+    interrupted run continues after the last committed chunk. `restart` rescans
+    from the first booking.
+    """
+    require_numpy()
+    live_progress = (lambda fraction: progress(fraction * 0.5)) if progress else None
+    archive_progress = (lambda fraction: progress(0.5 + fraction * 0.5)) if progress else None
+    return {
+        'bookings': _backfill_table(Booking, chunk_size, restart, max_chunks, live_progress),
+        'bookings_archive': _backfill_table(ArchivedBooking, chunk_size, restart, max_chunks, archive_progress)
+    }
+
+def backfill_status():
+    return [checkpoint.to_dict() for checkpoint in BackfillCheckpoint.query.filter(
+        BackfillCheckpoint.name.like('distance_km:%')
+    ).all()]
@@ -0,0 +1,231 @@
+from src.models.admin_models import (
+    db, Booking, ArchivedBooking, BookingDurationDaily, CalendarDay, BookingStatus, ServiceType, DurationMetric
+)
+from src.routes.reporting_calendar import reporting_timezone, ensure_calendar, calendar_join, local_today
+from sqlalchemy import func, select, delete, insert, union_all
+from datetime import datetime, timedelta
+import json
+import math
+
+PERCENTILES = (50, 90, 99)
+# Days are recomputed on read until this long after they end, late trip end times land in time
+FINALIZE_AFTER = timedelta(days=1)
+# Log-linear buckets: exact below 2 * SUB_BUCKETS seconds, then 32 buckets per power of two (~3% error)
+SUB_BUCKETS = 32
+_SHIFT_BASE = SUB_BUCKETS.bit_length() - 1
+
+def bucket_index(seconds):
+    value = max(0, int(seconds))
+    if value < SUB_BUCKETS:
+        return value
+    exponent = value.bit_length() - 1
+    return SUB_BUCKETS * (exponent - _SHIFT_BASE + 1) + (value >> (exponent - _SHIFT_BASE)) - SUB_BUCKETS
+
+def bucket_value(index):
+    """Midpoint, in seconds, of the values that fall into bucket `index`."""
+    if index < SUB_BUCKETS:
+        return float(index)
+    shift = (index - SUB_BUCKETS) // SUB_BUCKETS
+    lower = (SUB_BUCKETS + (index - SUB_BUCKETS) % SUB_BUCKETS) << shift
+    return lower + ((1 << shift) - 1) / 2
+
+class DurationSketch:
+    """Mergeable histogram of durations in seconds."""
+    
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+    
+    def add(self, seconds):
+        index = bucket_index(seconds)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = seconds if self.max is None else max(self.max, seconds)
+    
+    def merge_row(self, row):
+        for index, count in json.loads(row.histogram or '{}').items():
+            self.counts[int(index)] = self.counts.get(int(index), 0) + count
+        self.count += row.sample_count or 0
+        self.total += row.total_seconds or 0
+        if row.max_seconds is not None:
+            self.max = row.max_seconds if self.max is None else max(self.max, row.max_seconds)
+    
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(bucket_value(index), self.max)
+        return self.max
+    
+    def summary(self):
+        summary = {
+            'count': self.count,
+            'mean_seconds': round(self.total / self.count, 1) if self.count else None,
+            'max_seconds': self.max
+        }
+        for percent in PERCENTILES:
+            value = self.percentile(percent)
+            summary[f'p{percent}_seconds'] = round(value, 1) if value is not None else None
+        return summary
+
+def _duration_source():
+    columns = ('booking_time', 'scheduled_time', 'start_time', 'end_time', 'service_type', 'status')
+    return union_all(
+        select(*[Booking.__table__.c[name] for name in columns]).where(Booking.start_time.isnot(None)),
+        select(*[ArchivedBooking.__table__.c[name] for name in columns]).where(ArchivedBooking.start_time.isnot(None))
+    ).subquery()
+
+def _sample_seconds(row, metric):
+    if metric == DurationMetric.PICKUP_WAIT:
+        # Scheduled rides wait from their scheduled time, not from when they were booked
+        requested_at = row.scheduled_time or row.booking_time
+        return (row.start_time - requested_at).total_seconds()
+    if row.status != BookingStatus.COMPLETED or row.end_time is None:
+        return None
+    return (row.end_time - row.start_time).total_seconds()
+
+def rollup_duration_days(local_dates):
+    """Recompute the duration histograms of the given local days in one pass over their bookings.
+    
+    Every (day, service type, metric) gets a row, also when it has no samples,
+    so empty days are not rescanned.
+    """
+    if not local_dates:
+        return 0
+    tz_name = reporting_timezone()
+    ensure_calendar(tz_name, min(local_dates), max(local_dates))
+    
+    sketches = {
+        (local_date, service_type, metric): DurationSketch()
+        for local_date in local_dates for service_type in ServiceType for metric in DurationMetric
+    }
+    source = _duration_source()
+    rows = db.session.execute(select(
+        CalendarDay.local_date,
+        source.c.booking_time,
+        source.c.scheduled_time,
+        source.c.start_time,
+        source.c.end_time,
+        source.c.service_type,
+        source.c.status
+    ).select_from(CalendarDay).join(
+        source, calendar_join(source.c.booking_time)
+    ).where(
+        CalendarDay.tz == tz_name,
+        CalendarDay.local_date.in_(local_dates)
+    )).yield_per(1000)
+    for row in rows:
+        for metric in DurationMetric:
+            seconds = _sample_seconds(row, metric)
+            # Negative spans are clock or data errors, not zero-length trips
+            if seconds is not None and seconds >= 0:
+                sketches[(row.local_date, row.service_type, metric)].add(seconds)
+    
+    now = datetime.utcnow()
+    try:
+        db.session.execute(delete(BookingDurationDaily.__table__).where(
+            BookingDurationDaily.stat_date.in_(local_dates)
+        ))
+        db.session.execute(insert(BookingDurationDaily.__table__), [
+            {
+                'stat_date': local_date,
+                'service_type': service_type,
+                'metric': metric,
+                'sample_count': sketch.count,
+                'total_seconds': sketch.total,
+                'max_seconds': int(sketch.max) if sketch.max is not None else None,
+                'histogram': json.dumps(sketch.counts),
+                'computed_at': now
+            }
+            for (local_date, service_type, metric), sketch in sketches.items()
+        ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(local_dates)
+
+def invalidate_duration_day(booking_time):
+    """Drop the rollup of the local day containing `booking_time`, it is rebuilt on the next read.
+    
+    Called from booking status changes before the commit, since only completed
+    bookings count towards trip durations.
+    """
+    if not booking_time:
+        return
+    day = CalendarDay.query.filter(
+        CalendarDay.tz == reporting_timezone(),
+        CalendarDay.utc_start <= booking_time,
+        CalendarDay.utc_end > booking_time
+    ).first()
+    if day:
+        db.session.execute(delete(BookingDurationDaily.__table__).where(
+            BookingDurationDaily.stat_date == day.local_date
+        ))
+
+def _stale_dates(date_from, date_to):
+    """Local days in the range that have no rollup yet or were rolled up before they were final."""
+    tz_name = reporting_timezone()
+    ensure_calendar(tz_name, date_from, date_to)
+    final_at = {
+        day.local_date: day.utc_end + FINALIZE_AFTER
+        for day in CalendarDay.query.filter(
+            CalendarDay.tz == tz_name,
+            CalendarDay.local_date >= date_from,
+            CalendarDay.local_date <= date_to
+        ).all()
+    }
+    computed_at = dict(db.session.query(
+        BookingDurationDaily.stat_date, func.min(BookingDurationDaily.computed_at)
+    ).filter(
+        BookingDurationDaily.stat_date >= date_from,
+        BookingDurationDaily.stat_date <= date_to
+    ).group_by(BookingDurationDaily.stat_date).all())
+    return sorted(
+        local_date for local_date, final in final_at.items()
+        if local_date not in computed_at or computed_at[local_date] < final
+    )
+
+def duration_percentiles(date_from, date_to, service_type=None):
+    """Per-day and whole-range pickup wait and trip duration percentiles over local days.
+    
+    Only days without a final rollup touch the bookings table; everything else
+    merges the stored daily histograms.
+    """
+    date_to = min(date_to, local_today(reporting_timezone()))
+    if date_from > date_to:
+        return {'days': [], 'overall': {}, 'recomputed_days': 0}
+    recomputed = rollup_duration_days(_stale_dates(date_from, date_to))
+    
+    query = BookingDurationDaily.query.filter(
+        BookingDurationDaily.stat_date >= date_from,
+        BookingDurationDaily.stat_date <= date_to
+    )
+    if service_type:
+        query = query.filter(BookingDurationDaily.service_type == service_type)
+    
+    daily = {}
+    overall = {}
+    for row in query.order_by(BookingDurationDaily.stat_date).all():
+        key = (row.service_type.value, row.metric.value)
+        daily.setdefault(row.stat_date, {}).setdefault(key, DurationSketch()).merge_row(row)
+        overall.setdefault(key, DurationSketch()).merge_row(row)
+    
+    def nest(sketches):
+        nested = {}
+        for (service, metric), sketch in sorted(sketches.items()):
+            nested.setdefault(service, {})[metric] = sketch.summary()
+        return nested
+    
+    return {
+        'days': [{'date': stat_date.isoformat(), 'services': nest(sketches)} for stat_date, sketches in daily.items()],
+        'overall': nest(overall),
+        'recomputed_days': recomputed
+    }
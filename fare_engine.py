@@ -0,0 +1,160 @@
+from src.models.admin_models import db, CaptainRate, ServiceType, BookingStatus
+from src.routes.booking_snapshot import require_numpy, np
+from src.routes.snapshot_analytics import snapshot_bookings
+from src.routes.shared_state import shared_state
+import threading
+
+# Average moving speed used to split trip time into driving and waiting minutes
+CRUISE_SPEED_KMH = 30.0
+RATE_CARD_VERSION_KEY = 'rate_cards:version'
+SERVICE_COUNT = len(ServiceType)
+
+def compute_fares(distance_km, rate_per_km, minimum_fare, waiting_minutes=None, waiting_time_rate=None):
+    """Fares for whole arrays at once: distance x rate plus waiting x rate, clamped to the minimum fare."""
+    fares = distance_km * rate_per_km
+    if waiting_minutes is not None:
+        fares = fares + waiting_minutes * waiting_time_rate
+    return np.maximum(fares, minimum_fare)
+
+def waiting_minutes(start_time, end_time, distance_km):
+    """Trip minutes beyond what the distance takes at CRUISE_SPEED_KMH, zero when times are missing."""
+    missing = np.isnat(start_time) | np.isnat(end_time)
+    duration = np.where(missing, 0.0, (end_time - start_time).astype('timedelta64[s]').astype('float64') / 60)
+    driving = distance_km / CRUISE_SPEED_KMH * 60
+    return np.nan_to_num(np.maximum(duration - driving, 0))
+
+class RateCardCache:
+    """All CaptainRate rows as sorted NumPy arrays keyed by captain_id x service type.
+    
+    The cache is shared by every request of a worker and reloaded when the
+    rate card version in the shared state store changes, which every rate
+    write bumps, so all workers drop their copy after an update.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = None
+        self._version = None
+    
+    def _shared_version(self):
+        return shared_state.get(RATE_CARD_VERSION_KEY, 0) if shared_state.store is not None else 0
+    
+    def invalidate(self):
+        if shared_state.store is not None:
+            shared_state.incr(RATE_CARD_VERSION_KEY)
+        with self._lock:
+            self._tables = None
+    
+    def tables(self):
+        require_numpy()
+        version = self._shared_version()
+        with self._lock:
+            if self._tables is None or self._version != version:
+                rates = db.session.query(
+                    CaptainRate.captain_id, CaptainRate.service_type, CaptainRate.rate_per_km,
+                    CaptainRate.minimum_fare, CaptainRate.waiting_time_rate
+                ).all()
+                service_codes = {service_type: code for code, service_type in enumerate(ServiceType)}
+                keys = np.array([rate.captain_id * SERVICE_COUNT + service_codes[rate.service_type] for rate in rates],
+                                dtype='int64')
+                order = np.argsort(keys)
+                self._tables = {
+                    'keys': keys[order],
+                    'rate_per_km': np.array([rate.rate_per_km for rate in rates], dtype='float64')[order],
+                    'minimum_fare': np.array([rate.minimum_fare for rate in rates], dtype='float64')[order],
+                    'waiting_time_rate': np.array([rate.waiting_time_rate for rate in rates], dtype='float64')[order]
+                }
+                self._version = version
+            return self._tables
+    
+    def lookup(self, captain_ids, service_codes):
+        """Rate arrays aligned with the inputs plus a mask of bookings that have a rate card."""
+        tables = self.tables()
+        keys = captain_ids.astype('int64') * SERVICE_COUNT + service_codes.astype('int64')
+        if not len(tables['keys']):
+            missing = np.zeros(len(keys), dtype=bool)
+            return missing, {name: np.full(len(keys), np.nan) for name in ('rate_per_km', 'minimum_fare', 'waiting_time_rate')}
+        positions = np.minimum(np.searchsorted(tables['keys'], keys), len(tables['keys']) - 1)
+        found = (tables['keys'][positions] == keys) & (captain_ids >= 0)
+        return found, {
+            name: np.where(found, tables[name][positions], np.nan)
+            for name in ('rate_per_km', 'minimum_fare', 'waiting_time_rate')
+        }
+
+rate_cards = RateCardCache()
+
+def audit_fares(tz_name, date_from, date_to, service_type=None, tolerance_pct=5.0, tolerance_abs=1.0, limit=100):
+    """Compare stored fares of local days date_from..date_to with the current rate cards in one vectorized pass.
+    
+    estimated_fare is checked for every booking against distance pricing,
+    final_fare for completed bookings against distance plus waiting time. A fare
+    deviates when it is off by more than both tolerance_abs EGP and
+    tolerance_pct percent. Returns the summary and the `limit` largest deviations.
+    """
+    manifest, bookings = snapshot_bookings(tz_name, date_from, date_to, service_type=service_type, status=None)
+    found, rates = rate_cards.lookup(bookings['captain_id'], bookings['service_type'])
+    distance = bookings['distance_km']
+    priced = found & ~np.isnan(distance)
+    
+    expected_estimate = compute_fares(distance, rates['rate_per_km'], rates['minimum_fare'])
+    waiting = waiting_minutes(bookings['start_time'], bookings['end_time'], distance)
+    expected_final = compute_fares(
+        distance, rates['rate_per_km'], rates['minimum_fare'], waiting, rates['waiting_time_rate']
+    )
+    completed = bookings['status'] == list(BookingStatus).index(BookingStatus.COMPLETED)
+    
+    def deviations(stored, expected, applies):
+        checked = applies & priced & ~np.isnan(stored)
+        difference = np.where(checked, stored - expected, 0.0)
+        relative = np.abs(difference) / np.maximum(np.abs(expected), 1e-9) * 100
+        flagged = checked & (np.abs(difference) > tolerance_abs) & (relative > tolerance_pct)
+        return checked, difference, flagged
+    
+    estimate_checked, estimate_difference, estimate_flagged = deviations(
+        bookings['estimated_fare'], expected_estimate, np.ones(len(distance), dtype=bool)
+    )
+    final_checked, final_difference, final_flagged = deviations(bookings['final_fare'], expected_final, completed)
+    
+    flagged = estimate_flagged | final_flagged
+    severity = np.maximum(np.abs(estimate_difference) * estimate_flagged, np.abs(final_difference) * final_flagged)
+    flagged_positions = np.flatnonzero(flagged)
+    top = flagged_positions[np.argsort(-severity[flagged_positions], kind='stable')[:limit]]
+    
+    service_types = list(ServiceType)
+    statuses = list(BookingStatus)
+    
+    def fare(value):
+        return None if np.isnan(value) else round(float(value), 2)
+    
+    return {
+        'summary': {
+            'bookings': int(len(distance)),
+            'missing_rate_card': int((~found).sum()),
+            'missing_distance': int(np.isnan(distance).sum()),
+            'estimated_checked': int(estimate_checked.sum()),
+            'estimated_flagged': int(estimate_flagged.sum()),
+            'final_checked': int(final_checked.sum()),
+            'final_flagged': int(final_flagged.sum()),
+            'final_overcharge_total': round(float(np.clip(final_difference * final_flagged, 0, None).sum()), 2),
+            'final_undercharge_total': round(float(-np.clip(final_difference * final_flagged, None, 0).sum()), 2)
+        },
+        'flagged': [
+            {
+                'booking_id': int(bookings['booking_id'][i]),
+                'captain_id': int(bookings['captain_id'][i]),
+                'service_type': service_types[bookings['service_type'][i]].value,
+                'status': statuses[bookings['status'][i]].value if bookings['status'][i] < len(statuses) else None,
+                'distance_km': fare(distance[i]),
+                'waiting_minutes': round(float(waiting[i]), 1),
+                'estimated_fare': fare(bookings['estimated_fare'][i]),
+                'expected_estimated_fare': fare(expected_estimate[i]),
+                'final_fare': fare(bookings['final_fare'][i]),
+                'expected_final_fare': fare(expected_final[i]) if completed[i] else None,
+                'estimated_flagged': bool(estimate_flagged[i]),
+                'final_flagged': bool(final_flagged[i])
+            }
+            for i in top
+        ],
+        'tolerance': {'percent': tolerance_pct, 'absolute': tolerance_abs},
+        'snapshot': {'version': manifest['version'], 'rows': manifest['rows']}
+    }
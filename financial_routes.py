@@ -1,13 +1,31 @@
-from flask import Blueprint, request, jsonify
-from src.models.admin_models import db, Payment, Booking, BookingStatus, PaymentMethod, PaymentStatus
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from src.models.admin_models import db, Payment, Booking, ArchivedPayment, ArchivedBooking, BookingStatus, PaymentMethod, PaymentStatus, CalendarDay, SettlementBatch, SettlementLine
+from src.models.admin_models import ReconciliationRun, ReconciliationDiscrepancy, DiscrepancyType
 from src.routes.admin_auth import token_required
+from src.routes.single_flight import single_flight
+from src.routes.admission_control import admission_controlled
+from src.routes.booking_archive import bookings_need_archive, payments_need_archive, bookings_source
+from src.routes.job_runner import job_runner
+from src.routes.captain_settlement import create_settlement, stream_settlement_csv
+from src.routes.payment_reconciliation import reconcile_payments
+from src.routes.booking_snapshot import analytics_snapshot
+from src.routes.snapshot_analytics import commission_distribution, revenue_heatmap, earnings_curves
+from src.routes.reporting_calendar import (
+    parse_calendar_args, reporting_timezone, local_today, local_range_utc, ensure_calendar, bucket_column, bucket_start, calendar_join
+)
 from sqlalchemy import func, desc
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 financial_bp = Blueprint('financial', __name__)
 
+# Rows between progress updates of export jobs
+EXPORT_PROGRESS_EVERY = 1000
+EXPORT_TYPES = ('transactions', 'commissions')
+
 @financial_bp.route('/financials/overview', methods=['GET'])
 @token_required
+@admission_controlled('report')
+@single_flight()
 def get_financial_overview(current_admin):
     try:
         # Get date range for filtering (default to current month)
@@ -191,27 +209,38 @@ def get_commissions(current_admin):
 
 @financial_bp.route('/financials/daily-revenue', methods=['GET'])
 @token_required
+@admission_controlled('report')
+@single_flight()
 def get_daily_revenue(current_admin):
     try:
-        # Get date range (default to last 30 days)
+        # Get date range (default to last 30 local days)
         days = int(request.args.get('days', 30))
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=days-1)
-        
-        # Query for daily revenue
+        tz_name, granularity = parse_calendar_args(request.args)
+        end_date = local_today(tz_name)
+        # Snapped back to a bucket boundary, so the first week or month is complete
+        start_date = bucket_start(granularity, end_date - timedelta(days=days-1))
+        ensure_calendar(tz_name, start_date, end_date)
+        
+        # Bucket revenue by range-matching booking_time against the calendar dimension,
+        # archived bookings included once the range reaches past the archive cutoff
+        bookings = bookings_source(*local_range_utc(tz_name, start_date, end_date))
+        bucket = bucket_column(granularity)
         daily_revenue = db.session.query(
-            func.date(Booking.booking_time).label('date'),
-            func.sum(Booking.final_fare).label('total_revenue'),
-            func.sum(Booking.app_commission).label('total_commission'),
-            func.count(Booking.booking_id).label('booking_count')
+            bucket.label('date'),
+            func.sum(bookings.c.final_fare).label('total_revenue'),
+            func.sum(bookings.c.app_commission).label('total_commission'),
+            func.count(bookings.c.booking_id).label('booking_count')
+        ).select_from(CalendarDay).join(
+            bookings, calendar_join(bookings.c.booking_time)
         ).filter(
-            Booking.status == BookingStatus.COMPLETED,
-            func.date(Booking.booking_time) >= start_date,
-            func.date(Booking.booking_time) <= end_date
+            bookings.c.status == BookingStatus.COMPLETED,
+            CalendarDay.tz == tz_name,
+            CalendarDay.local_date >= start_date,
+            CalendarDay.local_date <= end_date
         ).group_by(
-            func.date(Booking.booking_time)
+            bucket
         ).order_by(
-            func.date(Booking.booking_time)
+            bucket
         ).all()
         
         # Format the data
@@ -226,23 +255,30 @@ def get_daily_revenue(current_admin):
         
         return jsonify({
             'daily_revenue': revenue_data,
+            'granularity': granularity,
+            'timezone': tz_name,
             'date_range': {
                 'start_date': start_date.isoformat(),
                 'end_date': end_date.isoformat()
             }
         }), 200
         
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'message': f'Failed to fetch daily revenue: {str(e)}'}), 500
 
 @financial_bp.route('/financials/export', methods=['GET'])
 @token_required
+@admission_controlled('export')
 def export_financial_data(current_admin):
     try:
         # Get query parameters
         date_from = request.args.get('date_from')
         date_to = request.args.get('date_to')
-        export_type = request.args.get('type', 'transactions')  # transactions, commissions, revenue
+        export_type = request.args.get('type', 'transactions')  # transactions, commissions
+        if export_type not in EXPORT_TYPES:
+            raise ValueError(f'Unsupported export type: {export_type}')
         
         if not date_from:
             date_from = datetime.now() - timedelta(days=30)
@@ -254,55 +290,391 @@ def export_financial_data(current_admin):
         else:
             date_to = datetime.fromisoformat(date_to)
         
-        if export_type == 'transactions':
-            # Export transaction data
-            payments = Payment.query.filter(
-                Payment.payment_date >= date_from,
-                Payment.payment_date <= date_to
-            ).all()
+        if request.args.get('async') in ('1', 'true'):
+            # Heavy exports run on the job runner, poll /api/jobs/jobs/<job_id> for the result
+            # Raw arguments keep the dedupe key stable when the range defaults to "now"
+            job, created = job_runner.submit('financial_export', {
+                'type': export_type,
+                'date_from': request.args.get('date_from'),
+                'date_to': request.args.get('date_to')
+            }, submitted_by=current_admin.admin_id)
+            return jsonify({
+                'message': 'Export job submitted' if created else 'Identical export job already exists',
+                'job': job.to_dict()
+            }), 202
             
-            export_data = []
-            for payment in payments:
-                export_data.append({
-                    'payment_id': payment.payment_id,
-                    'booking_id': payment.booking_id,
-                    'amount': payment.amount,
-                    'currency': payment.currency,
-                    'method': payment.method.value,
-                    'status': payment.status.value,
-                    'payment_date': payment.payment_date.isoformat() if payment.payment_date else None,
-                    'transaction_ref': payment.transaction_ref
-                })
-        
-        elif export_type == 'commissions':
-            # Export commission data
-            bookings = Booking.query.filter(
-                Booking.status == BookingStatus.COMPLETED,
-                Booking.booking_time >= date_from,
-                Booking.booking_time <= date_to
+        return jsonify(build_financial_export(export_type, date_from, date_to)), 200
+        
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to export financial data: {str(e)}'}), 500
+
+def build_financial_export(export_type, date_from, date_to, progress=None):
+    """Build the financial export payload, reporting completion fractions to `progress` if given."""
+    def report(fraction):
+        if progress:
+            progress(fraction)
+    
+    if export_type == 'transactions':
+        # Export transaction data
+        payments = Payment.query.filter(
+            Payment.payment_date >= date_from,
+            Payment.payment_date <= date_to
+        ).all()
+        if payments_need_archive(date_from):
+            payments += ArchivedPayment.query.filter(
+                ArchivedPayment.payment_date >= date_from,
+                ArchivedPayment.payment_date <= date_to
             ).all()
-            
-            export_data = []
-            for booking in bookings:
-                export_data.append({
-                    'booking_id': booking.booking_id,
-                    'booking_time': booking.booking_time.isoformat() if booking.booking_time else None,
-                    'service_type': booking.service_type.value,
-                    'final_fare': booking.final_fare,
-                    'app_commission': booking.app_commission,
-                    'captain_earning': booking.captain_earning,
-                    'payment_method': booking.payment_method.value
-                })
+        report(0.5)
+        
+        export_data = []
+        for index, payment in enumerate(payments, 1):
+            export_data.append({
+                'payment_id': payment.payment_id,
+                'booking_id': payment.booking_id,
+                'amount': payment.amount,
+                'currency': payment.currency,
+                'method': payment.method.value,
+                'status': payment.status.value,
+                'payment_date': payment.payment_date.isoformat() if payment.payment_date else None,
+                'transaction_ref': payment.transaction_ref
+            })
+            if index % EXPORT_PROGRESS_EVERY == 0:
+                report(0.5 + 0.5 * index / len(payments))
+    
+    elif export_type == 'commissions':
+        # Export commission data
+        bookings = Booking.query.filter(
+            Booking.status == BookingStatus.COMPLETED,
+            Booking.booking_time >= date_from,
+            Booking.booking_time <= date_to
+        ).all()
+        if bookings_need_archive(date_from):
+            bookings += ArchivedBooking.query.filter(
+                ArchivedBooking.status == BookingStatus.COMPLETED,
+                ArchivedBooking.booking_time >= date_from,
+                ArchivedBooking.booking_time <= date_to
+            ).all()
+        report(0.5)
+        
+        export_data = []
+        for index, booking in enumerate(bookings, 1):
+            export_data.append({
+                'booking_id': booking.booking_id,
+                'booking_time': booking.booking_time.isoformat() if booking.booking_time else None,
+                'service_type': booking.service_type.value,
+                'final_fare': booking.final_fare,
+                'app_commission': booking.app_commission,
+                'captain_earning': booking.captain_earning,
+                'payment_method': booking.payment_method.value
+            })
+            if index % EXPORT_PROGRESS_EVERY == 0:
+                report(0.5 + 0.5 * index / len(bookings))
+    
+    else:
+        raise ValueError(f'Unsupported export type: {export_type}')
+    
+    report(1.0)
+    return {
+        'export_data': export_data,
+        'export_type': export_type,
+        'date_range': {
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat()
+        },
+        'total_records': len(export_data)
+    }
+
+@job_runner.job('financial_export')
+def run_financial_export_job(params, progress):
+    date_from = params.get('date_from')
+    date_to = params.get('date_to')
+    return build_financial_export(
+        params.get('type', 'transactions'),
+        datetime.fromisoformat(date_from) if date_from else datetime.now() - timedelta(days=30),
+        datetime.fromisoformat(date_to) if date_to else datetime.now(),
+        progress=progress
+    )
+
+@financial_bp.route('/financials/settlements', methods=['POST'])
+@token_required
+def run_captain_settlement(current_admin):
+    try:
+        data = request.get_json()
+        period_start = data.get('period_start')
+        period_end = data.get('period_end')
+        
+        if not period_start or not period_end:
+            return jsonify({'message': 'period_start and period_end are required'}), 400
+        
+        try:
+            period_start = datetime.fromisoformat(period_start)
+            period_end = datetime.fromisoformat(period_end)
+        except ValueError:
+            return jsonify({'message': 'Invalid date format'}), 400
+        
+        if period_end <= period_start:
+            return jsonify({'message': 'period_end must be after period_start'}), 400
+        
+        batch = create_settlement(period_start, period_end, created_by=current_admin.admin_id)
+        if not batch:
+            return jsonify({'message': 'No unsettled completed bookings in this period'}), 200
         
         return jsonify({
-            'export_data': export_data,
-            'export_type': export_type,
-            'date_range': {
-                'from': date_from.isoformat(),
-                'to': date_to.isoformat()
-            },
-            'total_records': len(export_data)
+            'message': 'Settlement batch created successfully',
+            'batch': batch.to_dict()
+        }), 201
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to create settlement: {str(e)}'}), 500
+
+@financial_bp.route('/financials/settlements', methods=['GET'])
+@token_required
+def get_settlements(current_admin):
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 10))
+        
+        batches = SettlementBatch.query.order_by(desc(SettlementBatch.created_at)).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+        
+        return jsonify({
+            'settlements': [batch.to_dict() for batch in batches.items],
+            'total': batches.total,
+            'pages': batches.pages,
+            'current_page': page,
+            'per_page': per_page
         }), 200
         
     except Exception as e:
-        return jsonify({'message': f'Failed to export financial data: {str(e)}'}), 500
+        return jsonify({'message': f'Failed to fetch settlements: {str(e)}'}), 500
+
+@financial_bp.route('/financials/settlements/<int:batch_id>', methods=['GET'])
+@token_required
+def get_settlement_details(current_admin, batch_id):
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 50))
+        
+        batch = SettlementBatch.query.get_or_404(batch_id)
+        lines = SettlementLine.query.filter_by(batch_id=batch_id).order_by(
+            desc(SettlementLine.balance)
+        ).paginate(page=page, per_page=per_page, error_out=False)
+        
+        batch_data = batch.to_dict()
+        batch_data['lines'] = [line.to_dict() for line in lines.items]
+        batch_data['total_lines'] = lines.total
+        batch_data['pages'] = lines.pages
+        batch_data['current_page'] = page
+        batch_data['per_page'] = per_page
+        
+        return jsonify(batch_data), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch settlement details: {str(e)}'}), 500
+
+@financial_bp.route('/financials/settlements/<int:batch_id>/export', methods=['GET'])
+@token_required
+def export_settlement(current_admin, batch_id):
+    try:
+        SettlementBatch.query.get_or_404(batch_id)
+        
+        return Response(
+            stream_with_context(stream_settlement_csv(batch_id)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=settlement_{batch_id}.csv'}
+        )
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to export settlement: {str(e)}'}), 500
+
+@job_runner.job('payment_reconciliation')
+def run_payment_reconciliation_job(params, progress):
+    run = reconcile_payments(
+        datetime.fromisoformat(params['date_from']),
+        datetime.fromisoformat(params['date_to']),
+        incremental=params.get('incremental', False),
+        resume_run_id=params.get('resume_run_id'),
+        progress=progress
+    )
+    return run.to_dict()
+
+@financial_bp.route('/financials/reconciliation', methods=['POST'])
+@token_required
+def start_payment_reconciliation(current_admin):
+    try:
+        data = request.get_json(silent=True) or {}
+        date_from = data.get('date_from')
+        date_to = data.get('date_to')
+        
+        # Default to the last 30 days
+        date_from = datetime.fromisoformat(date_from) if date_from else datetime.now() - timedelta(days=30)
+        date_to = datetime.fromisoformat(date_to) if date_to else datetime.now()
+        
+        job, created = job_runner.submit('payment_reconciliation', {
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'incremental': bool(data.get('incremental', False)),
+            'resume_run_id': data.get('resume_run_id')
+        }, submitted_by=current_admin.admin_id)
+        
+        return jsonify({
+            'message': 'Reconciliation job submitted' if created else 'Identical reconciliation job already exists',
+            'job': job.to_dict()
+        }), 202
+        
+    except ValueError:
+        return jsonify({'message': 'Invalid date format'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to start reconciliation: {str(e)}'}), 500
+
+@financial_bp.route('/financials/reconciliation', methods=['GET'])
+@token_required
+def get_reconciliation_discrepancies(current_admin):
+    try:
+        kind_filter = request.args.get('kind')
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 10))
+        
+        query = ReconciliationDiscrepancy.query
+        
+        if kind_filter:
+            query = query.filter(ReconciliationDiscrepancy.kind == DiscrepancyType(kind_filter))
+        
+        if date_from:
+            query = query.filter(ReconciliationDiscrepancy.booking_time >= datetime.fromisoformat(date_from))
+        
+        if date_to:
+            query = query.filter(ReconciliationDiscrepancy.booking_time <= datetime.fromisoformat(date_to))
+        
+        discrepancies = query.order_by(desc(ReconciliationDiscrepancy.booking_time)).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+        
+        # Totals per kind for the summary cards
+        summary = dict(db.session.query(
+            ReconciliationDiscrepancy.kind,
+            func.count(ReconciliationDiscrepancy.discrepancy_id)
+        ).group_by(ReconciliationDiscrepancy.kind).all())
+        
+        return jsonify({
+            'discrepancies': [discrepancy.to_dict() for discrepancy in discrepancies.items],
+            'summary': {kind.value: summary.get(kind, 0) for kind in DiscrepancyType},
+            'total': discrepancies.total,
+            'pages': discrepancies.pages,
+            'current_page': page,
+            'per_page': per_page
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch reconciliation discrepancies: {str(e)}'}), 500
+
+@financial_bp.route('/financials/reconciliation/runs', methods=['GET'])
+@token_required
+def get_reconciliation_runs(current_admin):
+    try:
+        limit = int(request.args.get('limit', 20))
+        runs = ReconciliationRun.query.order_by(desc(ReconciliationRun.run_id)).limit(limit).all()
+        return jsonify({'runs': [run.to_dict() for run in runs]}), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch reconciliation runs: {str(e)}'}), 500
+
+def _analytics_range(args):
+    """Timezone and local day range of the snapshot analytics endpoints (default to last 30 days)."""
+    tz_name = reporting_timezone(args.get('tz'))
+    date_to = date.fromisoformat(args['date_to']) if args.get('date_to') else local_today(tz_name)
+    date_from = date.fromisoformat(args['date_from']) if args.get('date_from') else date_to - timedelta(days=29)
+    return tz_name, date_from, date_to
+
+@financial_bp.route('/financials/analytics/commission-distribution', methods=['GET'])
+@token_required
+@admission_controlled('report')
+@single_flight()
+def get_commission_distribution(current_admin):
+    try:
+        tz_name, date_from, date_to = _analytics_range(request.args)
+        bin_width = float(request.args.get('bin_width', 2.5))
+        if not 0 < bin_width <= 50:
+            return jsonify({'message': 'bin_width must be between 0 and 50'}), 400
+        
+        return jsonify(commission_distribution(tz_name, date_from, date_to, bin_width=bin_width)), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch commission distribution: {str(e)}'}), 500
+
+@financial_bp.route('/financials/analytics/revenue-heatmap', methods=['GET'])
+@token_required
+@admission_controlled('report')
+@single_flight()
+def get_revenue_heatmap(current_admin):
+    try:
+        tz_name, date_from, date_to = _analytics_range(request.args)
+        
+        return jsonify(revenue_heatmap(tz_name, date_from, date_to)), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch revenue heatmap: {str(e)}'}), 500
+
+@financial_bp.route('/financials/analytics/earnings-curves', methods=['GET'])
+@token_required
+@admission_controlled('report')
+@single_flight()
+def get_earnings_curves(current_admin):
+    try:
+        tz_name, date_from, date_to = _analytics_range(request.args)
+        captain_ids = [int(value) for value in request.args.get('captain_ids', '').split(',') if value.strip()]
+        limit = min(int(request.args.get('limit', 5)), 50)
+        
+        return jsonify(earnings_curves(tz_name, date_from, date_to, captain_ids=captain_ids, limit=limit)), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch earnings curves: {str(e)}'}), 500
+
+@job_runner.job('analytics_snapshot')
+def run_analytics_snapshot_job(params, progress):
+    return analytics_snapshot.refresh(full=params.get('full', False), progress=progress)
+
+@financial_bp.route('/financials/analytics/snapshot', methods=['GET'])
+@token_required
+def get_analytics_snapshot(current_admin):
+    try:
+        return jsonify({'snapshot': analytics_snapshot.manifest()}), 200
+    
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch analytics snapshot: {str(e)}'}), 500
+
+@financial_bp.route('/financials/analytics/snapshot', methods=['POST'])
+@token_required
+def refresh_analytics_snapshot(current_admin):
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        # Reports refresh the snapshot on their own once it is older than ANALYTICS_SNAPSHOT_MAX_AGE_SECONDS;
+        # the current version is part of the dedupe key, so only refreshes of the same version coalesce
+        manifest = analytics_snapshot.manifest()
+        job, created = job_runner.submit('analytics_snapshot', {
+            'full': bool(data.get('full', False)),
+            'from_version': manifest['version'] if manifest else None
+        }, submitted_by=current_admin.admin_id)
+        
+        return jsonify({
+            'message': 'Snapshot refresh submitted' if created else 'Identical snapshot refresh already exists',
+            'job': job.to_dict()
+        }), 202
+    
+    except Exception as e:
+        return jsonify({'message': f'Failed to refresh analytics snapshot: {str(e)}'}), 500
@@ -0,0 +1,91 @@
+from flask import Blueprint, request, jsonify, send_file
+from src.models.admin_models import db, BackgroundJob, JobStatus
+from src.routes.admin_auth import token_required
+from src.routes.job_runner import job_runner
+from sqlalchemy import desc
+import os
+
+job_bp = Blueprint('job', __name__)
+
+@job_bp.route('/jobs', methods=['POST'])
+@token_required
+def submit_job(current_admin):
+    try:
+        data = request.get_json()
+        job_type = data.get('type')
+        params = data.get('params', {})
+        
+        if not job_type:
+            return jsonify({'message': 'Job type is required'}), 400
+        
+        if job_type not in job_runner.handlers:
+            return jsonify({'message': f'Unknown job type: {job_type}'}), 400
+        
+        job, created = job_runner.submit(job_type, params, submitted_by=current_admin.admin_id)
+        
+        return jsonify({
+            'message': 'Job submitted' if created else 'Identical job already exists',
+            'job': job.to_dict()
+        }), 202
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Failed to submit job: {str(e)}'}), 500
+
+@job_bp.route('/jobs', methods=['GET'])
+@token_required
+def get_jobs(current_admin):
+    try:
+        status_filter = request.args.get('status')
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 10))
+        
+        query = BackgroundJob.query
+        
+        if status_filter:
+            query = query.filter(BackgroundJob.status == JobStatus(status_filter))
+        
+        jobs = query.order_by(desc(BackgroundJob.created_at)).paginate(page=page, per_page=per_page, error_out=False)
+        
+        return jsonify({
+            'jobs': [job.to_dict() for job in jobs.items],
+            'total': jobs.total,
+            'pages': jobs.pages,
+            'current_page': page,
+            'per_page': per_page
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch jobs: {str(e)}'}), 500
+
+@job_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@token_required
+def get_job(current_admin, job_id):
+    try:
+        job = BackgroundJob.query.get_or_404(job_id)
+        return jsonify(job.to_dict()), 200
+    
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch job: {str(e)}'}), 500
+
+@job_bp.route('/jobs/<int:job_id>/download', methods=['GET'])
+@token_required
+def download_job_result(current_admin, job_id):
+    try:
+        job = BackgroundJob.query.get_or_404(job_id)
+        
+        if job.status != JobStatus.COMPLETED:
+            return jsonify({'message': f'Job is not completed (status: {job.status.value})'}), 409
+        
+        if not job.result_path or not os.path.exists(job.result_path):
+            return jsonify({'message': 'Job result is no longer available'}), 410
+        
+        return send_file(
+            job.result_path,
+            mimetype='application/json',
+            as_attachment=True,
+            download_name=f'{job.job_type}_{job.job_id}.json'
+        )
+    
+    except Exception as e:
+        return jsonify({'message': f'Failed to download job result: {str(e)}'}), 500
@@ -0,0 +1,208 @@
+from src.models.admin_models import db, BackgroundJob, JobStatus
+from sqlalchemy import or_, and_, update
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import threading
+import time
+
+ACTIVE_JOB_STATUSES = [JobStatus.QUEUED, JobStatus.RUNNING]
+
+class JobRunner:
+    """Runs heavy reports and exports on a bounded thread pool instead of the request thread.
+    
+    Handlers are registered with `@job_runner.job('name')` and called as
+    `handler(params, progress)`; their JSON-serializable return value is written to
+    a result file that can be downloaded once the job is completed.
+    
+    Jobs live in this process's pool only, so a daemon thread refreshes the
+    heartbeat of the jobs it owns. Queued or running jobs whose heartbeat is
+    older than JOB_STALE_AFTER_SECONDS belonged to a worker that stopped; they
+    are failed at startup and before every submission, so an identical
+    submission starts a new job instead of attaching to the dead one.
+    """
+    
+    def __init__(self, app=None):
+        self.handlers = {}
+        self.app = None
+        self.executor = None
+        self._submit_lock = threading.Lock()
+        self._owned = set()
+        self._owned_lock = threading.Lock()
+        self._heartbeat_thread = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('JOB_WORKERS', 2)
+        app.config.setdefault('JOB_RESULTS_DIR', os.path.join(app.root_path, 'database', 'job_results'))
+        app.config.setdefault('JOB_RESULT_TTL_HOURS', 24)
+        # Completed jobs younger than this are returned for identical submissions
+        app.config.setdefault('JOB_DEDUPE_WINDOW_MINUTES', 10)
+        app.config.setdefault('JOB_HEARTBEAT_SECONDS', 30)
+        app.config.setdefault('JOB_STALE_AFTER_SECONDS', 120)
+        os.makedirs(app.config['JOB_RESULTS_DIR'], exist_ok=True)
+        
+        self.app = app
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config['JOB_WORKERS'],
+            thread_name_prefix='job-runner'
+        )
+        # Jobs left queued or running by a worker that is gone
+        with app.app_context():
+            self.fail_stale_jobs()
+        if self._heartbeat_thread is None:
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+            self._heartbeat_thread.start()
+        app.extensions['job_runner'] = self
+    
+    def job(self, name):
+        def decorator(f):
+            self.handlers[name] = f
+            return f
+        return decorator
+    
+    @staticmethod
+    def normalize_params(params):
+        return json.dumps(params or {}, sort_keys=True, separators=(',', ':'), default=str)
+    
+    def submit(self, job_type, params, submitted_by=None):
+        """Queue a job, or return the existing one when identical parameters are queued, running or recently done."""
+        if job_type not in self.handlers:
+            raise ValueError(f'Unknown job type: {job_type}')
+        
+        self.cleanup_expired()
+        self.fail_stale_jobs()
+        
+        normalized = self.normalize_params(params)
+        params_hash = hashlib.sha256(f'{job_type}:{normalized}'.encode()).hexdigest()
+        
+        # Serialize the check-then-insert so concurrent duplicate submissions in this process share one job
+        with self._submit_lock:
+            reuse_after = datetime.utcnow() - timedelta(minutes=self.app.config['JOB_DEDUPE_WINDOW_MINUTES'])
+            existing = BackgroundJob.query.filter(
+                BackgroundJob.params_hash == params_hash,
+                or_(
+                    BackgroundJob.status.in_(ACTIVE_JOB_STATUSES),
+                    and_(BackgroundJob.status == JobStatus.COMPLETED, BackgroundJob.finished_at >= reuse_after)
+                )
+            ).order_by(BackgroundJob.created_at.desc()).first()
+            if existing:
+                return existing, False
+            
+            job = BackgroundJob(
+                job_type=job_type,
+                params=normalized,
+                params_hash=params_hash,
+                status=JobStatus.QUEUED,
+                progress=0.0,
+                submitted_by=submitted_by,
+                heartbeat_at=datetime.utcnow()
+            )
+            db.session.add(job)
+            db.session.commit()
+        
+        with self._owned_lock:
+            self._owned.add(job.job_id)
+        self.executor.submit(self._run, job.job_id)
+        return job, True
+    
+    def _set_progress(self, job_id, fraction):
+        job = db.session.get(BackgroundJob, job_id)
+        job.progress = max(0.0, min(1.0, fraction))
+        db.session.commit()
+    
+    def _run(self, job_id):
+        with self.app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            if not job or job.status != JobStatus.QUEUED:
+                self._release(job_id)
+                return
+            
+            job.status = JobStatus.RUNNING
+            job.started_at = datetime.utcnow()
+            db.session.commit()
+            
+            try:
+                handler = self.handlers[job.job_type]
+                result = handler(json.loads(job.params), lambda fraction: self._set_progress(job_id, fraction))
+                
+                # Write to a temporary file first so a download never sees a partial result
+                result_path = os.path.join(self.app.config['JOB_RESULTS_DIR'], f'job_{job_id}.json')
+                tmp_path = f'{result_path}.tmp'
+                with open(tmp_path, 'w') as result_file:
+                    json.dump(result, result_file, default=str)
+                os.replace(tmp_path, result_path)
+                
+                job = db.session.get(BackgroundJob, job_id)
+                job.result_path = result_path
+                job.status = JobStatus.COMPLETED
+                job.progress = 1.0
+            except Exception as e:
+                db.session.rollback()
+                job = db.session.get(BackgroundJob, job_id)
+                job.status = JobStatus.FAILED
+                job.error = str(e)
+            finally:
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+                db.session.remove()
+                self._release(job_id)
+    
+    def _release(self, job_id):
+        with self._owned_lock:
+            self._owned.discard(job_id)
+    
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.app.config['JOB_HEARTBEAT_SECONDS'])
+            with self._owned_lock:
+                owned = list(self._owned)
+            with self.app.app_context():
+                try:
+                    if owned:
+                        db.session.execute(update(BackgroundJob.__table__).where(
+                            BackgroundJob.job_id.in_(owned),
+                            BackgroundJob.status.in_(ACTIVE_JOB_STATUSES)
+                        ).values(heartbeat_at=datetime.utcnow()))
+                        db.session.commit()
+                    self.fail_stale_jobs()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Job heartbeat failed')
+                finally:
+                    db.session.remove()
+    
+    def fail_stale_jobs(self):
+        """Mark queued or running jobs whose owning worker stopped heartbeating as failed."""
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=self.app.config['JOB_STALE_AFTER_SECONDS'])
+        result = db.session.execute(update(BackgroundJob.__table__).where(
+            BackgroundJob.status.in_(ACTIVE_JOB_STATUSES),
+            # Jobs from before heartbeats existed only have created_at
+            db.func.coalesce(BackgroundJob.heartbeat_at, BackgroundJob.created_at) < stale_before
+        ).values(status=JobStatus.FAILED, error='Worker stopped before the job finished', finished_at=now))
+        db.session.commit()
+        return result.rowcount
+    
+    def cleanup_expired(self):
+        """Delete result files older than JOB_RESULT_TTL_HOURS and mark their jobs as expired."""
+        cutoff = datetime.utcnow() - timedelta(hours=self.app.config['JOB_RESULT_TTL_HOURS'])
+        expired_jobs = BackgroundJob.query.filter(
+            BackgroundJob.status.in_([JobStatus.COMPLETED, JobStatus.FAILED]),
+            BackgroundJob.finished_at < cutoff
+        ).all()
+        
+        for job in expired_jobs:
+            if job.result_path and os.path.exists(job.result_path):
+                os.remove(job.result_path)
+            job.result_path = None
+            job.status = JobStatus.EXPIRED
+        
+        if expired_jobs:
+            db.session.commit()
+        return len(expired_jobs)
+
+job_runner = JobRunner()
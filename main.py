@@ -4,13 +4,27 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory, jsonify, request
-from src.models.admin_models import db
+from src.models.admin_models import db, CaptainDailyStat
 from src.routes.admin_auth import admin_auth_bp
 from src.routes.captain_routes import captain_bp
 from src.routes.user_routes import user_routes_bp
 from src.routes.booking_routes import booking_bp
 from src.routes.financial_routes import financial_bp
 from src.routes.dashboard_routes import dashboard_bp
+from src.routes.job_routes import job_bp
+from src.routes.job_runner import job_runner
+from src.routes.admin_audit import audit_log
+from src.routes.change_feed import change_feed
+from src.routes.typeahead_index import typeahead
+from src.routes.captain_locations import captain_locations
+from src.routes.booking_snapshot import analytics_snapshot
+from src.routes.scheduled_dispatch import scheduled_dispatcher
+from src.routes.stale_sweeper import stale_sweeper
+from src.routes.read_routing import read_routing
+from src.routes.shared_state import shared_state
+from src.routes.schema_upgrade import upgrade_schema
+from src.routes.captain_ratings import recompute_captain_ratings
+from src.routes.captain_leaderboard import rebuild_captain_daily_stats
 from flask_cors import CORS
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
@@ -26,13 +40,45 @@ app.register_blueprint(user_routes_bp, url_prefix='/api/users')
 app.register_blueprint(booking_bp, url_prefix='/api/bookings')
 app.register_blueprint(financial_bp, url_prefix='/api/financials')
 app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
+app.register_blueprint(job_bp, url_prefix='/api/jobs')
 
 # uncomment if you need to use database
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Cross-worker caches, counters and metrics
+shared_state.init_app(app)
+# Optional replica for GET requests, defaults to a read-only connection to the same file
+app.config['SQLALCHEMY_READ_URI'] = os.environ.get('SQLALCHEMY_READ_URI')
+read_routing.init_app(app)
 db.init_app(app)
+# Change log behind the /changes?since= delta-sync endpoints
+change_feed.init_app(app)
+# Buffered admin_audit_log writer
+audit_log.init_app(app)
 with app.app_context():
+    existing_tables = set(db.inspect(db.engine).get_table_names())
     db.create_all()
+    # Columns and indexes added to existing tables since they were created
+    added_columns = upgrade_schema()
+    if ('captains', 'rating_sum') in added_columns:
+        # The rating aggregates start at 0/0, fill them from the stored ratings before a new rating adjusts them
+        recompute_captain_ratings(restart=True)
+    if CaptainDailyStat.__tablename__ not in existing_tables:
+        # The leaderboard aggregate is only refreshed per changed day, fill it from the stored bookings once
+        rebuild_captain_daily_stats()
+# Prefix indexes behind /captains/suggest and /users/suggest
+typeahead.init_app(app)
+# Latest captain positions behind /bookings/<id>/nearby-captains
+captain_locations.init_app(app)
+
+# Background worker pool for heavy reports and exports
+job_runner.init_app(app)
+# Columnar bookings/payments snapshot for the vectorized financial analytics
+analytics_snapshot.init_app(app)
+# Releases scheduled bookings into the live feed when they are due
+scheduled_dispatcher.init_app(app)
+# Cancels or flags bookings stuck in PENDING/in-progress statuses
+stale_sweeper.init_app(app)
 
 # This route must be placed AFTER all API blueprint registrations
 @app.route('/', defaults={'path': ''})
@@ -0,0 +1,153 @@
+from src.models.admin_models import (
+    db, Booking, Payment, ReconciliationRun, ReconciliationDiscrepancy, ChangeLogEntry,
+    BookingStatus, PaymentStatus, DiscrepancyType
+)
+from sqlalchemy import func, case, select, delete, or_
+from datetime import datetime
+
+# Absolute difference (EGP) tolerated between final_fare and completed payments
+AMOUNT_TOLERANCE = 0.01
+
+def _classify(row):
+    kinds = []
+    if row.completed_count == 0:
+        kinds.append(DiscrepancyType.MISSING_PAYMENT)
+    elif abs((row.final_fare or 0) - (row.paid_amount or 0)) > AMOUNT_TOLERANCE:
+        kinds.append(DiscrepancyType.AMOUNT_MISMATCH)
+    if row.refunded_count:
+        kinds.append(DiscrepancyType.REFUNDED_PAYMENT)
+    if row.failed_count:
+        kinds.append(DiscrepancyType.FAILED_PAYMENT)
+    return kinds
+
+def reconcile_payments(date_from, date_to, incremental=False, chunk_size=5000, resume_run_id=None, progress=None):
+    """Compare completed bookings in [date_from, date_to] with their payments.
+    
+    Bookings are walked in booking_id chunks; each chunk is one grouped LEFT JOIN
+    that returns only the mismatching bookings, so memory is bounded by the chunk.
+    A chunk replaces the discrepancies previously recorded for its bookings and
+    commits with the run checkpoint, so runs are idempotent and resumable.
+    Bookings that still have a discrepancy but are no longer completed are
+    walked too, which closes it.
+    
+    An incremental run builds on the last completed run covering the same or a
+    wider range and only checks bookings logged in change_log after that run
+    started (created, or any status/fare edit) and bookings whose payments were
+    updated since. Without such a run it checks the whole range.
+    """
+    if resume_run_id:
+        run = ReconciliationRun.query.get(resume_run_id)
+        if not run or run.completed:
+            raise ValueError('Only unfinished runs can be resumed')
+        date_from, date_to, incremental = run.date_from, run.date_to, run.incremental
+    else:
+        run = ReconciliationRun(date_from=date_from, date_to=date_to, incremental=incremental, last_booking_id=0)
+        run.started_at = datetime.utcnow()
+        run.max_booking_id = db.session.query(func.max(Booking.booking_id)).scalar() or 0
+        run.head_seq = db.session.query(func.max(ChangeLogEntry.seq)).scalar() or 0
+        db.session.add(run)
+        db.session.commit()
+    
+    base_filters = [
+        Booking.booking_time >= date_from,
+        Booking.booking_time <= date_to,
+        Booking.booking_id <= run.max_booking_id,
+        or_(
+            Booking.status == BookingStatus.COMPLETED,
+            Booking.booking_id.in_(select(ReconciliationDiscrepancy.booking_id))
+        )
+    ]
+    if incremental:
+        previous = ReconciliationRun.query.filter(
+            ReconciliationRun.completed.is_(True),
+            ReconciliationRun.run_id < run.run_id,
+            ReconciliationRun.head_seq.isnot(None),
+            ReconciliationRun.date_from <= date_from,
+            ReconciliationRun.date_to >= date_to
+        ).order_by(ReconciliationRun.run_id.desc()).first()
+        if previous:
+            base_filters.append(or_(
+                Booking.booking_id.in_(select(ChangeLogEntry.entity_id).where(
+                    ChangeLogEntry.resource == 'bookings',
+                    ChangeLogEntry.seq > previous.head_seq
+                )),
+                Booking.booking_id.in_(select(Payment.booking_id).where(
+                    Payment.updated_at >= previous.started_at
+                ))
+            ))
+    
+    total = db.session.query(func.count(Booking.booking_id)).filter(
+        *base_filters, Booking.booking_id > run.last_booking_id
+    ).scalar() or 0
+    done = 0
+    
+    while True:
+        chunk_ids = [row.booking_id for row in db.session.query(Booking.booking_id).filter(
+            *base_filters, Booking.booking_id > run.last_booking_id
+        ).order_by(Booking.booking_id).limit(chunk_size).all()]
+        if not chunk_ids:
+            break
+        chunk_start, chunk_end = chunk_ids[0], chunk_ids[-1]
+        
+        mismatches = db.session.query(
+            Booking.booking_id,
+            Booking.booking_time,
+            Booking.final_fare,
+            func.coalesce(func.sum(case((Payment.status == PaymentStatus.COMPLETED, Payment.amount), else_=0)), 0).label('paid_amount'),
+            func.sum(case((Payment.status == PaymentStatus.COMPLETED, 1), else_=0)).label('completed_count'),
+            func.sum(case((Payment.status == PaymentStatus.REFUNDED, 1), else_=0)).label('refunded_count'),
+            func.sum(case((Payment.status == PaymentStatus.FAILED, 1), else_=0)).label('failed_count'),
+            func.count(Payment.payment_id).label('payment_count')
+        ).outerjoin(
+            Payment, Payment.booking_id == Booking.booking_id
+        ).filter(
+            *base_filters,
+            Booking.status == BookingStatus.COMPLETED,
+            Booking.booking_id >= chunk_start,
+            Booking.booking_id <= chunk_end
+        ).group_by(
+            Booking.booking_id, Booking.booking_time, Booking.final_fare
+        ).having(or_(
+            func.sum(case((Payment.status == PaymentStatus.COMPLETED, 1), else_=0)) == 0,
+            func.abs(func.coalesce(Booking.final_fare, 0) - func.coalesce(
+                func.sum(case((Payment.status == PaymentStatus.COMPLETED, Payment.amount), else_=0)), 0
+            )) > AMOUNT_TOLERANCE,
+            func.sum(case((Payment.status.in_([PaymentStatus.REFUNDED, PaymentStatus.FAILED]), 1), else_=0)) > 0
+        )).all()
+        
+        try:
+            db.session.execute(delete(ReconciliationDiscrepancy.__table__).where(
+                ReconciliationDiscrepancy.booking_id.in_(chunk_ids)
+            ))
+            new_rows = []
+            for row in mismatches:
+                for kind in _classify(row):
+                    new_rows.append({
+                        'run_id': run.run_id,
+                        'booking_id': row.booking_id,
+                        'booking_time': row.booking_time,
+                        'kind': kind,
+                        'expected_amount': row.final_fare,
+                        'paid_amount': float(row.paid_amount or 0),
+                        'payment_count': row.payment_count,
+                        'detected_at': datetime.utcnow()
+                    })
+            if new_rows:
+                db.session.execute(ReconciliationDiscrepancy.__table__.insert(), new_rows)
+            
+            run.last_booking_id = chunk_end
+            run.checked_bookings = (run.checked_bookings or 0) + len(chunk_ids)
+            run.discrepancy_count = (run.discrepancy_count or 0) + len(new_rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        done += len(chunk_ids)
+        if progress and total:
+            progress(done / total)
+    
+    run.completed = True
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+    return run
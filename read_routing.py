@@ -0,0 +1,92 @@
+from flask import current_app, g, request
+from src.routes.shared_state import shared_state
+from sqlalchemy.engine import URL, make_url
+import hashlib
+import sqlite3
+
+READ_BIND_KEY = 'read'
+
+class ReadRouting:
+    """Send the queries of read-only requests to a separate read bind.
+    
+    GET/HEAD requests read through the 'read' bind: SQLALCHEMY_READ_URI (e.g. a
+    replica) when configured, otherwise a read-only connection to the primary
+    SQLite file (mode=ro). Every other request, every flush and every
+    INSERT/UPDATE/DELETE statement uses the primary bind.
+    
+    A request reads from the primary instead when it sends `X-Read-Your-Writes: 1`
+    or `?consistency=strong`, or when the same token made a successful write less
+    than READ_YOUR_WRITES_SECONDS ago on any worker (tracked in the shared state store).
+    
+    Call init_app after shared_state.init_app and before db.init_app, so the bind
+    exists when engines are created.
+    """
+    
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_READ_URI', None)
+        app.config.setdefault('READ_YOUR_WRITES_SECONDS', 5)
+        
+        read_bind = self._read_bind_config(app)
+        if read_bind is not None:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds[READ_BIND_KEY] = read_bind
+            app.config['SQLALCHEMY_BINDS'] = binds
+        
+        app.before_request(self._choose_bind)
+        app.after_request(self._remember_write)
+        app.extensions['read_routing'] = self
+    
+    @staticmethod
+    def _read_bind_config(app):
+        if app.config['SQLALCHEMY_READ_URI']:
+            return app.config['SQLALCHEMY_READ_URI']
+        
+        primary_url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        if primary_url.get_backend_name() != 'sqlite' or not primary_url.database or primary_url.database == ':memory:':
+            return None
+        
+        # A file URI keeps the file-backed QueuePool; a 'sqlite://' URL with a creator would get a
+        # StaticPool, one connection shared by every thread
+        return URL.create('sqlite', database=f'file:{primary_url.database}', query={'mode': 'ro', 'uri': 'true'})
+    
+    @staticmethod
+    def _client_key():
+        token = request.headers.get('Authorization')
+        return hashlib.sha256(token.encode()).hexdigest() if token else None
+    
+    def _choose_bind(self):
+        g.db_route = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+        if request.headers.get('X-Read-Your-Writes') in ('1', 'true'):
+            return
+        if request.args.get('consistency') == 'strong':
+            return
+        
+        client_key = self._client_key()
+        if client_key:
+            try:
+                if shared_state.get(f'recent_write:{client_key}'):
+                    return
+            except sqlite3.Error:
+                # Without the write marker the read could miss this client's own write, use the primary
+                current_app.logger.warning('Shared state unavailable, reading from the primary', exc_info=True)
+                return
+        g.db_route = READ_BIND_KEY
+    
+    def _remember_write(self, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            client_key = self._client_key()
+            if client_key:
+                try:
+                    shared_state.set(f'recent_write:{client_key}', True, ttl=current_app.config['READ_YOUR_WRITES_SECONDS'])
+                except sqlite3.Error:
+                    # The write already committed, don't fail its response over the marker
+                    current_app.logger.warning('Shared state unavailable, write marker not stored', exc_info=True)
+        return response
+
+read_routing = ReadRouting()
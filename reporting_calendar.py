@@ -0,0 +1,103 @@
+from flask import current_app
+from src.models.admin_models import db, CalendarDay
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, date, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DEFAULT_TIMEZONE = 'Africa/Cairo'
+GRANULARITIES = ('day', 'week', 'month')
+
+def reporting_timezone(tz_name=None):
+    """Validate `tz_name` (or the configured default) and return it."""
+    tz_name = tz_name or current_app.config.get('REPORTING_TIMEZONE', DEFAULT_TIMEZONE)
+    try:
+        ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f'Unknown timezone: {tz_name}')
+    return tz_name
+
+def parse_calendar_args(args):
+    """Read the `tz` and `granularity` query parameters shared by the trend endpoints."""
+    granularity = args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'Invalid granularity: {granularity}')
+    return reporting_timezone(args.get('tz')), granularity
+
+def local_today(tz_name):
+    return datetime.now(ZoneInfo(tz_name)).date()
+
+def local_midnight_utc(tz_name, local_date):
+    """UTC instant (naive) of the start of `local_date` in `tz_name`, DST aware."""
+    local_start = datetime(local_date.year, local_date.month, local_date.day, tzinfo=ZoneInfo(tz_name))
+    return local_start.astimezone(timezone.utc).replace(tzinfo=None)
+
+def ensure_calendar(tz_name, start_date, end_date, commit=True):
+    """Insert any missing calendar rows for [start_date, end_date] in `tz_name`.
+    
+    Concurrent first requests for a new day may both find it missing; the insert
+    skips rows another request added in the meantime instead of failing on the
+    (tz, local_date) key, and never rolls back the caller's open transaction.
+    """
+    expected_days = (end_date - start_date).days + 1
+    existing = CalendarDay.query.filter(
+        CalendarDay.tz == tz_name,
+        CalendarDay.local_date >= start_date,
+        CalendarDay.local_date <= end_date
+    ).count()
+    if existing >= expected_days:
+        return 0
+    
+    existing_dates = {row.local_date for row in db.session.query(CalendarDay.local_date).filter(
+        CalendarDay.tz == tz_name,
+        CalendarDay.local_date >= start_date,
+        CalendarDay.local_date <= end_date
+    ).all()}
+    
+    new_days = []
+    current = start_date
+    while current <= end_date:
+        if current not in existing_dates:
+            iso_year, iso_week, iso_weekday = current.isocalendar()
+            new_days.append({
+                'tz': tz_name,
+                'local_date': current,
+                'utc_start': local_midnight_utc(tz_name, current),
+                'utc_end': local_midnight_utc(tz_name, current + timedelta(days=1)),
+                'day_of_week': iso_weekday,
+                'iso_year': iso_year,
+                'iso_week': iso_week,
+                'week_start': current - timedelta(days=iso_weekday - 1),
+                'month_start': date(current.year, current.month, 1)
+            })
+        current += timedelta(days=1)
+    
+    inserted = db.session.execute(
+        sqlite_insert(CalendarDay.__table__).on_conflict_do_nothing(index_elements=['tz', 'local_date']),
+        new_days
+    ).rowcount if new_days else 0
+    if commit:
+        db.session.commit()
+    return max(inserted, 0)
+
+def bucket_column(granularity):
+    return {
+        'day': CalendarDay.local_date,
+        'week': CalendarDay.week_start,
+        'month': CalendarDay.month_start
+    }[granularity]
+
+def bucket_start(granularity, local_date):
+    """First day of the bucket containing `local_date`, matching the keys bucket_column groups by."""
+    if granularity == 'week':
+        return local_date - timedelta(days=local_date.isoweekday() - 1)
+    if granularity == 'month':
+        return local_date.replace(day=1)
+    return local_date
+
+def calendar_join(timestamp_column):
+    """Join condition matching a naive UTC timestamp to the calendar day containing it."""
+    return db.and_(timestamp_column >= CalendarDay.utc_start, timestamp_column < CalendarDay.utc_end)
+
+def local_range_utc(tz_name, start_date, end_date):
+    """Naive UTC [start, end) bounds covering local days start_date..end_date."""
+    return local_midnight_utc(tz_name, start_date), local_midnight_utc(tz_name, end_date + timedelta(days=1))
@@ -0,0 +1,219 @@
+from src.models.admin_models import db, RoutingSession, Booking, BookingStatus, ChangeOperation
+from src.routes.change_feed import record_changes
+from sqlalchemy import event, update, select
+from datetime import datetime, timedelta
+import heapq
+import threading
+import time
+
+def _park_future_booking(mapper, connection, booking):
+    # Bookings far enough in the future stay out of the live feed until the dispatcher releases them
+    dispatcher = scheduled_dispatcher
+    if (dispatcher.lead is not None and booking.scheduled_time is not None
+            and booking.status in (None, BookingStatus.PENDING)
+            and booking.scheduled_time - dispatcher.lead > datetime.utcnow()):
+        booking.status = BookingStatus.SCHEDULED
+
+def _collect_scheduled(session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Booking) and obj.status == BookingStatus.SCHEDULED and obj.scheduled_time is not None:
+            session.info.setdefault('scheduled_bookings', {})[obj.booking_id] = obj.scheduled_time
+
+def _push_committed(session):
+    scheduled = session.info.pop('scheduled_bookings', None)
+    if scheduled:
+        scheduled_dispatcher.push_many(scheduled.items())
+
+def _drop_rolled_back(session):
+    session.info.pop('scheduled_bookings', None)
+
+class ScheduledDispatcher:
+    """Min-heap of SCHEDULED bookings keyed by their release time (scheduled_time - lead).
+    
+    A daemon thread sleeps until the head of the heap is due and then moves the
+    due bookings to PENDING with one guarded UPDATE ... RETURNING, so they show
+    up in /bookings/live. ORM writes push new or rescheduled bookings after
+    commit; the heap keeps one live entry per booking and skips superseded ones.
+    The heap is rebuilt from the (status, scheduled_time) index at startup and
+    every SCHEDULED_DISPATCH_RESYNC_SECONDS, which also parks future PENDING
+    bookings written outside this app. Several workers may run dispatchers; the
+    status guard lets only one of them release a booking.
+    """
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.lead = None
+        self._condition = threading.Condition()
+        self._heap = []
+        self._entries = {}
+        self._thread = None
+        self._next_resync = 0
+        self.released = 0
+        self.last_release_at = None
+        self.last_resync_at = None
+        self.last_error = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        # Scheduled rides enter the live feed this long before their pickup time
+        app.config.setdefault('SCHEDULED_DISPATCH_LEAD_MINUTES', 15)
+        app.config.setdefault('SCHEDULED_DISPATCH_HORIZON_HOURS', 24)
+        app.config.setdefault('SCHEDULED_DISPATCH_RESYNC_SECONDS', 300)
+        app.config.setdefault('SCHEDULED_DISPATCH_ENABLED', True)
+        self.app = app
+        self.lead = timedelta(minutes=app.config['SCHEDULED_DISPATCH_LEAD_MINUTES'])
+        self.horizon = timedelta(hours=app.config['SCHEDULED_DISPATCH_HORIZON_HOURS'])
+        self.resync_seconds = app.config['SCHEDULED_DISPATCH_RESYNC_SECONDS']
+        
+        for target, name, listener in (
+            (Booking, 'before_insert', _park_future_booking),
+            (Booking, 'before_update', _park_future_booking),
+            (RoutingSession, 'after_flush', _collect_scheduled),
+            (RoutingSession, 'after_commit', _push_committed),
+            (RoutingSession, 'after_rollback', _drop_rolled_back)
+        ):
+            if not event.contains(target, name, listener):
+                event.listen(target, name, listener)
+        
+        if app.config['SCHEDULED_DISPATCH_ENABLED'] and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='scheduled-dispatch', daemon=True)
+            self._thread.start()
+        app.extensions['scheduled_dispatcher'] = self
+    
+    def push_many(self, bookings):
+        """Queue (booking_id, scheduled_time) pairs, replacing earlier entries of the same bookings."""
+        horizon_end = datetime.utcnow() + self.horizon
+        with self._condition:
+            head = self._heap[0][0] if self._heap else None
+            for booking_id, scheduled_time in bookings:
+                if scheduled_time - self.lead > horizon_end:
+                    # Picked up by a later resync
+                    self._entries.pop(booking_id, None)
+                    continue
+                self._entries[booking_id] = scheduled_time
+                heapq.heappush(self._heap, (scheduled_time - self.lead, booking_id, scheduled_time))
+            if self._heap and (head is None or self._heap[0][0] < head):
+                # Wake the dispatcher so it sleeps until the new head instead
+                self._condition.notify()
+    
+    def resync(self):
+        """Rebuild the heap from SCHEDULED bookings released within the horizon."""
+        now = datetime.utcnow()
+        parked = db.session.execute(
+            update(Booking).where(
+                Booking.status == BookingStatus.PENDING,
+                Booking.scheduled_time > now + self.lead
+            ).values(
+                status=BookingStatus.SCHEDULED, previous_status=Booking.status, version=Booking.version + 1, updated_at=now
+            ).returning(Booking.booking_id)
+        ).scalars().all()
+        record_changes('bookings', parked, ChangeOperation.UPDATED)
+        db.session.commit()
+        
+        rows = db.session.execute(select(Booking.booking_id, Booking.scheduled_time).where(
+            Booking.status == BookingStatus.SCHEDULED,
+            Booking.scheduled_time <= now + self.lead + self.horizon
+        )).all()
+        heap = [(row.scheduled_time - self.lead, row.booking_id, row.scheduled_time) for row in rows]
+        heapq.heapify(heap)
+        with self._condition:
+            self._heap = heap
+            self._entries = {row.booking_id: row.scheduled_time for row in rows}
+            self._condition.notify()
+        self.last_resync_at = now
+        self._next_resync = time.time() + self.resync_seconds
+        return len(rows)
+    
+    def release_due(self):
+        """Move every due booking to PENDING, returns the released booking ids."""
+        now = datetime.utcnow()
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                _, booking_id, scheduled_time = heapq.heappop(self._heap)
+                if self._entries.get(booking_id) == scheduled_time:
+                    del self._entries[booking_id]
+                    due.append(booking_id)
+        if not due:
+            return []
+        
+        try:
+            # The guard skips bookings cancelled, edited or released by another worker meanwhile
+            released = db.session.execute(
+                update(Booking).where(
+                    Booking.booking_id.in_(due),
+                    Booking.status == BookingStatus.SCHEDULED,
+                    Booking.scheduled_time <= now + self.lead
+                ).values(
+                    status=BookingStatus.PENDING, previous_status=Booking.status, version=Booking.version + 1, updated_at=now
+                ).returning(Booking.booking_id)
+            ).scalars().all()
+            record_changes('bookings', released, ChangeOperation.UPDATED)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        self.released += len(released)
+        if released:
+            self.last_release_at = now
+        return released
+    
+    def _seconds_until_next(self):
+        with self._condition:
+            until_resync = self._next_resync - time.time()
+            if not self._heap:
+                return until_resync
+            return min((self._heap[0][0] - datetime.utcnow()).total_seconds(), until_resync)
+    
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    if time.time() >= self._next_resync:
+                        self.resync()
+                    self.release_due()
+                    self.last_error = None
+                except Exception as e:
+                    self.last_error = str(e)
+                    self.app.logger.exception('Scheduled dispatch failed')
+                    # Retry after a pause rather than spinning on a persistent error
+                    self._next_resync = min(self._next_resync, time.time() + 30)
+                    time.sleep(1)
+                finally:
+                    db.session.remove()
+            with self._condition:
+                timeout = self._seconds_until_next()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+    
+    def upcoming(self, limit=50):
+        with self._condition:
+            entries = heapq.nsmallest(
+                limit, (entry for entry in self._heap if self._entries.get(entry[1]) == entry[2])
+            )
+        return [
+            {
+                'booking_id': booking_id,
+                'scheduled_time': scheduled_time.isoformat(),
+                'release_at': release_at.isoformat()
+            }
+            for release_at, booking_id, scheduled_time in entries
+        ]
+    
+    def stats(self):
+        with self._condition:
+            queued = len(self._entries)
+            next_release = self._heap[0][0].isoformat() if self._heap else None
+        return {
+            'queued': queued,
+            'next_release_at': next_release,
+            'lead_minutes': self.lead.total_seconds() / 60 if self.lead else None,
+            'released': self.released,
+            'last_release_at': self.last_release_at.isoformat() if self.last_release_at else None,
+            'last_resync_at': self.last_resync_at.isoformat() if self.last_resync_at else None,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'last_error': self.last_error
+        }
+
+scheduled_dispatcher = ScheduledDispatcher()
@@ -0,0 +1,50 @@
+from src.models.admin_models import db
+from sqlalchemy import inspect, literal, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.exc import OperationalError
+
+def _column_ddl(column, dialect):
+    """ADD COLUMN clause for a model column; NOT NULL columns take their scalar default for existing rows."""
+    ddl = f'{column.name} {column.type.compile(dialect=dialect)}'
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        value = literal(default, column.type).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+        ddl += f' DEFAULT {value}'
+    if not column.nullable:
+        if default is None:
+            raise RuntimeError(f'Cannot add NOT NULL column {column.table.name}.{column.name} without a scalar default')
+        ddl += ' NOT NULL'
+    return ddl
+
+def upgrade_schema():
+    """Bring tables created by an older release up to the models.
+
+    db.create_all() only creates missing tables, so columns and indexes added
+    to an existing table are applied here: one ALTER TABLE ... ADD COLUMN per
+    missing column and CREATE INDEX IF NOT EXISTS for every model index. Every
+    step checks the live schema first, so it is a no-op on an up-to-date database
+    and safe to run on every start. Returns the (table, column) pairs it added.
+    """
+    added = []
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                try:
+                    connection.execute(text(
+                        f'ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column, connection.dialect)}'
+                    ))
+                    added.append((table.name, column.name))
+                except OperationalError as e:
+                    # Another worker starting at the same time added it first
+                    if 'duplicate column' not in str(e):
+                        raise
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+    return added
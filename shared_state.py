@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class SharedStore:
+    """Key/value store shared by every worker process on the host.
+    
+    Backed by a SQLite file in WAL mode, so readers never block the writer and
+    no external service is needed. Values are JSON, keys can expire, and incr
+    is atomic across processes (it runs under BEGIN IMMEDIATE).
+    """
+    
+    def __init__(self, path, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS shared_kv ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)'
+        )
+    
+    def _connection(self):
+        # One connection per thread and per process, a forked worker must not reuse its parent's
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+    
+    def get(self, key, default=None):
+        row = self._connection().execute(
+            'SELECT value FROM shared_kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+    
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connection().execute(
+            'INSERT INTO shared_kv (key, value, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at',
+            (key, json.dumps(value), expires_at)
+        )
+    
+    def delete(self, key):
+        self._connection().execute('DELETE FROM shared_kv WHERE key = ?', (key,))
+    
+    def incr(self, key, amount=1, ttl=None):
+        """Atomically add `amount` and return the new value.
+        
+        A missing or expired key starts from 0; `ttl` is applied when the key is
+        (re)created, which gives fixed-window counters for rate limiting.
+        """
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT value, expires_at FROM shared_kv WHERE key = ?', (key,)
+            ).fetchone()
+            if row and (row[1] is None or row[1] > now):
+                value = json.loads(row[0]) + amount
+                expires_at = row[1]
+            else:
+                value = amount
+                expires_at = now + ttl if ttl else None
+            connection.execute(
+                'INSERT INTO shared_kv (key, value, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at',
+                (key, json.dumps(value), expires_at)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return value
+    
+    def get_prefix(self, prefix):
+        """All live keys starting with `prefix`, e.g. every counter of one metric family."""
+        rows = self._connection().execute(
+            'SELECT key, value FROM shared_kv WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)',
+            (prefix, prefix + '\uffff', time.time())
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+    
+    def cleanup(self):
+        """Remove expired keys and return how many were deleted."""
+        return self._connection().execute(
+            'DELETE FROM shared_kv WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),)
+        ).rowcount
+
+class SharedState:
+    """Flask extension exposing a SharedStore as app.extensions['shared_state'].
+    
+    A daemon thread removes expired keys every SHARED_STATE_CLEANUP_SECONDS
+    (0 disables it), expired keys are otherwise only hidden from reads.
+    """
+    
+    def __init__(self, app=None):
+        self.store = None
+        self._cleanup_thread = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('SHARED_STATE_PATH', os.path.join(app.root_path, 'database', 'shared_state.db'))
+        app.config.setdefault('SHARED_STATE_CLEANUP_SECONDS', 300)
+        os.makedirs(os.path.dirname(app.config['SHARED_STATE_PATH']), exist_ok=True)
+        self.store = SharedStore(app.config['SHARED_STATE_PATH'])
+        interval = app.config['SHARED_STATE_CLEANUP_SECONDS']
+        if interval and self._cleanup_thread is None:
+            self._cleanup_thread = threading.Thread(
+                target=self._cleanup_loop, args=(app, interval), name='shared-state-cleanup', daemon=True
+            )
+            self._cleanup_thread.start()
+        app.extensions['shared_state'] = self
+    
+    def _cleanup_loop(self, app, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.store.cleanup()
+            except sqlite3.Error:
+                app.logger.exception('Shared state cleanup failed')
+    
+    def __getattr__(self, name):
+        # Delegate get/set/incr/... to the store once the extension is initialized
+        store = self.__dict__.get('store')
+        if store is None:
+            raise RuntimeError('SharedState is not initialized, call init_app first')
+        return getattr(store, name)
+
+shared_state = SharedState()
+
+def record_metric(name, amount=1):
+    """Add to a cross-worker counter; metrics never fail the request that records them."""
+    if shared_state.store is None:
+        return
+    try:
+        shared_state.store.incr(f'metric:{name}', amount)
+    except sqlite3.Error:
+        pass
+
+def metric_totals(prefix):
+    """Cross-worker counters whose name starts with `prefix`, keyed by the rest of the name."""
+    if shared_state.store is None:
+        return {}
+    return {
+        key[len(f'metric:{prefix}'):]: value
+        for key, value in shared_state.store.get_prefix(f'metric:{prefix}').items()
+    }
@@ -0,0 +1,51 @@
+"""Throughput of the shared state store across worker processes.
+
+Run from the project root's parent directory:
+
+    python -m src.routes.shared_state_benchmark --processes 4 --ops 5000
+"""
+from src.routes.shared_state import SharedStore
+from multiprocessing import Pool
+import argparse
+import os
+import tempfile
+import time
+
+def _worker(args):
+    path, operation, ops, worker_id = args
+    store = SharedStore(path)
+    started = time.perf_counter()
+    for i in range(ops):
+        if operation == 'set':
+            store.set(f'bench:{worker_id}:{i % 1000}', {'value': i}, ttl=60)
+        elif operation == 'get':
+            store.get(f'bench:0:{i % 1000}')
+        else:
+            store.incr('bench:counter')
+    return time.perf_counter() - started
+
+def run(processes, ops):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'shared_state_bench.db')
+        SharedStore(path)
+        results = {}
+        with Pool(processes) as pool:
+            for operation in ('set', 'get', 'incr'):
+                started = time.perf_counter()
+                pool.map(_worker, [(path, operation, ops, worker_id) for worker_id in range(processes)])
+                elapsed = time.perf_counter() - started
+                results[operation] = processes * ops / elapsed
+        
+        counter = SharedStore(path).get('bench:counter')
+        expected = processes * ops
+        print(f'processes={processes} ops_per_process={ops}')
+        for operation, throughput in results.items():
+            print(f'{operation:>5}: {throughput:12,.0f} ops/s')
+        print(f'incr counter {counter} (expected {expected}) {"OK" if counter == expected else "LOST UPDATES"}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=5000)
+    arguments = parser.parse_args()
+    run(arguments.processes, arguments.ops)
@@ -0,0 +1,111 @@
+from flask import current_app, request, jsonify, Response
+from src.routes.shared_state import record_metric
+from functools import wraps
+import threading
+
+class SingleFlightTimeout(Exception):
+    pass
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+    
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for it and receive the same result, or the same exception.
+    Nothing is cached once the call finishes.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+    
+    def do(self, key, fn, timeout=None):
+        """Return (result, shared) where shared tells whether another caller computed it."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+        
+        record_metric('single_flight:executions' if leader else 'single_flight:coalesced')
+        
+        if not leader:
+            if not call.done.wait(timeout):
+                raise SingleFlightTimeout(f'Timed out waiting for in-flight call {key[0]}')
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executions': self.executions,
+                'coalesced': self.coalesced
+            }
+
+single_flight_group = SingleFlight()
+
+def _freeze_response(rv):
+    """Turn a view return value into plain data every waiting request can rebuild a response from."""
+    response = current_app.make_response(rv)
+    return response.get_data(), response.status_code, [
+        (name, value) for name, value in response.headers.items() if name.lower() != 'content-length'
+    ]
+
+def single_flight(timeout=30.0):
+    """Share one computation between identical concurrent requests to a view.
+    
+    Requests are identical when they hit the same endpoint with the same view
+    arguments and query string; the admin is not part of the key, so only use
+    this on views whose output does not depend on who asks. Place it below
+    @token_required so every request is still authenticated, and below
+    @admission_controlled so every caller is admitted on its own and one
+    caller's 429/503 rejection is never handed to the others.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_admin, *args, **kwargs):
+            key = (
+                request.endpoint,
+                tuple(sorted(kwargs.items())),
+                tuple(sorted(request.args.items(multi=True)))
+            )
+            try:
+                (data, status, headers), shared = single_flight_group.do(
+                    key,
+                    lambda: _freeze_response(f(current_admin, *args, **kwargs)),
+                    timeout=timeout
+                )
+            except SingleFlightTimeout as e:
+                return jsonify({'message': str(e)}), 504
+            
+            response = Response(data, status=status, headers=headers)
+            if shared:
+                response.headers['X-Single-Flight'] = 'shared'
+            return response
+        return decorated
+    return decorator
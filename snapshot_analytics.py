@@ -0,0 +1,143 @@
+from src.models.admin_models import db, Captain, ServiceType, BookingStatus
+from src.routes.booking_snapshot import analytics_snapshot, enum_code, np
+from src.routes.reporting_calendar import local_range_utc
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+def _local_seconds(utc_seconds, tz_name):
+    """Shift UTC epoch seconds to local wall-clock seconds, DST aware.
+    
+    Offsets are looked up once per distinct UTC hour and broadcast back, so the
+    cost is bounded by the hours spanned rather than the number of rows.
+    """
+    hours, inverse = np.unique(utc_seconds // 3600, return_inverse=True)
+    zone = ZoneInfo(tz_name)
+    offsets = np.array([
+        datetime.fromtimestamp(int(hour) * 3600, tz=timezone.utc).astimezone(zone).utcoffset().total_seconds()
+        for hour in hours
+    ], dtype='int64')
+    return utc_seconds + offsets[inverse]
+
+def snapshot_bookings(tz_name, date_from, date_to, service_type=None, status=BookingStatus.COMPLETED):
+    """Snapshot bookings of local days date_from..date_to as (manifest, columns), any status when status is None."""
+    manifest, tables = analytics_snapshot.ensure_fresh()
+    bookings = tables['bookings']
+    start, end = local_range_utc(tz_name, date_from, date_to)
+    times = bookings['booking_time']
+    mask = (times >= np.datetime64(start, 's')) & (times < np.datetime64(end, 's'))
+    if status is not None:
+        mask &= bookings['status'] == enum_code(status)
+    if service_type is not None:
+        mask &= bookings['service_type'] == enum_code(service_type)
+    return manifest, {name: np.asarray(values[mask]) for name, values in bookings.items()}
+
+def _snapshot_info(manifest):
+    return {
+        'version': manifest['version'],
+        'refreshed_at': datetime.utcfromtimestamp(manifest['refreshed_at']).isoformat(),
+        'rows': manifest['rows']
+    }
+
+def commission_distribution(tz_name, date_from, date_to, bin_width=2.5):
+    """Histogram and percentiles of app_commission / final_fare per service type."""
+    manifest, bookings = snapshot_bookings(tz_name, date_from, date_to)
+    fares = bookings['final_fare']
+    valid = (fares > 0) & ~np.isnan(bookings['app_commission'])
+    percentages = np.clip(bookings['app_commission'][valid] / fares[valid] * 100, 0, 100)
+    services = bookings['service_type'][valid]
+    
+    edges = np.arange(0, 100 + bin_width, bin_width)
+    distribution = {}
+    for code, service_type in enumerate(ServiceType):
+        values = percentages[services == code]
+        if not len(values):
+            continue
+        counts, _ = np.histogram(values, bins=edges)
+        p10, p50, p90 = np.percentile(values, [10, 50, 90])
+        distribution[service_type.value] = {
+            'bookings': int(len(values)),
+            'mean_percentage': round(float(values.mean()), 2),
+            'p10_percentage': round(float(p10), 2),
+            'p50_percentage': round(float(p50), 2),
+            'p90_percentage': round(float(p90), 2),
+            'histogram': [
+                {'from': float(edges[i]), 'to': float(edges[i + 1]), 'count': int(count)}
+                for i, count in enumerate(counts) if count
+            ]
+        }
+    return {'distribution': distribution, 'bin_width': bin_width, 'snapshot': _snapshot_info(manifest)}
+
+def revenue_heatmap(tz_name, date_from, date_to):
+    """Completed-booking revenue and counts by local hour-of-week x service type, one bincount each."""
+    manifest, bookings = snapshot_bookings(tz_name, date_from, date_to)
+    local = _local_seconds(bookings['booking_time'].astype('int64'), tz_name)
+    # 1970-01-01 was a Thursday, shift so Monday is day 0
+    hour_of_week = ((local // 86400 + 3) % 7) * 24 + (local // 3600) % 24
+    service_count = len(ServiceType)
+    keys = hour_of_week * service_count + bookings['service_type'].astype('int64')
+    fares = np.nan_to_num(bookings['final_fare'])
+    revenue = np.bincount(keys, weights=fares, minlength=168 * service_count).reshape(168, service_count)
+    counts = np.bincount(keys, minlength=168 * service_count).reshape(168, service_count)
+    
+    heatmap = {}
+    for code, service_type in enumerate(ServiceType):
+        heatmap[service_type.value] = [
+            {
+                'weekday': WEEKDAYS[hour // 24],
+                'hour': hour % 24,
+                'revenue': round(float(revenue[hour, code]), 2),
+                'bookings': int(counts[hour, code])
+            }
+            for hour in range(168)
+        ]
+    return {'heatmap': heatmap, 'timezone': tz_name, 'snapshot': _snapshot_info(manifest)}
+
+def earnings_curves(tz_name, date_from, date_to, captain_ids=None, limit=5):
+    """Daily and cumulative captain earnings; the top `limit` earners unless captain_ids are given."""
+    manifest, bookings = snapshot_bookings(tz_name, date_from, date_to)
+    has_captain = bookings['captain_id'] >= 0
+    captains = bookings['captain_id'][has_captain]
+    earnings = np.nan_to_num(bookings['captain_earning'][has_captain])
+    local_days = _local_seconds(bookings['booking_time'][has_captain].astype('int64'), tz_name) // 86400
+    
+    captain_values, captain_index = np.unique(captains, return_inverse=True)
+    totals = np.bincount(captain_index, weights=earnings, minlength=len(captain_values))
+    if captain_ids:
+        selected = np.flatnonzero(np.isin(captain_values, captain_ids))
+    else:
+        selected = np.argsort(-totals, kind='stable')[:limit]
+    
+    # Group only the selected captains' rows by (captain, local day)
+    rows = np.isin(captain_index, selected)
+    position = np.full(len(captain_values), -1, dtype='int64')
+    position[selected] = np.arange(len(selected))
+    day_values, day_index = np.unique(local_days[rows], return_inverse=True)
+    daily = np.bincount(
+        position[captain_index[rows]] * len(day_values) + day_index, weights=earnings[rows],
+        minlength=len(selected) * len(day_values)
+    ).reshape(len(selected), len(day_values))
+    cumulative = np.cumsum(daily, axis=1)
+    
+    names = dict(db.session.query(Captain.captain_id, Captain.name).filter(
+        Captain.captain_id.in_([int(captain_values[index]) for index in selected])
+    ).all()) if len(selected) else {}
+    day_labels = [str(np.datetime64(int(day), 'D')) for day in day_values]
+    curves = []
+    for row, index in enumerate(selected):
+        captain_id = int(captain_values[index])
+        curves.append({
+            'captain_id': captain_id,
+            'name': names.get(captain_id),
+            'total_earnings': round(float(totals[index]), 2),
+            'points': [
+                {
+                    'date': day_labels[day],
+                    'earnings': round(float(daily[row, day]), 2),
+                    'cumulative': round(float(cumulative[row, day]), 2)
+                }
+                for day in range(len(day_values)) if daily[row, day]
+            ]
+        })
+    return {'curves': curves, 'timezone': tz_name, 'snapshot': _snapshot_info(manifest)}
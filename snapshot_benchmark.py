@@ -0,0 +1,87 @@
+"""Vectorized snapshot analytics versus the SQL and ORM paths on the configured database.
+
+Run from the project root's parent directory:
+
+    python -m src.routes.snapshot_benchmark --days 365 --repeat 5
+"""
+from src.main import app
+from src.models.admin_models import db, Booking, ArchivedBooking, CalendarDay, BookingStatus
+from src.routes.booking_snapshot import analytics_snapshot
+from src.routes.snapshot_analytics import revenue_heatmap, commission_distribution
+from src.routes.reporting_calendar import reporting_timezone, local_today, ensure_calendar, calendar_join
+from sqlalchemy import func, cast, Integer, select, union_all
+from datetime import timedelta
+import argparse
+import time
+
+def _sql_heatmap(tz_name, date_from, date_to):
+    """Grouped SQL: calendar join for the local day, hour from the offset into that day."""
+    columns = ('booking_time', 'service_type', 'status', 'final_fare')
+    source = union_all(
+        select(*[Booking.__table__.c[name] for name in columns]),
+        select(*[ArchivedBooking.__table__.c[name] for name in columns])
+    ).subquery()
+    hour = cast((func.julianday(source.c.booking_time) - func.julianday(CalendarDay.utc_start)) * 24, Integer)
+    return db.session.query(
+        CalendarDay.day_of_week, hour, source.c.service_type,
+        func.sum(source.c.final_fare), func.count()
+    ).select_from(CalendarDay).join(
+        source, calendar_join(source.c.booking_time)
+    ).filter(
+        CalendarDay.tz == tz_name,
+        CalendarDay.local_date >= date_from,
+        CalendarDay.local_date <= date_to,
+        source.c.status == BookingStatus.COMPLETED
+    ).group_by(CalendarDay.day_of_week, hour, source.c.service_type).all()
+
+def _orm_commissions(date_from, date_to):
+    """Row-by-row ORM loop, the way the existing financial endpoints compute percentages."""
+    percentages = {}
+    for booking in Booking.query.filter(
+        Booking.status == BookingStatus.COMPLETED,
+        Booking.booking_time >= date_from,
+        Booking.booking_time <= date_to + timedelta(days=1)
+    ).all():
+        if booking.final_fare and booking.app_commission:
+            percentages.setdefault(booking.service_type.value, []).append(
+                booking.app_commission / booking.final_fare * 100
+            )
+    return {service: sorted(values)[len(values) // 2] for service, values in percentages.items()}
+
+def _time(label, fn, repeat):
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - started) / repeat * 1000
+    print(f'{label:<34} {elapsed:10.1f} ms')
+    return elapsed
+
+def run(days, repeat):
+    with app.app_context():
+        tz_name = reporting_timezone()
+        date_to = local_today(tz_name)
+        date_from = date_to - timedelta(days=days - 1)
+        ensure_calendar(tz_name, date_from, date_to)
+        
+        started = time.perf_counter()
+        manifest = analytics_snapshot.refresh(full=True)
+        print(f'full snapshot build: {(time.perf_counter() - started) * 1000:.1f} ms, rows {manifest["rows"]}')
+        started = time.perf_counter()
+        analytics_snapshot.refresh()
+        print(f'incremental refresh: {(time.perf_counter() - started) * 1000:.1f} ms')
+        print(f'local days {date_from} .. {date_to}, average of {repeat} runs')
+        
+        sql = _time('revenue heatmap, grouped SQL', lambda: _sql_heatmap(tz_name, date_from, date_to), repeat)
+        vectorized = _time('revenue heatmap, NumPy snapshot', lambda: revenue_heatmap(tz_name, date_from, date_to), repeat)
+        print(f'{"speedup":<34} {sql / vectorized:10.1f} x')
+        orm = _time('commission median, ORM loop', lambda: _orm_commissions(date_from, date_to), repeat)
+        vectorized = _time('commission distribution, NumPy', lambda: commission_distribution(tz_name, date_from, date_to), repeat)
+        print(f'{"speedup":<34} {orm / vectorized:10.1f} x')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+    run(arguments.days, arguments.repeat)
@@ -0,0 +1,204 @@
+from src.models.admin_models import (
+    db, Booking, StaleSweepRun, StaleSweepItem, BookingStatus, ServiceType, SweepAction, ChangeOperation
+)
+from src.routes.captain_leaderboard import refresh_captain_day
+from src.routes.change_feed import record_changes
+from sqlalchemy import insert, or_, update
+from datetime import datetime, timedelta
+import threading
+import time
+
+# Bookings nobody accepted are cancelled; trips a captain already took are only flagged for review
+SWEEP_ACTIONS = {
+    BookingStatus.PENDING: SweepAction.CANCELLED,
+    BookingStatus.ACCEPTED: SweepAction.FLAGGED,
+    BookingStatus.EN_ROUTE: SweepAction.FLAGGED,
+    BookingStatus.ARRIVED: SweepAction.FLAGGED
+}
+# Minutes since booking_time (scheduled_time for scheduled rides) before a booking counts as stale
+DEFAULT_THRESHOLD_MINUTES = {
+    BookingStatus.PENDING: 60,
+    BookingStatus.ACCEPTED: 180,
+    BookingStatus.EN_ROUTE: 240,
+    BookingStatus.ARRIVED: 240
+}
+SERVICE_THRESHOLD_MINUTES = {
+    ServiceType.CROSS_CITY: {BookingStatus.EN_ROUTE: 720, BookingStatus.ARRIVED: 720},
+    ServiceType.BOOK_CAPTAIN: {
+        BookingStatus.ACCEPTED: 720, BookingStatus.EN_ROUTE: 1440, BookingStatus.ARRIVED: 1440
+    }
+}
+
+def stale_thresholds(overrides=None):
+    """{ServiceType: {BookingStatus: minutes}}, `overrides` uses the enum values, e.g. {'CrossCity': {'EnRoute': 600}}."""
+    thresholds = {
+        service_type: {**DEFAULT_THRESHOLD_MINUTES, **SERVICE_THRESHOLD_MINUTES.get(service_type, {})}
+        for service_type in ServiceType
+    }
+    for service_value, minutes_by_status in (overrides or {}).items():
+        for status_value, minutes in minutes_by_status.items():
+            status = BookingStatus(status_value)
+            if status not in SWEEP_ACTIONS:
+                raise ValueError(f'{status_value} bookings are not swept')
+            if int(minutes) < 1:
+                raise ValueError('thresholds must be at least one minute')
+            thresholds[ServiceType(service_value)][status] = int(minutes)
+    return thresholds
+
+def _cutoff_groups(thresholds, now):
+    """(status, cutoff, service types) per distinct threshold, one index range scan each."""
+    groups = {}
+    for service_type, minutes_by_status in thresholds.items():
+        for status, minutes in minutes_by_status.items():
+            groups.setdefault((status, minutes), []).append(service_type)
+    return [
+        (status, now - timedelta(minutes=minutes), service_types)
+        for (status, minutes), service_types in sorted(groups.items(), key=lambda item: list(BookingStatus).index(item[0][0]))
+    ]
+
+def sweep_stale_bookings(thresholds=None, batch_size=500, max_batches=None, triggered_by=None):
+    """Cancel stale PENDING bookings and flag stuck in-progress ones, in bounded batches.
+    
+    Candidates come from the (status, booking_time) index. Each batch is one
+    guarded UPDATE ... WHERE booking_id IN (...) AND status = ? RETURNING, so
+    bookings an admin moved on in the meantime are left alone; the batch, its
+    sweep items and change log rows commit together. The run is only stored
+    once it changed something, so idle periodic sweeps leave no rows.
+    """
+    thresholds = thresholds or stale_thresholds()
+    now = datetime.utcnow()
+    run = StaleSweepRun(
+        thresholds={
+            service_type.value: {status.value: minutes for status, minutes in minutes_by_status.items()}
+            for service_type, minutes_by_status in thresholds.items()
+        },
+        batches=0, cancelled_count=0, flagged_count=0, triggered_by=triggered_by, started_at=now
+    )
+    
+    for status, cutoff, service_types in _cutoff_groups(thresholds, now):
+        action = SWEEP_ACTIONS[status]
+        # Re-checked in the UPDATE, the rows may have changed since they were selected
+        guard = [Booking.status == status]
+        if action == SweepAction.FLAGGED:
+            guard.append(Booking.stale_flagged_at.is_(None))
+        filters = [
+            *guard,
+            Booking.booking_time < cutoff,
+            Booking.service_type.in_(service_types),
+            # Scheduled rides age from their pickup time, not from when they were booked
+            or_(Booking.scheduled_time.is_(None), Booking.scheduled_time < cutoff)
+        ]
+        
+        while max_batches is None or run.batches < max_batches:
+            candidates = {
+                row.booking_id: row
+                for row in db.session.query(
+                    Booking.booking_id, Booking.captain_id, Booking.service_type, Booking.booking_time
+                ).filter(*filters).order_by(Booking.booking_id).limit(batch_size).all()
+            }
+            if not candidates:
+                break
+            
+            values = (
+                {'status': BookingStatus.CANCELLED, 'previous_status': Booking.status}
+                if action == SweepAction.CANCELLED else {'stale_flagged_at': now}
+            )
+            try:
+                swept = db.session.execute(
+                    update(Booking).where(
+                        Booking.booking_id.in_(list(candidates)), *guard
+                    ).values(**values, version=Booking.version + 1, updated_at=now).returning(Booking.booking_id)
+                ).scalars().all()
+                if swept:
+                    if run.run_id is None:
+                        db.session.add(run)
+                        db.session.flush()
+                    db.session.execute(insert(StaleSweepItem.__table__), [
+                        {
+                            'run_id': run.run_id,
+                            'booking_id': booking_id,
+                            'service_type': candidates[booking_id].service_type,
+                            'previous_status': status,
+                            'action': action,
+                            'booking_time': candidates[booking_id].booking_time,
+                            'swept_at': now
+                        }
+                        for booking_id in swept
+                    ])
+                    record_changes('bookings', swept, ChangeOperation.UPDATED)
+                if action == SweepAction.CANCELLED:
+                    # Keep the captain leaderboard aggregate in step with the cancellations
+                    for captain_id, booking_time in {
+                        (candidates[booking_id].captain_id, candidates[booking_id].booking_time) for booking_id in swept
+                    }:
+                        refresh_captain_day(captain_id, booking_time)
+                    run.cancelled_count += len(swept)
+                else:
+                    run.flagged_count += len(swept)
+                run.batches += 1
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+    
+    run.finished_at = datetime.utcnow()
+    if run.run_id is not None:
+        db.session.commit()
+    return run
+
+class StaleSweeper:
+    """Runs sweep_stale_bookings every STALE_SWEEP_INTERVAL_SECONDS on a daemon thread (0 disables it).
+    
+    Thresholds come from STALE_BOOKING_THRESHOLDS, in the override format of
+    stale_thresholds. Several workers may sweep at once; the status guard in
+    the UPDATE keeps a booking from being swept twice.
+    """
+    
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self.last_run_id = None
+        self.last_error = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('STALE_SWEEP_INTERVAL_SECONDS', 600)
+        app.config.setdefault('STALE_SWEEP_BATCH_SIZE', 500)
+        # Bound each periodic sweep, the next one continues with what is left
+        app.config.setdefault('STALE_SWEEP_MAX_BATCHES', 20)
+        app.config.setdefault('STALE_BOOKING_THRESHOLDS', {})
+        self.app = app
+        # Fail at startup on a bad threshold config rather than in the thread
+        stale_thresholds(app.config['STALE_BOOKING_THRESHOLDS'])
+        if app.config['STALE_SWEEP_INTERVAL_SECONDS'] and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='stale-sweeper', daemon=True)
+            self._thread.start()
+        app.extensions['stale_sweeper'] = self
+    
+    def thresholds(self, overrides=None):
+        configured = self.app.config['STALE_BOOKING_THRESHOLDS'] if self.app else {}
+        merged = {service: dict(statuses) for service, statuses in configured.items()}
+        for service, statuses in (overrides or {}).items():
+            merged.setdefault(service, {}).update(statuses)
+        return stale_thresholds(merged)
+    
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['STALE_SWEEP_INTERVAL_SECONDS'])
+            with self.app.app_context():
+                try:
+                    run = sweep_stale_bookings(
+                        self.thresholds(),
+                        batch_size=self.app.config['STALE_SWEEP_BATCH_SIZE'],
+                        max_batches=self.app.config['STALE_SWEEP_MAX_BATCHES']
+                    )
+                    self.last_run_id = run.run_id
+                    self.last_error = None
+                except Exception as e:
+                    self.last_error = str(e)
+                    self.app.logger.exception('Stale booking sweep failed')
+                finally:
+                    db.session.remove()
+
+stale_sweeper = StaleSweeper()
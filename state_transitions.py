@@ -0,0 +1,91 @@
+from flask import request
+from src.models.admin_models import db, Booking, Captain, BookingStatus, CaptainStatus, ChangeOperation
+from src.routes.change_feed import record_changes
+from sqlalchemy import update
+from datetime import datetime
+
+# Allowed status changes, current status -> statuses it may move to
+BOOKING_TRANSITIONS = {
+    BookingStatus.SCHEDULED: {BookingStatus.PENDING, BookingStatus.CANCELLED},
+    BookingStatus.PENDING: {BookingStatus.SCHEDULED, BookingStatus.ACCEPTED, BookingStatus.CANCELLED},
+    # A captain dropping an accepted ride sends it back to PENDING
+    BookingStatus.ACCEPTED: {BookingStatus.PENDING, BookingStatus.EN_ROUTE, BookingStatus.ARRIVED, BookingStatus.CANCELLED},
+    BookingStatus.EN_ROUTE: {BookingStatus.ARRIVED, BookingStatus.COMPLETED, BookingStatus.CANCELLED},
+    BookingStatus.ARRIVED: {BookingStatus.COMPLETED, BookingStatus.CANCELLED},
+    BookingStatus.COMPLETED: {BookingStatus.DISPUTED},
+    BookingStatus.DISPUTED: {BookingStatus.COMPLETED, BookingStatus.CANCELLED},
+    BookingStatus.CANCELLED: set()
+}
+CAPTAIN_TRANSITIONS = {
+    CaptainStatus.PENDING: {CaptainStatus.ACTIVE, CaptainStatus.DEACTIVATED},
+    CaptainStatus.ACTIVE: {CaptainStatus.ON_HOLD, CaptainStatus.DEACTIVATED},
+    CaptainStatus.ON_HOLD: {CaptainStatus.ACTIVE, CaptainStatus.DEACTIVATED},
+    CaptainStatus.DEACTIVATED: {CaptainStatus.ACTIVE, CaptainStatus.ON_HOLD}
+}
+
+class TransitionRejected(Exception):
+    def __init__(self, status_code, reason, current=None):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.current = current
+
+def allowed_sources(transitions, to_status):
+    return [status for status, targets in transitions.items() if to_status in targets]
+
+def _transition(model, resource, transitions, entity_id, to_status, expected_version=None, from_statuses=None, values=None):
+    """Move one row to `to_status` with a single UPDATE ... WHERE id AND status IN AND version RETURNING.
+    
+    `from_statuses` narrows the statuses the table allows the move from, and
+    `expected_version` (the version the client last read) turns the update into
+    a compare-and-set. Only when nothing matched is the row read again, to tell
+    a missing row (404) from a conflicting one (409). Does not commit.
+    """
+    primary_key = db.inspect(model).primary_key[0]
+    sources = allowed_sources(transitions, to_status)
+    if from_statuses is not None:
+        sources = [status for status in sources if status in from_statuses]
+    
+    conditions = [primary_key == entity_id, model.status.in_(sources)]
+    if expected_version is not None:
+        conditions.append(model.version == expected_version)
+    updated = db.session.execute(
+        update(model).where(*conditions).values(
+            # SET expressions read the row as it was, so previous_status and version - 1 describe the replaced state
+            status=to_status, previous_status=model.status, version=model.version + 1, updated_at=datetime.utcnow(),
+            **(values or {})
+        ).returning(model).execution_options(synchronize_session='fetch')
+    ).scalars().first()
+    if updated is not None:
+        record_changes(resource, [entity_id], ChangeOperation.UPDATED)
+        return updated
+    
+    current = db.session.query(model.status, model.version).filter(primary_key == entity_id).first()
+    if current is None:
+        raise TransitionRejected(404, f'{model.__name__} not found')
+    state = {'status': current.status.value, 'version': current.version}
+    if expected_version is not None and current.version != expected_version:
+        raise TransitionRejected(409, f'{model.__name__} was changed by someone else, reload and retry', state)
+    if current.status in sources:
+        # Matched the read but not the update, a concurrent write got in between
+        raise TransitionRejected(409, f'{model.__name__} was changed by someone else, reload and retry', state)
+    if current.status in allowed_sources(transitions, to_status):
+        # Allowed by the table but not by this action, e.g. approving a captain that is not pending
+        expected = ', '.join(status.value for status in sources)
+        raise TransitionRejected(409, f'{model.__name__} is not in {expected} status', state)
+    raise TransitionRejected(409, f'Cannot change status from {current.status.value} to {to_status.value}', state)
+
+def transition_booking(booking_id, to_status, expected_version=None, from_statuses=None, values=None):
+    return _transition(Booking, 'bookings', BOOKING_TRANSITIONS, booking_id, to_status,
+                       expected_version, from_statuses, values)
+
+def transition_captain(captain_id, to_status, expected_version=None, from_statuses=None, values=None):
+    return _transition(Captain, 'captains', CAPTAIN_TRANSITIONS, captain_id, to_status,
+                       expected_version, from_statuses, values)
+
+def expected_version(data):
+    """Version the client last read, from the JSON body or an If-Match header; None skips the check."""
+    version = (data or {}).get('version', request.headers.get('If-Match'))
+    if version is None or version == '':
+        return None
+    return int(str(version).strip('"'))
@@ -0,0 +1,254 @@
+from src.models.admin_models import db, AppUser, Captain, ChangeLogEntry
+from bisect import bisect_left, insort
+from sqlalchemy import func
+import re
+import sys
+import threading
+import time
+import unicodedata
+
+def normalize_text(value):
+    """Lowercase, strip accents and collapse whitespace, so 'Ahmed  Ali' matches 'ahmed ali'."""
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return ' '.join(value.lower().split())
+
+def normalize_phone(value):
+    return re.sub(r'\D', '', value or '')
+
+def normalize_plate(value):
+    return re.sub(r'[\s\-]', '', normalize_text(value))
+
+def normalize_query(value):
+    """Queries made only of digits and phone punctuation are matched as phone digits."""
+    if value and re.fullmatch(r'[\d\s\-\+\(\)]+', value):
+        return normalize_phone(value)
+    return normalize_text(value)
+
+def _name_terms(name):
+    normalized = normalize_text(name)
+    # The full name and every word, so 'ali' finds 'Ahmed Ali' too
+    return {normalized, *normalized.split()} if normalized else set()
+
+def _phone_terms(phone_number):
+    digits = normalize_phone(phone_number)
+    terms = {digits} if digits else set()
+    if digits.startswith('20') and len(digits) > 10:
+        # +20 10... is typed as 010... locally
+        terms.add('0' + digits[2:])
+    return terms
+
+def _email_terms(email):
+    email = normalize_text(email)
+    return {email, email.split('@')[0]} if email else set()
+
+class PrefixIndex:
+    """Sorted (term, entity_id) pairs searched with bisect.
+    
+    A lookup is a binary search plus a scan over the matching run, so it stays
+    well under a millisecond for a few hundred thousand terms. Writes insert
+    into the sorted list, which is fine for the write rate of admin screens.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._terms = {}
+        self._payloads = {}
+    
+    def build(self, items):
+        """Replace the whole index with (entity_id, terms, payload) items."""
+        entries, terms, payloads = [], {}, {}
+        for entity_id, entity_terms, payload in items:
+            terms[entity_id] = entity_terms
+            payloads[entity_id] = payload
+            entries.extend((term, entity_id) for term in entity_terms)
+        entries.sort()
+        with self._lock:
+            self._entries, self._terms, self._payloads = entries, terms, payloads
+    
+    def _remove_locked(self, entity_id):
+        for term in self._terms.pop(entity_id, ()):
+            position = bisect_left(self._entries, (term, entity_id))
+            if position < len(self._entries) and self._entries[position] == (term, entity_id):
+                del self._entries[position]
+        self._payloads.pop(entity_id, None)
+    
+    def upsert(self, entity_id, terms, payload):
+        with self._lock:
+            self._remove_locked(entity_id)
+            for term in terms:
+                insort(self._entries, (term, entity_id))
+            self._terms[entity_id] = terms
+            self._payloads[entity_id] = payload
+    
+    def remove(self, entity_id):
+        with self._lock:
+            self._remove_locked(entity_id)
+    
+    def search(self, prefix, limit=10):
+        """Payloads of the first `limit` entities with a term starting with `prefix`."""
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect_left(self._entries, (prefix,))
+            while position < len(self._entries) and len(results) < limit:
+                term, entity_id = self._entries[position]
+                if not term.startswith(prefix):
+                    break
+                if entity_id not in seen:
+                    seen.add(entity_id)
+                    results.append(self._payloads[entity_id])
+                position += 1
+        return results
+    
+    def stats(self):
+        with self._lock:
+            memory = sys.getsizeof(self._entries) + sys.getsizeof(self._terms) + sys.getsizeof(self._payloads)
+            for entry in self._entries:
+                memory += sys.getsizeof(entry) + sys.getsizeof(entry[0])
+            for terms in self._terms.values():
+                memory += sys.getsizeof(terms)
+            for payload in self._payloads.values():
+                memory += sys.getsizeof(payload) + sum(sys.getsizeof(value) for value in payload.values())
+            return {
+                'entities': len(self._payloads),
+                'terms': len(self._entries),
+                'memory_bytes': memory
+            }
+
+class EntitySuggester:
+    """Prefix index over one model, kept current from the change log.
+    
+    Every lookup first applies change_log entries newer than the last one seen
+    (one indexed query), so writes made by any worker show up in every
+    worker's index.
+    """
+    
+    def __init__(self, resource, model, terms, payload):
+        self.resource = resource
+        self.model = model
+        self._terms = terms
+        self._payload = payload
+        self._primary_key = db.inspect(model).primary_key[0]
+        self.index = PrefixIndex()
+        self.last_seq = 0
+        self.built_at = None
+        self.build_ms = None
+        self._refresh_lock = threading.Lock()
+    
+    def _head_seq(self):
+        return db.session.query(func.max(ChangeLogEntry.seq)).filter(
+            ChangeLogEntry.resource == self.resource
+        ).scalar() or 0
+    
+    def build(self):
+        started = time.perf_counter()
+        # Read the head first, changes made while loading are applied again by the next refresh
+        head = self._head_seq()
+        self.index.build(
+            (getattr(row, self._primary_key.key), self._terms(row), self._payload(row))
+            for row in self.model.query.yield_per(1000)
+        )
+        self.last_seq = head
+        self.built_at = time.time()
+        self.build_ms = round((time.perf_counter() - started) * 1000, 2)
+    
+    def refresh(self):
+        if self.built_at is None:
+            self.build()
+            return
+        with self._refresh_lock:
+            changes = db.session.query(ChangeLogEntry.seq, ChangeLogEntry.entity_id).filter(
+                ChangeLogEntry.resource == self.resource,
+                ChangeLogEntry.seq > self.last_seq
+            ).order_by(ChangeLogEntry.seq).all()
+            if not changes:
+                return
+            
+            entity_ids = {change.entity_id for change in changes}
+            rows = {
+                getattr(row, self._primary_key.key): row
+                for row in self.model.query.filter(self._primary_key.in_(entity_ids)).all()
+            }
+            for entity_id in entity_ids:
+                if entity_id in rows:
+                    self.index.upsert(entity_id, self._terms(rows[entity_id]), self._payload(rows[entity_id]))
+                else:
+                    self.index.remove(entity_id)
+            self.last_seq = changes[-1].seq
+    
+    def suggest(self, query, limit=10):
+        """Return (matches, lookup_ms), the lookup time excludes the change log refresh."""
+        self.refresh()
+        started = time.perf_counter()
+        matches = self.index.search(normalize_query(query), limit)
+        return matches, round((time.perf_counter() - started) * 1000, 3)
+    
+    def stats(self):
+        return {
+            **self.index.stats(),
+            'last_seq': self.last_seq,
+            'build_ms': self.build_ms
+        }
+
+def _captain_terms(captain):
+    terms = _name_terms(captain.name) | _email_terms(captain.email) | _phone_terms(captain.phone_number)
+    plate = normalize_plate(captain.plate_number)
+    if plate:
+        terms.add(plate)
+    return terms
+
+def _captain_payload(captain):
+    return {
+        'captain_id': captain.captain_id,
+        'name': captain.name,
+        'email': captain.email,
+        'phone_number': captain.phone_number,
+        'plate_number': captain.plate_number,
+        'status': captain.status.value if captain.status else None
+    }
+
+def _user_terms(user):
+    return _name_terms(user.name) | _email_terms(user.email) | _phone_terms(user.phone_number)
+
+def _user_payload(user):
+    return {
+        'user_id': user.user_id,
+        'name': user.name,
+        'email': user.email,
+        'phone_number': user.phone_number,
+        'status': user.status.value if user.status else None
+    }
+
+class Typeahead:
+    """Flask extension holding the captain and user suggesters, built at startup.
+    
+    Call init_app after db.init_app and change_feed.init_app.
+    """
+    
+    def __init__(self, app=None):
+        self.suggesters = {
+            'captains': EntitySuggester('captains', Captain, _captain_terms, _captain_payload),
+            'users': EntitySuggester('users', AppUser, _user_terms, _user_payload)
+        }
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('TYPEAHEAD_BUILD_ON_STARTUP', True)
+        if app.config['TYPEAHEAD_BUILD_ON_STARTUP']:
+            with app.app_context():
+                for suggester in self.suggesters.values():
+                    suggester.build()
+        app.extensions['typeahead'] = self
+    
+    def suggest(self, resource, query, limit=10):
+        return self.suggesters[resource].suggest(query, limit)
+    
+    def stats(self):
+        return {resource: suggester.stats() for resource, suggester in self.suggesters.items()}
+
+typeahead = Typeahead()
@@ -0,0 +1,230 @@
+from src.models.admin_models import (
+    db, AppUser, Booking, ArchivedBooking, UserCohortMember, UserActivityMonth, UserCohort,
+    UserCohortRetention, CohortState, CohortType, BookingStatus
+)
+from src.routes.reporting_calendar import reporting_timezone, local_today, local_range_utc
+from sqlalchemy import func, select, insert, update, delete, literal, union_all
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+# A month is final, and never recomputed, this long after it ends, so late bookings still land
+FINALIZE_AFTER = timedelta(days=1)
+COHORT_COLUMNS = {
+    CohortType.SIGNUP: UserCohortMember.signup_month,
+    CohortType.FIRST_BOOKING: UserCohortMember.first_booking_month
+}
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def months_between(start, end):
+    return (end.year - start.year) * 12 + end.month - start.month
+
+def _month_bounds(tz_name, month):
+    return local_range_utc(tz_name, month, add_months(month, 1) - timedelta(days=1))
+
+def _local_month(tz_name, utc_timestamp):
+    return month_start(utc_timestamp.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(tz_name)))
+
+def get_cohort_state():
+    state = CohortState.query.first()
+    if not state:
+        state = CohortState()
+        db.session.add(state)
+        db.session.flush()
+    return state
+
+def _first_month(tz_name):
+    """Local month of the earliest signup or booking, None on an empty database."""
+    candidates = [
+        db.session.query(func.min(AppUser.created_at)).scalar(),
+        db.session.query(func.min(Booking.booking_time)).scalar(),
+        db.session.query(func.min(ArchivedBooking.booking_time)).scalar()
+    ]
+    candidates = [value for value in candidates if value]
+    return _local_month(tz_name, min(candidates)) if candidates else None
+
+def _clear_from(month):
+    """Drop everything materialized for `month` and later, so later months never shadow a recomputed one."""
+    db.session.execute(delete(UserCohortRetention.__table__).where(UserCohortRetention.activity_month >= month))
+    db.session.execute(delete(UserCohort.__table__).where(UserCohort.cohort_month >= month))
+    db.session.execute(update(UserCohortMember.__table__).where(
+        UserCohortMember.first_booking_month >= month
+    ).values(first_booking_month=None))
+    # Members that booked before signing up were added in an earlier month and stay
+    db.session.execute(delete(UserCohortMember.__table__).where(
+        UserCohortMember.signup_month >= month,
+        UserCohortMember.first_booking_month.is_(None)
+    ))
+    db.session.execute(delete(UserActivityMonth.__table__).where(UserActivityMonth.activity_month >= month))
+
+def materialize_month(tz_name, month):
+    """Add one local month: its signups, its active users, and the retention cells it completes.
+    
+    Every step is an indexed set-based statement over that month's users and
+    bookings only, so the cost of a month does not grow with the history
+    before it. Assumes all earlier months are materialized and later ones are not.
+    """
+    start, end = _month_bounds(tz_name, month)
+    month_value = literal(month, db.Date)
+    
+    activity = union_all(*[
+        select(model.user_id).where(
+            model.booking_time >= start,
+            model.booking_time < end,
+            model.status != BookingStatus.CANCELLED
+        )
+        for model in (Booking, ArchivedBooking)
+    ]).subquery()
+    db.session.execute(insert(UserActivityMonth.__table__).from_select(
+        ['user_id', 'activity_month', 'bookings'],
+        select(activity.c.user_id, month_value, func.count()).group_by(activity.c.user_id)
+    ))
+    
+    # Users join at their signup month or, for bookings recorded before the signup, at their first booking
+    members = select(UserCohortMember.user_id)
+    active_ids = select(UserActivityMonth.user_id).where(UserActivityMonth.activity_month == month)
+    early = db.session.query(AppUser.user_id, AppUser.created_at).filter(
+        AppUser.user_id.in_(active_ids),
+        AppUser.created_at >= end,
+        AppUser.user_id.notin_(members)
+    ).all()
+    if early:
+        db.session.execute(insert(UserCohortMember.__table__), [
+            {'user_id': user_id, 'signup_month': _local_month(tz_name, created_at)}
+            for user_id, created_at in early
+        ])
+    db.session.execute(insert(UserCohortMember.__table__).from_select(
+        ['user_id', 'signup_month'],
+        select(AppUser.user_id, month_value).where(
+            AppUser.created_at >= start,
+            AppUser.created_at < end,
+            AppUser.user_id.notin_(members)
+        )
+    ))
+    db.session.execute(update(UserCohortMember.__table__).where(
+        UserCohortMember.first_booking_month.is_(None),
+        UserCohortMember.user_id.in_(active_ids)
+    ).values(first_booking_month=month))
+    
+    cohorts = []
+    cells = []
+    for cohort_type, column in COHORT_COLUMNS.items():
+        size = db.session.query(func.count(UserCohortMember.user_id)).filter(column == month).scalar()
+        if size:
+            cohorts.append({'cohort_type': cohort_type, 'cohort_month': month, 'cohort_size': size})
+        active = db.session.query(column, func.count()).join(
+            UserActivityMonth, UserActivityMonth.user_id == UserCohortMember.user_id
+        ).filter(
+            UserActivityMonth.activity_month == month,
+            column.isnot(None),
+            column <= month
+        ).group_by(column).all()
+        cells.extend(
+            {
+                'cohort_type': cohort_type,
+                'cohort_month': cohort_month,
+                'month_offset': months_between(cohort_month, month),
+                'activity_month': month,
+                'active_users': active_users
+            }
+            for cohort_month, active_users in active
+        )
+    if cohorts:
+        db.session.execute(insert(UserCohort.__table__), cohorts)
+    if cells:
+        db.session.execute(insert(UserCohortRetention.__table__), cells)
+    return len(cells)
+
+def materialize_cohorts(restart=False, progress=None):
+    """Bring the cohort tables up to the current local month.
+    
+    Months up to finalized_through are kept; everything after it, including
+    the month in progress, is recomputed in order, one transaction per month,
+    so an interrupted run resumes after the last finalized month. A change of
+    the reporting timezone or `restart` rebuilds from the first month.
+    """
+    tz_name = reporting_timezone()
+    state = get_cohort_state()
+    if restart or state.tz != tz_name:
+        _clear_from(date.min)
+        state.tz = tz_name
+        state.finalized_through = None
+        state.materialized_through = None
+    
+    first_month = add_months(state.finalized_through, 1) if state.finalized_through else _first_month(tz_name)
+    current_month = month_start(local_today(tz_name))
+    months = []
+    if first_month is not None:
+        month = first_month
+        while month <= current_month:
+            months.append(month)
+            month = add_months(month, 1)
+    
+    try:
+        _clear_from(first_month or current_month)
+        db.session.commit()
+        for index, month in enumerate(months):
+            materialize_month(tz_name, month)
+            if datetime.utcnow() >= _month_bounds(tz_name, month)[1] + FINALIZE_AFTER:
+                state.finalized_through = month
+            state.materialized_through = month
+            db.session.commit()
+            if progress:
+                progress((index + 1) / len(months))
+        state.last_run_at = datetime.utcnow()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {**state.to_dict(), 'months_materialized': len(months)}
+
+def cohort_matrix(cohort_type, max_offset=12, month_from=None, month_to=None):
+    """Precomputed retention matrix; reads only the cohort tables."""
+    state = CohortState.query.first()
+    materialized_through = state.materialized_through if state else None
+    finalized_through = state.finalized_through if state else None
+    
+    query = UserCohort.query.filter(UserCohort.cohort_type == cohort_type)
+    retention = UserCohortRetention.query.filter(
+        UserCohortRetention.cohort_type == cohort_type,
+        UserCohortRetention.month_offset <= max_offset
+    )
+    if month_from:
+        query = query.filter(UserCohort.cohort_month >= month_from)
+        retention = retention.filter(UserCohortRetention.cohort_month >= month_from)
+    if month_to:
+        query = query.filter(UserCohort.cohort_month <= month_to)
+        retention = retention.filter(UserCohortRetention.cohort_month <= month_to)
+    
+    active = {(row.cohort_month, row.month_offset): row.active_users for row in retention.all()}
+    cohorts = []
+    for cohort in query.order_by(UserCohort.cohort_month).all():
+        observed = min(max_offset, months_between(cohort.cohort_month, materialized_through))
+        cells = []
+        for offset in range(observed + 1):
+            active_users = active.get((cohort.cohort_month, offset), 0)
+            activity_month = add_months(cohort.cohort_month, offset)
+            cells.append({
+                'month_offset': offset,
+                'month': activity_month.strftime('%Y-%m'),
+                'active_users': active_users,
+                'share': round(active_users / cohort.cohort_size, 4) if cohort.cohort_size else None,
+                # Still recomputed by the next materialization run
+                'partial': finalized_through is None or activity_month > finalized_through
+            })
+        cohorts.append({
+            'cohort_month': cohort.cohort_month.strftime('%Y-%m'),
+            'cohort_size': cohort.cohort_size,
+            'retention': cells
+        })
+    return {
+        'cohort_type': cohort_type.value,
+        'max_offset': max_offset,
+        'cohorts': cohorts,
+        'state': state.to_dict() if state else None
+    }
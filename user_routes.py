@@ -1,7 +1,14 @@
 from flask import Blueprint, request, jsonify
-from src.models.admin_models import db, AppUser, UserStatus
+from src.models.admin_models import db, AppUser, UserStatus, CohortType
 from src.routes.admin_auth import token_required
+from src.routes.booking_archive import bookings_need_archive, paginate_with_archive
+from src.routes.change_feed import changes_since
+from src.routes.typeahead_index import typeahead
+from src.routes.admin_audit import audit_log, state_of
+from src.routes.user_cohorts import materialize_cohorts, cohort_matrix, get_cohort_state
+from src.routes.job_runner import job_runner
 from sqlalchemy import or_
+from datetime import datetime
 
 user_routes_bp = Blueprint('user_routes', __name__)
 
@@ -43,6 +50,42 @@ def get_users(current_admin):
     except Exception as e:
         return jsonify({'message': f'Failed to fetch users: {str(e)}'}), 500
 
+@user_routes_bp.route('/users/suggest', methods=['GET'])
+@token_required
+def suggest_users(current_admin):
+    try:
+        query = request.args.get('q', '')
+        limit = min(int(request.args.get('limit', 10)), 50)
+        
+        # Served from the in-process prefix index instead of a leading-wildcard ilike scan
+        matches, lookup_ms = typeahead.suggest('users', query, limit)
+        
+        return jsonify({
+            'query': query,
+            'suggestions': matches,
+            'lookup_ms': lookup_ms
+        }), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch user suggestions: {str(e)}'}), 500
+
+@user_routes_bp.route('/users/changes', methods=['GET'])
+@token_required
+def get_user_changes(current_admin):
+    try:
+        since = request.args.get('since')
+        since = int(since) if since else None
+        limit = min(int(request.args.get('limit', 500)), 5000)
+        
+        return jsonify(changes_since('users', since, limit)), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch user changes: {str(e)}'}), 500
+
 @user_routes_bp.route('/users/<int:user_id>', methods=['GET'])
 @token_required
 def get_user_details(current_admin, user_id):
@@ -87,6 +130,7 @@ def update_user_status(current_admin, user_id):
             return jsonify({'message': 'Status is required'}), 400
         
         user = AppUser.query.get_or_404(user_id)
+        before = state_of(user, 'status')
         
         try:
             user.status = UserStatus(new_status)
@@ -94,6 +138,7 @@ def update_user_status(current_admin, user_id):
             return jsonify({'message': 'Invalid status value'}), 400
         
         db.session.commit()
+        audit_log.record('user.status', 'user', user_id, before, state_of(user, 'status'))
         
         return jsonify({
             'message': 'User status updated successfully',
@@ -111,10 +156,27 @@ def get_user_bookings(current_admin, user_id):
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
         
-        from src.models.admin_models import Booking
-        bookings = Booking.query.filter_by(user_id=user_id).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        date_from = datetime.fromisoformat(date_from) if date_from else None
+        date_to = datetime.fromisoformat(date_to) if date_to else None
+        
+        from src.models.admin_models import Booking, ArchivedBooking
+        query = Booking.query.filter_by(user_id=user_id)
+        archived_query = ArchivedBooking.query.filter_by(user_id=user_id)
+        if date_from:
+            query = query.filter(Booking.booking_time >= date_from)
+            archived_query = archived_query.filter(ArchivedBooking.booking_time >= date_from)
+        if date_to:
+            query = query.filter(Booking.booking_time <= date_to)
+            archived_query = archived_query.filter(ArchivedBooking.booking_time <= date_to)
+        
+        if bookings_need_archive(date_from):
+            bookings = paginate_with_archive(query, archived_query, page, per_page)
+        else:
+            bookings = query.paginate(
+                page=page, per_page=per_page, error_out=False
+            )
         
         return jsonify({
             'bookings': [booking.to_dict() for booking in bookings.items],
@@ -145,3 +207,52 @@ def get_users_stats(current_admin):
         
     except Exception as e:
         return jsonify({'message': f'Failed to fetch user statistics: {str(e)}'}), 500
+
+@job_runner.job('user_cohorts')
+def run_user_cohorts_job(params, progress):
+    return materialize_cohorts(restart=params.get('restart', False), progress=progress)
+
+@user_routes_bp.route('/users/analytics/cohorts', methods=['GET'])
+@token_required
+def get_user_cohorts(current_admin):
+    try:
+        cohort_type = CohortType(request.args.get('cohort_type', CohortType.SIGNUP.value))
+        months = int(request.args.get('months', 12))
+        if months < 1 or months > 120:
+            return jsonify({'message': 'months must be between 1 and 120'}), 400
+        month_from = request.args.get('month_from')
+        month_to = request.args.get('month_to')
+        month_from = datetime.strptime(month_from, '%Y-%m').date() if month_from else None
+        month_to = datetime.strptime(month_to, '%Y-%m').date() if month_to else None
+        
+        # Served from the materialized cohort tables, refreshed by the user_cohorts job
+        return jsonify(cohort_matrix(cohort_type, months, month_from, month_to)), 200
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to fetch user cohorts: {str(e)}'}), 500
+
+@user_routes_bp.route('/users/analytics/cohorts/refresh', methods=['POST'])
+@token_required
+def refresh_user_cohorts(current_admin):
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        # The state is part of the dedupe key, so a finished run does not swallow the next one
+        state = get_cohort_state().to_dict()
+        db.session.commit()
+        job, created = job_runner.submit('user_cohorts', {
+            'restart': bool(data.get('restart', False)),
+            'state': state
+        }, submitted_by=current_admin.admin_id)
+        
+        return jsonify({
+            'message': 'Cohort materialization submitted' if created else 'Identical cohort materialization already exists',
+            'job': job.to_dict()
+        }), 202
+    
+    except ValueError as e:
+        return jsonify({'message': f'Invalid parameter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': f'Failed to submit cohort materialization: {str(e)}'}), 500